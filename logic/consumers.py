@@ -1,13 +1,26 @@
+import asyncio
 import logging
+import time
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
-from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
 
-from .models import Message, Friend
+from .models import Message
+from .redis_positions import GEO_MAX_LAT, WRITE_MIN_MOVE_METERS, aupdate_actor_position
+from .utils.map_feed import parse_bbox, parse_zoom, acollect_map_items, diff_map_items, actor_to_map_item
+from .utils.clustering import CLUSTER_MAX_ZOOM
+from .utils.aoi import cells_for_bbox, cell_group, bbox_contains, publish_positions
+from .utils.message_buffer import message_buffer
+from .utils.chat_cache import aget_recipient
+from .utils import delivery, presence
+from .utils.unread import apublish_new_message
 
-User = get_user_model()
 logger = logging.getLogger(__name__)
 
+# How long a chat connection reuses a recipient lookup; block changes
+# invalidate it earlier via chat.blocks_changed.
+RECIPIENT_CACHE_SECONDS = 60
+# Same limit as api_chat_send.
+MESSAGE_MAX_LENGTH = 2000
+
 
 class DirectChatConsumer(AsyncJsonWebsocketConsumer):
     """
@@ -22,16 +35,28 @@ class DirectChatConsumer(AsyncJsonWebsocketConsumer):
             return
 
         self.group = f"user_{self.user.id}"
+        # to_id -> (username or None, blocked, expires_at), see _check_recipient.
+        self.recipients = {}
         await self.channel_layer.group_add(self.group, self.channel_name)
 
         await self.accept()
 
+        try:
+            seq = await delivery.aget_seq(self.user.id)
+        except Exception as e:
+            logger.warning(f"Error reading delivery seq: {e}")
+            seq = None
+
+        # Clients compare seq with the last one they saw and send "sync".
         await self.send_json({
             "type": "connection.ack",
             "user_id": self.user.id,
-            "username": self.user.username
+            "username": self.user.username,
+            "seq": seq
         })
 
+        await self._touch_presence()
+
     async def disconnect(self, code):
         if hasattr(self, "group"):
             try:
@@ -39,19 +64,73 @@ class DirectChatConsumer(AsyncJsonWebsocketConsumer):
             except Exception as e:
                 logger.warning(f"Error discarding from group: {e}")
 
+            try:
+                if await presence.aleave(self.user.id, self.channel_name):
+                    await presence.apublish_presence(self.user.id, False)
+            except Exception as e:
+                logger.warning(f"Error updating presence: {e}")
+
+    async def _touch_presence(self):
+        try:
+            if await presence.atouch(self.user.id, self.channel_name):
+                await presence.apublish_presence(self.user.id, True)
+        except Exception as e:
+            logger.warning(f"Error updating presence: {e}")
+
     async def receive_json(self, content, **kwargs):
         msg_type = content.get("type")
 
         if msg_type == "message.send":
             await self._send_message(content)
         elif msg_type == "ping":
+            # Pings double as presence heartbeats.
+            await self._touch_presence()
             await self.send_json({"type": "pong"})
+        elif msg_type == "sync":
+            await self._catch_up(content)
+        elif msg_type == "delivered":
+            await self._ack_delivered(content)
         else:
             await self.send_json({"type": "error", "error": "UNKNOWN_TYPE"})
 
+    async def _catch_up(self, content):
+        """Replay queued message.new events after seq `since` (see utils.delivery)."""
+        try:
+            since = int(content.get("since"))
+        except (TypeError, ValueError):
+            return await self.send_json({"type": "error", "error": "BAD_SINCE"})
+
+        try:
+            events, seq, complete = await delivery.aget_since(self.user.id, since)
+        except Exception as e:
+            logger.warning(f"Error reading catch-up queue: {e}")
+            return await self.send_json({
+                "type": "message.error",
+                "error": "SYNC_FAILED"
+            })
+
+        await self.send_json({
+            "type": "sync",
+            "events": events,
+            "seq": seq,
+            "complete": complete
+        })
+
+    async def _ack_delivered(self, content):
+        try:
+            seq = int(content.get("seq"))
+        except (TypeError, ValueError):
+            return await self.send_json({"type": "error", "error": "BAD_SEQ"})
+
+        try:
+            await delivery.aack(self.user.id, seq)
+        except Exception as e:
+            logger.warning(f"Error acknowledging delivery: {e}")
+
     async def _send_message(self, content):
         to_id = content.get("to")
-        text = (content.get("text") or content.get("content") or "").strip()
+        # Postgres text cannot hold NUL bytes.
+        text = (content.get("text") or content.get("content") or "").replace("\x00", "").strip()
 
         if not to_id or not text:
             return await self.send_json({
@@ -59,6 +138,12 @@ class DirectChatConsumer(AsyncJsonWebsocketConsumer):
                 "error": "MISSING_TO_OR_TEXT"
             })
 
+        if len(text) > MESSAGE_MAX_LENGTH:
+            return await self.send_json({
+                "type": "message.error",
+                "error": "MESSAGE_TOO_LONG"
+            })
+
         try:
             to_id = int(to_id)
         except (TypeError, ValueError):
@@ -67,7 +152,7 @@ class DirectChatConsumer(AsyncJsonWebsocketConsumer):
                 "error": "BAD_TO_ID"
             })
 
-        result = await self._create_message(self.user.id, to_id, text)
+        result = await self._check_recipient(self.user.id, to_id)
 
         if "error" in result:
             return await self.send_json({
@@ -75,64 +160,315 @@ class DirectChatConsumer(AsyncJsonWebsocketConsumer):
                 "error": result["error"]
             })
 
-        msg_data = result["message"]
+        # Saved by the write-behind buffer together with other senders'
+        # messages; only acked and delivered once it is in the database.
+        try:
+            msg = await message_buffer.add(Message(sender_id=self.user.id, receiver_id=to_id, content=text))
+        except Exception as e:
+            logger.warning(f"Error saving chat message: {e}")
+            return await self.send_json({
+                "type": "message.error",
+                "ref": content.get("ref"),
+                "error": "SEND_FAILED"
+            })
+
         payload = {
-            "id": msg_data["id"],
-            "sender_id": msg_data["sender_id"],
-            "sender_name": msg_data["sender_name"],
-            "receiver_id": msg_data["receiver_id"],
-            "receiver_name": msg_data["receiver_name"],
-            "content": msg_data["content"],
-            "time": msg_data["time"],
+            "id": msg.id,
+            "sender_id": self.user.id,
+            "sender_name": self.user.username,
+            "receiver_id": to_id,
+            "receiver_name": result["receiver_name"],
+            "content": text,
+            "time": msg.created_at.isoformat(),
         }
 
+        await self.send_json({
+            "type": "message.ack",
+            "ref": content.get("ref"),
+            "message": payload,
+        })
+
+        try:
+            seq = await delivery.aenqueue(to_id, {"type": "message.new", "message": payload})
+        except Exception as e:
+            logger.warning(f"Error queueing message for catch-up: {e}")
+            seq = None
+
         # Send to receiver's group
         try:
             await self.channel_layer.group_send(
-                f"user_{msg_data['receiver_id']}",
-                {"type": "chat.message", "message": payload}
+                f"user_{to_id}",
+                {"type": "chat.message", "message": payload, "seq": seq}
             )
         except Exception as e:
             logger.warning(f"Error sending to receiver: {e}")
 
-    @database_sync_to_async
-    def _create_message(self, from_id, to_id, text):
         try:
-            sender = User.objects.get(id=from_id)
-            receiver = User.objects.get(id=to_id)
-        except User.DoesNotExist:
-            return {"error": "USER_NOT_FOUND"}
+            await apublish_new_message(
+                self.user.id, self.user.username, to_id, result["receiver_name"],
+                text, payload["time"],
+            )
+        except Exception as e:
+            logger.warning(f"Error updating unread counters: {e}")
 
-        if sender.id == receiver.id:
+    async def _check_recipient(self, from_id, to_id):
+        if from_id == to_id:
             return {"error": "CANNOT_MESSAGE_SELF"}
 
-        # Check if blocked (using Friend model with status='blocked')
-        if Friend.objects.filter(user=receiver, friend=sender, status='blocked').exists():
-            return {"error": "BLOCKED_BY_USER"}
+        cached = self.recipients.get(to_id)
+        if cached is None or cached[2] <= time.monotonic():
+            name, blocked = await aget_recipient(from_id, to_id)
+            cached = self.recipients[to_id] = (name, blocked, time.monotonic() + RECIPIENT_CACHE_SECONDS)
+        name, blocked, _ = cached
 
-        # Create and save the message
-        msg = Message.objects.create(
-            sender=sender,
-            receiver=receiver,
-            content=text
-        )
+        if name is None:
+            return {"error": "USER_NOT_FOUND"}
 
-        # Return serializable data instead of model object
-        return {
-            "message": {
-                "id": msg.id,
-                "sender_id": msg.sender_id,
-                "sender_name": sender.username,
-                "receiver_id": msg.receiver_id,
-                "receiver_name": receiver.username,
-                "content": msg.content,
-                "time": msg.created_at.isoformat(),
-            }
-        }
+        # Receiver has blocked the sender
+        if blocked:
+            return {"error": "BLOCKED_BY_USER"}
+
+        return {"receiver_name": name}
 
     async def chat_message(self, event):
         """Handler for messages sent via channel layer"""
         await self.send_json({
             "type": "message.new",
-            "message": event["message"]
+            "message": event["message"],
+            "seq": event.get("seq")
         })
+
+    async def chat_thread_updated(self, event):
+        """Handler for new messages in one of the user's threads (see utils.unread)"""
+        await self.send_json({
+            "type": "thread.updated",
+            "thread": event["thread"],
+            "total_unread": event.get("total_unread")
+        })
+
+    async def chat_unread_changed(self, event):
+        """Handler for a thread being marked read (see utils.unread)"""
+        await self.send_json({
+            "type": "unread.changed",
+            "user_id": event["user_id"],
+            "unread": event["unread"],
+            "total_unread": event["total_unread"]
+        })
+
+    async def presence_changed(self, event):
+        """Handler for friends going online/offline (see utils.presence)"""
+        await self.send_json({
+            "type": "presence",
+            "user_id": event["user_id"],
+            "online": event["online"]
+        })
+
+    async def chat_blocks_changed(self, event):
+        """Drop cached recipients whose block lists changed (see chat_cache.invalidate_blocks)."""
+        for user_id in event.get("user_ids", []):
+            self.recipients.pop(user_id, None)
+
+
+POSITION_TICK_SECONDS = 1.0
+POSITION_WRITE_MIN_INTERVAL = 1.0
+# In AOI push mode, reconcile with a full snapshot every N ticks to pick
+# up expired and departed actors.
+POSITION_RESYNC_TICKS = 10
+
+
+class PositionConsumer(AsyncJsonWebsocketConsumer):
+    """
+    WebSocket consumer for live avatar positions.
+
+    Clients send their own position ("position.update") and camera view
+    ("view.set" with bbox/zoom). Once a view is set the server pushes
+    "positions.delta" events with added/changed/removed items at most every
+    POSITION_TICK_SECONDS, and only when something changed. Full snapshots
+    also carry "truncated", true when the search limit cut them off.
+
+    For small views the consumer joins the AOI cell groups covering the
+    view and forwards published moves, taking a full snapshot only every
+    POSITION_RESYNC_TICKS and whenever the view changes. Larger or
+    clustered views poll a snapshot on every tick.
+    """
+
+    async def connect(self):
+        self.user = self.scope.get("user")
+        if not self.user or self.user.is_anonymous:
+            await self.close(code=4001)
+            return
+
+        self.bbox = None
+        self.zoom = None
+        self.snapshot = {}
+        # Whether the last full snapshot was cut off at the search limit.
+        self.truncated = False
+        self.pending = {}
+        self.cells = set()
+        self.last_write = 0.0
+        self.tick_task = None
+        # Serializes pushes from the tick loop and from view changes.
+        self.push_lock = asyncio.Lock()
+
+        await self.accept()
+
+        await self.send_json({
+            "type": "connection.ack",
+            "user_id": self.user.id,
+        })
+
+    async def disconnect(self, code):
+        task = getattr(self, "tick_task", None)
+        if task:
+            task.cancel()
+        if getattr(self, "cells", None):
+            await self._set_cells(set())
+
+    async def receive_json(self, content, **kwargs):
+        msg_type = content.get("type")
+
+        if msg_type == "position.update":
+            await self._update_position(content)
+        elif msg_type == "view.set":
+            await self._set_view(content)
+        elif msg_type == "ping":
+            await self.send_json({"type": "pong"})
+        else:
+            await self.send_json({"type": "error", "error": "UNKNOWN_TYPE"})
+
+    async def _update_position(self, content):
+        now = time.monotonic()
+        if now - self.last_write < POSITION_WRITE_MIN_INTERVAL:
+            return
+
+        try:
+            lat = float(content.get("lat"))
+            lon = float(content.get("lon"))
+            alt = float(content["alt"]) if content.get("alt") is not None else 0.0
+        except (TypeError, ValueError):
+            return await self.send_json({"type": "error", "error": "BAD_COORDS"})
+
+        if not (-GEO_MAX_LAT <= lat <= GEO_MAX_LAT and -180.0 <= lon <= 180.0):
+            return await self.send_json({"type": "error", "error": "OUT_OF_RANGE"})
+
+        self.last_write = now
+        name = self.user.username or self.user.email or ""
+        written = await aupdate_actor_position(
+            actor_type="user",
+            actor_id=self.user.id,
+            lat=lat,
+            lon=lon,
+            alt=alt,
+            name=name,
+            min_move_m=WRITE_MIN_MOVE_METERS,
+        )
+        if written:
+            await publish_positions([actor_to_map_item({
+                "type": "user",
+                "id": self.user.id,
+                "lat": lat,
+                "lon": lon,
+                "alt": alt,
+                "name": name,
+            })])
+
+    async def _set_view(self, content):
+        try:
+            bbox = parse_bbox(content.get("bbox"))
+            zoom = parse_zoom(content.get("zoom"))
+        except (TypeError, ValueError):
+            return await self.send_json({"type": "error", "error": "BAD_VIEW"})
+
+        cells = None
+        if bbox and (zoom is None or zoom >= CLUSTER_MAX_ZOOM):
+            cells = cells_for_bbox(bbox)
+        cells = cells or set()
+        changed = (bbox, zoom, cells) != (self.bbox, self.zoom, self.cells)
+        self.bbox = bbox
+        self.zoom = zoom
+        await self._set_cells(cells)
+
+        if self.tick_task is None:
+            self.tick_task = asyncio.ensure_future(self._tick_loop())
+        elif changed:
+            # Idle actors in the new view never publish moves, so send the
+            # full snapshot now rather than at the next resync.
+            try:
+                await self._push_delta()
+            except Exception as e:
+                logger.warning(f"Error pushing position delta: {e}")
+
+    async def _set_cells(self, cells):
+        """Join/leave AOI cell groups so exactly `cells` are subscribed."""
+        for cell in self.cells - cells:
+            await self.channel_layer.group_discard(cell_group(cell), self.channel_name)
+        for cell in cells - self.cells:
+            await self.channel_layer.group_add(cell_group(cell), self.channel_name)
+        self.cells = cells
+
+    async def position_moved(self, event):
+        """Handler for AOI cell broadcasts; buffered until the next tick."""
+        if not self.bbox:
+            return
+        me_id_str = str(self.user.id)
+        for item in event["items"]:
+            if item["type"] == "user" and item["id"] == me_id_str:
+                continue
+            if bbox_contains(self.bbox, item["lat"], item["lon"]):
+                self.pending[item["id"]] = item
+            elif item["id"] in self.snapshot or item["id"] in self.pending:
+                # Moved out of the view; None marks it for removal.
+                self.pending[item["id"]] = None
+
+    async def _tick_loop(self):
+        tick = 0
+        while True:
+            try:
+                if self.cells and tick % POSITION_RESYNC_TICKS:
+                    await self._flush_pending()
+                else:
+                    await self._push_delta()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Error pushing position delta: {e}")
+            tick += 1
+            await asyncio.sleep(POSITION_TICK_SECONDS)
+
+    async def _flush_pending(self):
+        async with self.push_lock:
+            if not self.pending:
+                return
+
+            pending, self.pending = self.pending, {}
+            items = dict(self.snapshot)
+            for item_id, item in pending.items():
+                if item is None:
+                    items.pop(item_id, None)
+                else:
+                    items[item_id] = item
+            added, changed, removed, self.snapshot = diff_map_items(self.snapshot, list(items.values()))
+
+            if added or changed or removed:
+                await self.send_json({
+                    "type": "positions.delta",
+                    "added": added,
+                    "changed": changed,
+                    "removed": removed,
+                })
+
+    async def _push_delta(self):
+        async with self.push_lock:
+            self.pending = {}
+            items, truncated = await acollect_map_items(self.user.id, bbox=self.bbox, zoom=self.zoom)
+            added, changed, removed, self.snapshot = diff_map_items(self.snapshot, items)
+
+            if added or changed or removed or truncated != self.truncated:
+                self.truncated = truncated
+                await self.send_json({
+                    "type": "positions.delta",
+                    "added": added,
+                    "changed": changed,
+                    "removed": removed,
+                    "truncated": truncated,
+                })
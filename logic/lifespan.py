@@ -0,0 +1,20 @@
+import logging
+
+from .utils.message_buffer import message_buffer
+
+logger = logging.getLogger(__name__)
+
+
+async def lifespan_app(scope, receive, send):
+    """ASGI lifespan handler: save buffered chat messages before the worker exits."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            try:
+                await message_buffer.drain()
+            except Exception as e:
+                logger.error(f"Error saving buffered chat messages at shutdown: {e}")
+            await send({"type": "lifespan.shutdown.complete"})
+            return
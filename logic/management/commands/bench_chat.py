@@ -0,0 +1,267 @@
+import asyncio
+import json
+import multiprocessing
+import queue
+import random
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django_redis import get_redis_connection
+
+from logic.utils import chat_cache, delivery, presence, unread
+from logic.utils.bench_stats import percentile, redis_calls
+from logic.utils.friend_graph import generation_key, graph_keys
+
+BENCH_USER_PREFIX = "bench_chat_"
+# Concurrent handshakes per worker while opening sockets.
+CONNECT_CONCURRENCY = 200
+# How long a worker may take to connect its sockets or to shut down.
+WORKER_TIMEOUT_SECONDS = 300
+
+
+def _latency_summary(name, seconds):
+    ms = sorted(v * 1000.0 for v in seconds)
+    return {
+        "metric": name,
+        "count": len(ms),
+        "p50_ms": percentile(ms, 50),
+        "p95_ms": percentile(ms, 95),
+        "p99_ms": percentile(ms, 99),
+        "max_ms": ms[-1] if ms else 0.0,
+    }
+
+
+async def _worker_main(users, peer_ids, options, run_id, go, ready):
+    from channels.testing import WebsocketCommunicator
+
+    from logic.consumers import DirectChatConsumer
+
+    result = {
+        "connect": [], "ack": [], "delivery": [],
+        "sent": 0, "acked": 0, "errors": 0, "received": 0, "connect_failures": 0,
+    }
+    app = DirectChatConsumer.as_asgi()
+    sockets = []
+    gate = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def open_socket(user):
+        async with gate:
+            c = WebsocketCommunicator(app, "/ws/chat/")
+            c.scope["user"] = user
+            t0 = time.perf_counter()
+            connected, _ = await c.connect(timeout=30)
+            if not connected:
+                result["connect_failures"] += 1
+                return
+            await c.receive_json_from(timeout=30)  # connection.ack
+            result["connect"].append(time.perf_counter() - t0)
+            sockets.append(c)
+
+    async def read(c):
+        # receive_json_from cancels the consumer on timeout, so wait long
+        # and stop by cancelling this task instead.
+        while True:
+            msg = await c.receive_json_from(timeout=3600)
+            kind = msg.get("type")
+            if kind == "message.new":
+                try:
+                    marker = json.loads(msg["message"]["content"])
+                except (TypeError, ValueError):
+                    continue
+                if marker.get("run") == run_id:
+                    result["received"] += 1
+                    result["delivery"].append(time.time() - marker["t"])
+            elif kind == "message.ack":
+                result["acked"] += 1
+                result["ack"].append(time.time() - msg["ref"])
+            elif kind == "message.error":
+                result["errors"] += 1
+
+    await asyncio.gather(*(open_socket(u) for u in users))
+    readers = [asyncio.create_task(read(c)) for c in sockets]
+    loop = asyncio.get_running_loop()
+    ready.put(len(sockets))
+    await loop.run_in_executor(None, go.wait)
+
+    rng = random.Random()
+    rate = options["rate"] / options["workers"]
+    start = time.time()
+    i = 0
+    while sockets and rate > 0:
+        scheduled = start + i / rate
+        if scheduled - start >= options["duration"]:
+            break
+        delay = scheduled - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        c = rng.choice(sockets)
+        to = rng.choice(peer_ids)
+        if to == c.scope["user"].id:
+            to = peer_ids[(peer_ids.index(to) + 1) % len(peer_ids)]
+        # Latency is measured from the scheduled send time.
+        await c.send_json_to({
+            "type": "message.send",
+            "to": to,
+            "text": json.dumps({"run": run_id, "t": scheduled}),
+            "ref": scheduled,
+        })
+        result["sent"] += 1
+        i += 1
+
+    await asyncio.sleep(options["drain"])
+    for task in readers:
+        task.cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+    await asyncio.gather(*(c.disconnect() for c in sockets), return_exceptions=True)
+    return result
+
+
+def _worker(user_ids, peer_ids, options, run_id, go, ready, results):
+    User = get_user_model()
+    users = list(User.objects.filter(id__in=user_ids))
+    connections.close_all()
+    results.put(asyncio.run(_worker_main(users, peer_ids, options, run_id, go, ready)))
+
+
+class Command(BaseCommand):
+    help = (
+        "Soak-test chat fan-out through the configured channel layer: open many "
+        "DirectChatConsumer sockets in-process across several worker processes, "
+        "send messages between random users at a fixed rate and report connect, "
+        "ack and end-to-end delivery latency, dropped messages and Redis commands "
+        "per message. Set CHANNEL_LAYER_BACKEND=pubsub (and CHANNEL_LAYER_HOSTS) "
+        "to measure the pub/sub layer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sockets", type=int, default=2000, help="Connected chat users (one socket each).")
+        parser.add_argument("--workers", type=int, default=3, help="Worker processes sharing the sockets.")
+        parser.add_argument("--rate", type=float, default=500.0, help="Messages per second across all workers.")
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds of sending.")
+        parser.add_argument("--drain", type=float, default=3.0, help="Seconds to wait for deliveries after sending.")
+        parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+        parser.add_argument("--keep", action="store_true", help="Keep benchmark users, messages and Redis keys.")
+
+    def handle(self, *args, **options):
+        if options["sockets"] < 2:
+            raise CommandError("--sockets must be at least 2")
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1")
+
+        self.r = get_redis_connection("default")
+        user_ids = self._create_users(options["sockets"])
+        run_id = uuid.uuid4().hex
+
+        # Fork after closing DB connections so workers open their own.
+        connections.close_all()
+        ctx = multiprocessing.get_context("fork")
+        go, ready, results = ctx.Event(), ctx.Queue(), ctx.Queue()
+        procs = [
+            ctx.Process(
+                target=_worker,
+                args=(user_ids[w::options["workers"]], user_ids, options, run_id, go, ready, results),
+                daemon=True,
+            )
+            for w in range(options["workers"])
+        ]
+        try:
+            for p in procs:
+                p.start()
+            try:
+                connected = sum(ready.get(timeout=WORKER_TIMEOUT_SECONDS) for _ in procs)
+                calls_before = redis_calls(self.r)
+                start = time.perf_counter()
+                go.set()
+                wait = options["duration"] + options["drain"] + WORKER_TIMEOUT_SECONDS
+                worker_results = [results.get(timeout=wait) for _ in procs]
+            except queue.Empty:
+                raise CommandError("A benchmark worker did not report back; see its traceback above.")
+            elapsed = time.perf_counter() - start
+            calls = redis_calls(self.r) - calls_before
+            for p in procs:
+                p.join()
+        finally:
+            for p in procs:
+                if p.is_alive():
+                    p.terminate()
+            if not options["keep"]:
+                self._cleanup(user_ids)
+
+        merged = {key: [] for key in ("connect", "ack", "delivery")}
+        totals = {key: 0 for key in ("sent", "acked", "errors", "received", "connect_failures")}
+        for res in worker_results:
+            for key in merged:
+                merged[key].extend(res[key])
+            for key in totals:
+                totals[key] += res[key]
+
+        summary = {
+            "backend": settings.CHANNEL_LAYERS["default"]["BACKEND"],
+            "sockets": connected,
+            "workers": options["workers"],
+            **totals,
+            "dropped": totals["acked"] - totals["received"],
+            # Deliveries over the sending window (the drain only catches stragglers).
+            "delivered_per_second": totals["received"] / min(elapsed, options["duration"]) if elapsed else 0.0,
+            "redis_ops_per_message": calls / totals["sent"] if totals["sent"] else None,
+            "latency": [_latency_summary(name, values) for name, values in merged.items()],
+        }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+
+        ops = "-" if summary["redis_ops_per_message"] is None else f"{summary['redis_ops_per_message']:.1f}"
+        self.stdout.write(
+            f"{summary['backend']}: {connected} sockets in {options['workers']} workers, "
+            f"{totals['connect_failures']} failed to connect"
+        )
+        self.stdout.write(
+            f"sent {totals['sent']}, acked {totals['acked']}, delivered {totals['received']}, "
+            f"dropped {summary['dropped']}, errors {totals['errors']}, "
+            f"{summary['delivered_per_second']:.1f} msg/s, redis/msg {ops}"
+        )
+        self.stdout.write(f"{'metric':<10}{'count':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+        for row in summary["latency"]:
+            self.stdout.write(
+                f"{row['metric']:<10}{row['count']:>9}{row['p50_ms']:>9.2f}"
+                f"{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}{row['max_ms']:>9.2f}"
+            )
+
+    def _create_users(self, n):
+        User = get_user_model()
+        names = [f"{BENCH_USER_PREFIX}{i}" for i in range(n)]
+        # Never run as (and later delete) accounts this run did not create.
+        existing = User.objects.filter(username__in=names).count()
+        if existing:
+            raise CommandError(
+                f"{existing} {BENCH_USER_PREFIX}* users already exist; delete them "
+                f"(they may be left over from a --keep run) before benchmarking."
+            )
+        User.objects.bulk_create(
+            [User(username=name, email=f"{name}@bench.invalid", password="!") for name in names],
+            batch_size=1000,
+        )
+        return list(User.objects.filter(username__in=names).order_by("id").values_list("id", flat=True))
+
+    def _cleanup(self, user_ids):
+        """Delete this run's users (cascading their messages) and their chat keys."""
+        User = get_user_model()
+        for i in range(0, len(user_ids), 1000):
+            User.objects.filter(id__in=user_ids[i:i + 1000]).delete()
+        keys = []
+        for user_id in user_ids:
+            keys.extend(chat_cache.user_keys(user_id))
+            keys.extend(unread.user_keys(user_id))
+            keys.extend(presence.user_keys(user_id))
+            keys.extend(delivery.user_keys(user_id))
+            keys.extend(graph_keys(user_id))
+            keys.append(generation_key(user_id))
+        for i in range(0, len(keys), 1000):
+            self.r.delete(*keys[i:i + 1000])
+        if user_ids:
+            self.r.zrem(presence.ONLINE_KEY, *user_ids)
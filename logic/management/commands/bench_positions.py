@@ -0,0 +1,267 @@
+import json
+import math
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django_redis import get_redis_connection
+
+from logic.redis_positions import (
+    KM_PER_DEGREE,
+    WRITE_MIN_MOVE_METERS,
+    get_nearby_actors,
+    get_nearby_actors_cached,
+    remove_actors,
+    update_actor_position,
+    update_actor_positions,
+)
+from logic.utils.bench_stats import percentile, redis_calls
+from logic.utils.map_feed import collect_map_items
+
+BENCH_ID_PREFIX = "bench-"
+PHASES = ("write", "nearby", "nearby_cached", "map", "mixed")
+
+
+class _Sim:
+    """N actors random-walking around a centre point; thread-safe steps."""
+
+    def __init__(self, n, center_lat, center_lon, spread_km, seed):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.center_lat = center_lat
+        self.center_lon = center_lon
+        self.spread_km = spread_km
+        self.actors = []
+        for i in range(n):
+            lat, lon = self.random_point()
+            self.actors.append({
+                "type": "bot",
+                "id": f"{BENCH_ID_PREFIX}{i}",
+                "lat": lat,
+                "lon": lon,
+                "heading": self.rng.uniform(0, 360),
+                "speed": self.rng.choice((0.0, 1.4, 1.4, 5.0)),
+            })
+
+    def random_point(self):
+        r_km = self.spread_km * math.sqrt(self.rng.random())
+        angle = self.rng.uniform(0, 2 * math.pi)
+        lat = self.center_lat + r_km * math.cos(angle) / KM_PER_DEGREE
+        lon = self.center_lon + r_km * math.sin(angle) / (KM_PER_DEGREE * math.cos(math.radians(self.center_lat)))
+        return lat, lon
+
+    def step(self, dt):
+        """Advance one random actor by dt seconds and return a copy of it."""
+        with self.lock:
+            a = self.rng.choice(self.actors)
+            if self.rng.random() < 0.05:
+                a["heading"] = (a["heading"] + self.rng.uniform(-90, 90)) % 360
+            dist_km = a["speed"] * dt / 1000.0
+            h = math.radians(a["heading"])
+            a["lat"] += dist_km * math.cos(h) / KM_PER_DEGREE
+            a["lon"] += dist_km * math.sin(h) / (KM_PER_DEGREE * math.cos(math.radians(a["lat"])))
+            return dict(a)
+
+    def query_point(self):
+        with self.lock:
+            return self.random_point()
+
+
+def _summary(phase, op, latencies, errors, elapsed, ops_per_request):
+    ms = sorted(v * 1000.0 for v in latencies)
+    return {
+        "phase": phase,
+        "op": op,
+        "requests": len(ms),
+        "errors": errors,
+        "throughput": len(ms) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(ms, 50),
+        "p95_ms": percentile(ms, 95),
+        "p99_ms": percentile(ms, 99),
+        "max_ms": ms[-1] if ms else 0.0,
+        "redis_ops_per_request": ops_per_request,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the position subsystem against the configured Redis: simulate "
+        "moving actors, drive write and read paths at fixed rates and report "
+        "throughput, p50/p95/p99 latency and Redis commands per request. "
+        "Latency is measured from each request's scheduled start time. "
+        "Benchmark actors go into the same indexes live map queries read, so "
+        "point REDIS_URL at a dedicated Redis or database and pass --confirm-redis."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--actors", type=int, default=2000, help="Number of simulated actors.")
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds per phase.")
+        parser.add_argument("--write-rate", type=float, default=1000.0, help="Position writes per second.")
+        parser.add_argument("--read-rate", type=float, default=200.0, help="Read requests per second.")
+        parser.add_argument("--threads", type=int, default=16, help="Worker threads per operation.")
+        parser.add_argument("--center", default="50.0614,19.9366", help="Simulation centre as lat,lon.")
+        parser.add_argument("--spread-km", type=float, default=5.0, help="Radius actors are spread over.")
+        parser.add_argument("--radius-km", type=float, default=1.0, help="Radius for nearby queries.")
+        parser.add_argument("--view-km", type=float, default=2.0, help="Half-size of the map view box.")
+        parser.add_argument("--zoom", type=int, default=16, help="Zoom level for map queries.")
+        parser.add_argument(
+            "--phases",
+            default=",".join(PHASES),
+            help=f"Comma-separated phases to run, from: {', '.join(PHASES)}.",
+        )
+        parser.add_argument("--seed", type=int, default=1, help="Random seed.")
+        parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+        parser.add_argument("--keep", action="store_true", help="Keep benchmark actors in Redis afterwards.")
+        parser.add_argument(
+            "--confirm-redis",
+            action="store_true",
+            help="Confirm that benchmark actors may be written to the Redis at REDIS_URL.",
+        )
+
+    def handle(self, *args, **options):
+        if not options["confirm_redis"]:
+            raise CommandError(
+                "bench_positions writes bot:bench-N actors into the Redis at REDIS_URL, where live map "
+                "queries see them. Point REDIS_URL at a dedicated Redis or database and pass --confirm-redis."
+            )
+
+        try:
+            center_lat, center_lon = (float(v) for v in options["center"].split(","))
+        except ValueError:
+            raise CommandError("--center must be lat,lon")
+
+        phases = [p.strip() for p in options["phases"].split(",") if p.strip()]
+        unknown = set(phases) - set(PHASES)
+        if unknown:
+            raise CommandError(f"Unknown phases: {', '.join(sorted(unknown))}")
+
+        self.options = options
+        self.r = get_redis_connection("default")
+        self.sim = _Sim(options["actors"], center_lat, center_lon, options["spread_km"], options["seed"])
+
+        update_actor_positions(self.sim.actors)
+
+        results = []
+        try:
+            for phase in phases:
+                results.extend(self._run_phase(phase))
+        finally:
+            if not options["keep"]:
+                self._cleanup()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(
+            f"{'phase':<14}{'op':<14}{'requests':>9}{'req/s':>10}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'redis/req':>11}"
+        )
+        for res in results:
+            ops = "-" if res["redis_ops_per_request"] is None else f"{res['redis_ops_per_request']:.1f}"
+            self.stdout.write(
+                f"{res['phase']:<14}{res['op']:<14}{res['requests']:>9}{res['throughput']:>10.1f}"
+                f"{res['p50_ms']:>9.2f}{res['p95_ms']:>9.2f}{res['p99_ms']:>9.2f}{res['max_ms']:>9.2f}{ops:>11}"
+            )
+
+    def _operations(self):
+        o = self.options
+        view_deg = o["view_km"] / KM_PER_DEGREE
+        sim = self.sim
+
+        def write():
+            a = sim.step(1.0)
+            update_actor_position(
+                a["type"],
+                a["id"],
+                a["lat"],
+                a["lon"],
+                heading=a["heading"],
+                speed=a["speed"],
+                min_move_m=WRITE_MIN_MOVE_METERS,
+            )
+
+        def nearby():
+            lat, lon = sim.query_point()
+            get_nearby_actors(lat, lon, o["radius_km"], include_types=["user", "bot"])
+
+        def nearby_cached():
+            lat, lon = sim.query_point()
+            get_nearby_actors_cached(lat, lon, o["radius_km"], include_types=["user", "bot"])
+
+        def map_view():
+            lat, lon = sim.query_point()
+            bbox = (lon - view_deg, lat - view_deg, lon + view_deg, lat + view_deg)
+            collect_map_items(0, bbox=bbox, zoom=o["zoom"])
+
+        return {
+            "write": (write, o["write_rate"]),
+            "nearby": (nearby, o["read_rate"]),
+            "nearby_cached": (nearby_cached, o["read_rate"]),
+            "map": (map_view, o["read_rate"]),
+        }
+
+    def _run_phase(self, phase):
+        ops = self._operations()
+        if phase == "mixed":
+            selected = {name: ops[name] for name in ("write", "nearby_cached", "map")}
+        else:
+            selected = {phase: ops[phase]}
+
+        latencies = {name: [] for name in selected}
+        errors = {name: 0 for name in selected}
+        duration = self.options["duration"]
+        calls_before = redis_calls(self.r)
+        start = time.perf_counter()
+
+        def worker(name, func, rate, counter, lock):
+            lat = latencies[name]
+            while True:
+                with lock:
+                    i = next(counter)
+                scheduled = start + i / rate
+                if scheduled - start >= duration:
+                    return
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    func()
+                except Exception:
+                    errors[name] += 1
+                    continue
+                lat.append(time.perf_counter() - scheduled)
+
+        threads = []
+        for name, (func, rate) in selected.items():
+            if rate <= 0:
+                continue
+            counter = iter(range(10 ** 12))
+            lock = threading.Lock()
+            for _ in range(max(1, self.options["threads"])):
+                t = threading.Thread(target=worker, args=(name, func, rate, counter, lock), daemon=True)
+                t.start()
+                threads.append(t)
+
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        calls = redis_calls(self.r) - calls_before
+
+        multi = len(selected) > 1
+        results = []
+        for name, values in latencies.items():
+            # Commands from other clients are counted too; with several
+            # operations only the phase total can be attributed.
+            ops_per_request = None if multi or not values else calls / len(values)
+            results.append(_summary(phase, name, values, errors[name], elapsed, ops_per_request))
+        if multi:
+            combined = [v for values in latencies.values() for v in values]
+            ops_per_request = calls / len(combined) if combined else None
+            results.append(_summary(phase, "total", combined, sum(errors.values()), elapsed, ops_per_request))
+        return results
+
+    def _cleanup(self):
+        """Remove only the benchmark actors from the indexes, with their hashes and trails."""
+        remove_actors((a["type"], a["id"]) for a in self.sim.actors)
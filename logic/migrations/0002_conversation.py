@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def backfill_conversations(apps, schema_editor):
+    Message = apps.get_model('logic', 'Message')
+    Conversation = apps.get_model('logic', 'Conversation')
+
+    last_ids = {}
+    for row in Message.objects.values('sender_id', 'receiver_id').annotate(last_id=Max('id')):
+        for key in ((row['sender_id'], row['receiver_id']), (row['receiver_id'], row['sender_id'])):
+            last_ids[key] = max(last_ids.get(key, 0), row['last_id'])
+
+    unread = {
+        (row['receiver_id'], row['sender_id']): row['cnt']
+        for row in Message.objects.filter(read_at__isnull=True)
+        .values('sender_id', 'receiver_id').annotate(cnt=Count('id'))
+    }
+    times = dict(
+        Message.objects.filter(id__in=set(last_ids.values())).values_list('id', 'created_at')
+    )
+
+    Conversation.objects.bulk_create(
+        [
+            Conversation(
+                user_id=user_id,
+                peer_id=peer_id,
+                last_message_id=last_id,
+                last_time=times[last_id],
+                unread_count=unread.get((user_id, peer_id), 0),
+            )
+            for (user_id, peer_id), last_id in last_ids.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logic', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_time', models.DateTimeField(blank=True, null=True)),
+                ('unread_count', models.IntegerField(default=0)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='logic.message')),
+                ('peer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-last_time'], name='conversation_user_recent')],
+                'unique_together': {('user', 'peer')},
+            },
+        ),
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
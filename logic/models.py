@@ -1,5 +1,7 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Upper
 from django.conf import settings
 import uuid
 
@@ -22,6 +24,12 @@ class User(AbstractUser):
     user_range = models.IntegerField(default=1, db_index=True)
     two_factor_enabled = models.BooleanField(default=False)
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Trigram index for username__icontains (UPPER(username) LIKE ...).
+            GinIndex(OpClass(Upper('username'), name='gin_trgm_ops'), name='user_username_upper_trgm'),
+        ]
+
 
 HOUSE_STATUS = [
     ('free', 'free'),
@@ -108,6 +116,47 @@ class Message(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     read_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Serves both directions of a conversation for history paging.
+            models.Index(fields=['sender', 'receiver', 'created_at'], name='message_pair_created'),
+            # Unread messages from one sender (mark-read); read rows stay out of it.
+            models.Index(
+                fields=['receiver', 'sender'],
+                name='message_unread_by_pair',
+                condition=models.Q(read_at__isnull=True),
+            ),
+        ]
+
+
+class Conversation(models.Model):
+    """One chat thread as seen by `user`; maintained by utils.conversations."""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='conversations',
+    )
+    peer = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    last_message = models.ForeignKey(
+        Message,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+    )
+    last_time = models.DateTimeField(null=True, blank=True)
+    unread_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [('user', 'peer')]
+        indexes = [
+            models.Index(fields=['user', '-last_time'], name='conversation_user_recent'),
+        ]
+
 
 FRIEND_STATUS = [
     ('pending', 'pending'),
@@ -1,87 +1,825 @@
+import hashlib
+import math
+import struct
 import time
-from typing import Literal, Optional, List, Dict, Any
+from typing import Literal, Optional, List, Dict, Any, Iterable, Tuple
 
+from django.conf import settings
 from django_redis import get_redis_connection
+from redis.exceptions import NoScriptError
+
+from .utils.async_redis import get_async_redis
+from .utils.snapshot_cache import SnapshotCache
+from .utils.aoi import geohash_encode, geohash_bounds
 
 ActorType = Literal["user", "bot"]
 
+# Geo index. With settings.POSITIONS_GEO_SHARD_PRECISION = 0 (the default)
+# every actor lives in GEO_KEY, with SEEN_KEY as its last-seen index. With
+# a precision > 0 actors live only in the shard of their geohash cell,
+# geo:actors:{<cell>}, which has its own last-seen index
+# geo:actors:seen:{<cell>}; the hash tag keeps the pair on one Cluster
+# slot. The actor hash records its cell (SHARD_FIELD) so a write that
+# changes cell removes the actor from its old shard, and SHARDS_KEY lists
+# every cell written so far for prune and searches.
 GEO_KEY = "geo:actors"
+SEEN_KEY = "geo:actors:seen"
+SHARDS_KEY = "geo:actors:shards"
+SHARD_FIELD = "shard"
+# How long a process reuses its copy of SHARDS_KEY; a brand new shard may
+# be missed by searches for this long.
+SHARD_REGISTRY_TTL_SECONDS = 1.0
 POS_KEY_PREFIX = "pos"
+TRAIL_KEY_PREFIX = "trail"
 
 DEFAULT_TTL_SECONDS = 120
 STALE_SECONDS = 180
 
+# Write suppression thresholds for callers that report idle actors often.
+WRITE_MIN_MOVE_METERS = 3.0
+WRITE_MIN_HEADING_DEGREES = 5.0
+# Never extrapolate an actor further than this past its last update.
+DEAD_RECKONING_MAX_SECONDS = 10
+PRUNE_BATCH_SIZE = 500
+
+# Per-actor trail streams (trail:<type>:<id>) hold the last
+# settings.POSITIONS_TRAIL_LENGTH points, trimmed approximately on every
+# XADD, and expire TRAIL_TTL_SECONDS after the actor's last real move.
+TRAIL_TTL_SECONDS = 3600
+MAX_TRAIL_POINTS = 1000
+
+# Packed hash layout (field "p"): lat, lon (float64), ts (uint32),
+# alt, heading, speed (float32, NaN when missing). String attributes
+# (type, name, op) stay as regular hash fields; a text "ts" field, written
+# by suppressed refreshes, overrides the packed ts.
+PACKED_FIELD = "p"
+PACKED_STRUCT = struct.Struct("<ddIfff")
+TEXT_FIELDS = ("lat", "lon", "ts", "alt", "heading", "speed")
+
+# Per-process cache shared by concurrent identical (quantized) read queries.
+SNAPSHOT_TTL_SECONDS = 0.5
+SNAPSHOT_GRID_DEGREES = 0.01
+SNAPSHOT_MIN_BOX_STEP = 2 ** -7
+# Nearby snapshots fetch this many times max_results, so that when they are
+# cut off they still reach past the max_results nearest of callers whose
+# centre was snapped (see _filter_nearby_snapshot).
+SNAPSHOT_NEARBY_OVERFETCH = 4
+
+_snapshot_cache = SnapshotCache(SNAPSHOT_TTL_SECONDS)
+_shard_registry = SnapshotCache(SHARD_REGISTRY_TTL_SECONDS)
+
+KM_PER_DEGREE = 111.32
+# Same earth radius Redis uses for GEO distances.
+EARTH_RADIUS_KM = 6372.797560856
+# Redis GEO cannot index latitudes beyond +/-85.05112878 (web mercator limit).
+GEO_MAX_LAT = 85.05112878
+
+# Removes up to ARGV[2] members last seen at or before ARGV[1] from both a
+# geo index (KEYS[1]) and its last-seen index (KEYS[2]) atomically, so an
+# actor refreshed mid-prune is never dropped.
+_PRUNE_SCRIPT = """
+local members = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #members > 0 then
+    redis.call('ZREM', KEYS[1], unpack(members))
+    redis.call('ZREM', KEYS[2], unpack(members))
+end
+return #members
+"""
+
+# Suppressed write: if the actor already exists in the shard it belongs
+# in, is (and was) not moving, has moved less than ARGV[6] metres (3D, using GEOPOS and the stored alt)
+# and has not turned by ARGV[7] degrees or more, only refresh ts, TTL and
+# last-seen and return 0. Otherwise do the same full write as
+# _queue_position_write (including the trail append when ARGV[12] > 0)
+# and return 1.
+# KEYS: geo index and last-seen index for the new position, actor hash,
+#       actor trail stream, geo index and last-seen index the actor is
+#       currently in (the same keys unless it changes shard).
+# ARGV: member, lon, lat, ts, ttl, min_move_m, min_heading_deg, alt,
+#       heading, speed ('' when missing), packed flag, trail length,
+#       trail ttl, field/value pairs...
+_WRITE_SCRIPT = """
+local function f32(s, i)
+    local b1, b2, b3, b4 = string.byte(s, i, i + 3)
+    local exp = (b4 % 128) * 2 + math.floor(b3 / 128)
+    if exp == 255 then return nil end
+    local mant = ((b3 % 128) * 256 + b2) * 256 + b1
+    local sign = 1
+    if b4 >= 128 then sign = -1 end
+    if exp == 0 then return sign * mant * 2 ^ -149 end
+    return sign * (1 + mant / 2 ^ 23) * 2 ^ (exp - 127)
+end
+
+local lon = tonumber(ARGV[2])
+local lat = tonumber(ARGV[3])
+local min_move = tonumber(ARGV[6])
+
+if min_move > 0 and KEYS[5] == KEYS[1] and redis.call('EXISTS', KEYS[3]) == 1 then
+    local old = redis.call('GEOPOS', KEYS[1], ARGV[1])[1]
+    if old then
+        local old_alt, old_heading, old_speed
+        local blob = redis.call('HGET', KEYS[3], 'p')
+        if blob and #blob == 32 then
+            old_alt = f32(blob, 21)
+            old_heading = f32(blob, 25)
+            old_speed = f32(blob, 29)
+        else
+            local v = redis.call('HMGET', KEYS[3], 'alt', 'heading', 'speed')
+            old_alt = tonumber(v[1])
+            old_heading = tonumber(v[2])
+            old_speed = tonumber(v[3])
+        end
+
+        local alt = tonumber(ARGV[8])
+        local heading = tonumber(ARGV[9])
+        local speed = tonumber(ARGV[10])
+
+        local old_lon = tonumber(old[1])
+        local old_lat = tonumber(old[2])
+        local x = math.rad(lon - old_lon) * math.cos(math.rad((lat + old_lat) / 2)) * 6372797.560856
+        local y = math.rad(lat - old_lat) * 6372797.560856
+        local z = 0
+        if alt and old_alt then z = alt - old_alt end
+        local moved = math.sqrt(x * x + y * y + z * z) >= min_move
+
+        local moving = math.abs(speed or 0) >= 0.01 or math.abs(old_speed or 0) >= 0.01
+
+        local turned = false
+        if heading then
+            if old_heading then
+                local dh = math.abs(heading - old_heading) % 360
+                if dh > 180 then dh = 360 - dh end
+                turned = dh >= tonumber(ARGV[7])
+            else
+                turned = true
+            end
+        end
+
+        if not moved and not moving and not turned then
+            redis.call('HSET', KEYS[3], 'ts', ARGV[4])
+            redis.call('EXPIRE', KEYS[3], ARGV[5])
+            redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+            return 0
+        end
+    end
+end
+
+if KEYS[5] ~= KEYS[1] then
+    redis.call('ZREM', KEYS[5], ARGV[1])
+    redis.call('ZREM', KEYS[6], ARGV[1])
+end
+redis.call('GEOADD', KEYS[1], lon, lat, ARGV[1])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+if ARGV[11] == '1' then
+    redis.call('HDEL', KEYS[3], 'lat', 'lon', 'ts', 'alt', 'heading', 'speed')
+else
+    redis.call('HDEL', KEYS[3], 'p')
+end
+for i = 14, #ARGV, 2 do
+    redis.call('HSET', KEYS[3], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[3], ARGV[5])
+
+if tonumber(ARGV[12]) > 0 then
+    local point = {'lat', ARGV[3], 'lon', ARGV[2]}
+    local names = {'alt', 'heading', 'speed'}
+    for i = 1, 3 do
+        if ARGV[7 + i] ~= '' then
+            table.insert(point, names[i])
+            table.insert(point, ARGV[7 + i])
+        end
+    end
+    redis.call('XADD', KEYS[4], 'MAXLEN', '~', ARGV[12], '*', unpack(point))
+    redis.call('EXPIRE', KEYS[4], ARGV[13])
+end
+return 1
+"""
+
+
+def _script_sha(script_source: str) -> str:
+    return hashlib.sha1(script_source.encode("utf-8")).hexdigest()
+
+
+def _queue_script(pipe, script_source: str, keys: List[str], args: list) -> None:
+    """
+    Queue EVALSHA of a Lua script on a sync or async pipeline.
+
+    Unlike pipeline-registered Scripts this does not send SCRIPT EXISTS on
+    every execute; _execute_writes loads the scripts once per process.
+    """
+    pipe.evalsha(_script_sha(script_source), len(keys), *keys, *args)
+
+
+_WRITE_SCRIPTS = (_WRITE_SCRIPT,)
+# Set once the write scripts were loaded by this process; cleared when
+# Redis reports NOSCRIPT (restart, failover, SCRIPT FLUSH).
+_scripts_loaded = False
+
+
+def _noscript_indexes(results: list) -> List[int]:
+    return [i for i, res in enumerate(results) if isinstance(res, NoScriptError)]
+
+
+def _raise_first_error(results: list) -> list:
+    for res in results:
+        if isinstance(res, Exception):
+            raise res
+    return results
+
+
+def _execute_writes(r, queue) -> list:
+    """
+    Run queue(pipe) on a MULTI pipeline, loading the write scripts first.
+
+    Redis does not roll back a transaction when a command fails inside
+    EXEC, so the rest of it has already been applied when an EVALSHA gets
+    NOSCRIPT. Only those EVALSHA commands, which did nothing, are run
+    again after reloading the scripts.
+    """
+    global _scripts_loaded
+    if not _scripts_loaded:
+        for source in _WRITE_SCRIPTS:
+            r.script_load(source)
+        _scripts_loaded = True
+
+    pipe = r.pipeline(transaction=True)
+    queue(pipe)
+    commands = list(pipe.command_stack)
+    results = pipe.execute(raise_on_error=False)
+
+    failed = _noscript_indexes(results)
+    if failed:
+        _scripts_loaded = False
+        for source in _WRITE_SCRIPTS:
+            r.script_load(source)
+        _scripts_loaded = True
+        retry = r.pipeline(transaction=True)
+        for i in failed:
+            args, options = commands[i]
+            retry.execute_command(*args, **options)
+        for i, res in zip(failed, retry.execute(raise_on_error=False)):
+            results[i] = res
+    return _raise_first_error(results)
+
+
+async def _aexecute_writes(r, queue) -> list:
+    """Async _execute_writes."""
+    global _scripts_loaded
+    if not _scripts_loaded:
+        for source in _WRITE_SCRIPTS:
+            await r.script_load(source)
+        _scripts_loaded = True
+
+    pipe = r.pipeline(transaction=True)
+    queue(pipe)
+    commands = list(pipe.command_stack)
+    results = await pipe.execute(raise_on_error=False)
+
+    failed = _noscript_indexes(results)
+    if failed:
+        _scripts_loaded = False
+        for source in _WRITE_SCRIPTS:
+            await r.script_load(source)
+        _scripts_loaded = True
+        retry = r.pipeline(transaction=True)
+        for i in failed:
+            args, options = commands[i]
+            retry.execute_command(*args, **options)
+        for i, res in zip(failed, await retry.execute(raise_on_error=False)):
+            results[i] = res
+    return _raise_first_error(results)
+
 
 def _pos_key(actor_type: ActorType, actor_id: int | str) -> str:
     return f"{POS_KEY_PREFIX}:{actor_type}:{actor_id}"
 
 
+def _trail_key(actor_type: ActorType, actor_id: int | str) -> str:
+    return f"{TRAIL_KEY_PREFIX}:{actor_type}:{actor_id}"
+
+
 def _member_name(actor_type: ActorType, actor_id: int | str) -> str:
     return f"{actor_type}:{actor_id}"
 
 
-def update_actor_position(
+def _packed_enabled() -> bool:
+    return bool(getattr(settings, "POSITIONS_PACKED_ENCODING", False))
+
+
+def _shard_precision() -> int:
+    return int(getattr(settings, "POSITIONS_GEO_SHARD_PRECISION", 0) or 0)
+
+
+def _shard_keys(cell: str) -> Tuple[str, str]:
+    """(geo index, last-seen index) of a shard cell; "" is GEO_KEY/SEEN_KEY."""
+    if not cell:
+        return GEO_KEY, SEEN_KEY
+    return f"{GEO_KEY}:{{{cell}}}", f"{SEEN_KEY}:{{{cell}}}"
+
+
+def _seen_key_for(geo_key: str) -> str:
+    """Last-seen index paired with a geo index key from _shard_keys."""
+    return SEEN_KEY + geo_key[len(GEO_KEY):]
+
+
+def _shard_cell(lat: float, lon: float) -> str:
+    """Shard cell holding actors at (lat, lon); "" when unsharded."""
+    precision = _shard_precision()
+    if precision <= 0:
+        return ""
+    return geohash_encode(float(lat), float(lon), precision)
+
+
+def _registry_entries(members, precision: int) -> tuple:
+    cells = sorted(m.decode("utf-8") for m in members)
+    return tuple((cell, geohash_bounds(cell)) for cell in cells if len(cell) == precision)
+
+
+def _registered_shards() -> tuple:
+    """(cell, bounds) of every shard in SHARDS_KEY at the current precision; () when unsharded."""
+    precision = _shard_precision()
+    if precision <= 0:
+        return ()
+    r = get_redis_connection("default")
+    return _shard_registry.get_or_load(
+        (SHARDS_KEY, precision),
+        lambda: _registry_entries(r.smembers(SHARDS_KEY), precision),
+    )
+
+
+async def _aregistered_shards() -> tuple:
+    """Async _registered_shards."""
+    precision = _shard_precision()
+    if precision <= 0:
+        return ()
+    r = get_async_redis()
+
+    async def load():
+        return _registry_entries(await r.smembers(SHARDS_KEY), precision)
+
+    return await _shard_registry.aget_or_load((SHARDS_KEY, precision), load)
+
+
+def _shard_keys_for_box(min_lat: float, min_lon: float, max_lat: float, max_lon: float, shards: tuple) -> List[str]:
+    """
+    Geo index keys to search for a box (min_lon <= max_lon): GEO_KEY when
+    unsharded, otherwise every registered shard overlapping the box.
+    """
+    if _shard_precision() <= 0:
+        return [GEO_KEY]
+
+    # Pad slightly: Redis stores coordinates with ~0.6 mm of error.
+    pad = 1e-6
+    return [
+        _shard_keys(cell)[0]
+        for cell, (south, west, north, east) in shards
+        if south <= max_lat + pad and north >= min_lat - pad and west <= max_lon + pad and east >= min_lon - pad
+    ]
+
+
+def _old_cells(r, actors: List[tuple]) -> List[Optional[str]]:
+    """
+    Shard cell each (type, id) actor is currently indexed in, read from
+    its hash ("" for GEO_KEY or a new actor); all None when unsharded.
+    """
+    if _shard_precision() <= 0:
+        return [None] * len(actors)
+    pipe = r.pipeline(transaction=False)
+    for actor_type, actor_id in actors:
+        pipe.hget(_pos_key(actor_type, actor_id), SHARD_FIELD)
+    return [(cell or b"").decode("utf-8") for cell in pipe.execute()]
+
+
+async def _aold_cells(r, actors: List[tuple]) -> List[Optional[str]]:
+    """Async _old_cells."""
+    if _shard_precision() <= 0:
+        return [None] * len(actors)
+    pipe = r.pipeline(transaction=False)
+    for actor_type, actor_id in actors:
+        pipe.hget(_pos_key(actor_type, actor_id), SHARD_FIELD)
+    return [(cell or b"").decode("utf-8") for cell in await pipe.execute()]
+
+
+def _trail_length() -> int:
+    return int(getattr(settings, "POSITIONS_TRAIL_LENGTH", 0) or 0)
+
+
+def _opt_float(value: Optional[float]) -> float:
+    return math.nan if value is None else float(value)
+
+
+def _position_mapping(
     actor_type: ActorType,
-    actor_id: int | str,
     lat: float,
     lon: float,
     *,
     alt: Optional[float] = None,
     name: Optional[str] = None,
-    op: Optional[str] = None,     
+    op: Optional[str] = None,
     heading: Optional[float] = None,
     speed: Optional[float] = None,
-    ttl_seconds: int = DEFAULT_TTL_SECONDS,
-) -> None:
-    """Update actor position in Redis geo index and hash."""
-    r = get_redis_connection("default")
-    member = _member_name(actor_type, actor_id)
-    pos_key = _pos_key(actor_type, actor_id)
+    now_ts: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Build the per-actor hash mapping stored under pos:<type>:<id>.
 
-    lon_f = float(lon)
-    lat_f = float(lat)
-    r.geoadd(GEO_KEY, [lon_f, lat_f, member])
-
-    now_ts = int(time.time())
-    mapping: Dict[str, Any] = {
-        "lat": str(lat_f),
-        "lon": str(lon_f),
-        "ts": str(now_ts),
-        "type": actor_type,
-    }
-    if alt is not None:
-        mapping["alt"] = str(float(alt))
+    With settings.POSITIONS_PACKED_ENCODING the numeric fields are stored as
+    one PACKED_STRUCT blob instead of one string per field. Readers accept
+    both layouts.
+    """
+    ts = int(time.time()) if now_ts is None else now_ts
+    if _packed_enabled():
+        mapping: Dict[str, Any] = {
+            PACKED_FIELD: PACKED_STRUCT.pack(
+                float(lat),
+                float(lon),
+                ts,
+                _opt_float(alt),
+                _opt_float(heading),
+                _opt_float(speed),
+            ),
+            "type": actor_type,
+        }
+    else:
+        mapping = {
+            "lat": str(float(lat)),
+            "lon": str(float(lon)),
+            "ts": str(ts),
+            "type": actor_type,
+        }
+        if alt is not None:
+            mapping["alt"] = str(float(alt))
+        if heading is not None:
+            mapping["heading"] = str(float(heading))
+        if speed is not None:
+            mapping["speed"] = str(float(speed))
     if name:
         mapping["name"] = str(name)
     if op:
         mapping["op"] = str(op)
+    return mapping
+
+
+def _queue_position_write(
+    pipe,
+    actor_type: ActorType,
+    actor_id: int | str,
+    lat: float,
+    lon: float,
+    ts: int,
+    mapping: Dict[str, Any],
+    ttl_seconds: int,
+    cell: str = "",
+    old_cell: Optional[str] = None,
+) -> None:
+    """
+    Queue GEOADD + ZADD last-seen + HSET + EXPIRE for one actor on a
+    pipeline, first removing it from the shard of old_cell when that is
+    not its new cell.
+    """
+    pos_key = _pos_key(actor_type, actor_id)
+    member = _member_name(actor_type, actor_id)
+    geo_key, seen_key = _shard_keys(cell)
+    if old_cell is not None and old_cell != cell:
+        old_geo_key, old_seen_key = _shard_keys(old_cell)
+        pipe.zrem(old_geo_key, member)
+        pipe.zrem(old_seen_key, member)
+        pipe.sadd(SHARDS_KEY, cell)
+    pipe.geoadd(geo_key, [float(lon), float(lat), member])
+    pipe.zadd(seen_key, {member: ts})
+    # Drop fields of the other layout so a hash never mixes both.
+    if PACKED_FIELD in mapping:
+        pipe.hdel(pos_key, *TEXT_FIELDS)
+    else:
+        pipe.hdel(pos_key, PACKED_FIELD)
+    pipe.hset(pos_key, mapping=mapping)
+    pipe.expire(pos_key, ttl_seconds)
+
+
+def _queue_trail_append(
+    pipe,
+    actor_type: ActorType,
+    actor_id: int | str,
+    lat: float,
+    lon: float,
+    *,
+    alt: Optional[float] = None,
+    heading: Optional[float] = None,
+    speed: Optional[float] = None,
+) -> None:
+    """Queue a capped XADD of one point to the actor's trail stream (no-op when trails are off)."""
+    length = _trail_length()
+    if length <= 0:
+        return
+    point = {"lat": str(float(lat)), "lon": str(float(lon))}
+    if alt is not None:
+        point["alt"] = str(float(alt))
     if heading is not None:
-        mapping["heading"] = str(float(heading))
+        point["heading"] = str(float(heading))
     if speed is not None:
-        mapping["speed"] = str(float(speed))
+        point["speed"] = str(float(speed))
+    trail_key = _trail_key(actor_type, actor_id)
+    pipe.xadd(trail_key, point, maxlen=length, approximate=True)
+    pipe.expire(trail_key, TRAIL_TTL_SECONDS)
 
-    r.hset(pos_key, mapping=mapping)
-    r.expire(pos_key, ttl_seconds)
 
+def _opt_arg(value: Optional[float]) -> str:
+    return "" if value is None else str(float(value))
 
-def get_actor_position(actor_type: ActorType, actor_id: int | str) -> Optional[dict]:
-    """Return actor position from Redis or None if not found/stale."""
+
+def _queue_actor_update(
+    pipe,
+    actor_type: ActorType,
+    actor_id: int | str,
+    lat: float,
+    lon: float,
+    now_ts: int,
+    *,
+    alt: Optional[float] = None,
+    name: Optional[str] = None,
+    op: Optional[str] = None,
+    heading: Optional[float] = None,
+    speed: Optional[float] = None,
+    ttl_seconds: int = DEFAULT_TTL_SECONDS,
+    min_move_m: float = 0.0,
+    min_heading_deg: float = WRITE_MIN_HEADING_DEGREES,
+    old_cell: Optional[str] = None,
+) -> bool:
+    """
+    Queue one actor update (see update_actor_position) on a pipeline.
+
+    old_cell is the shard cell the actor is indexed in now (see
+    _old_cells). Returns True when the write may be suppressed, i.e. the
+    first queued result is the _WRITE_SCRIPT "written" flag.
+    """
+    cell = _shard_cell(lat, lon)
+    mapping = _position_mapping(
+        actor_type,
+        lat,
+        lon,
+        alt=alt,
+        name=name,
+        op=op,
+        heading=heading,
+        speed=speed,
+        now_ts=now_ts,
+    )
+    if cell:
+        mapping[SHARD_FIELD] = cell
+
+    if min_move_m > 0 and not op:
+        args = [
+            _member_name(actor_type, actor_id),
+            float(lon),
+            float(lat),
+            now_ts,
+            ttl_seconds,
+            float(min_move_m),
+            float(min_heading_deg),
+            _opt_arg(alt),
+            _opt_arg(heading),
+            _opt_arg(speed),
+            "1" if PACKED_FIELD in mapping else "0",
+            _trail_length(),
+            TRAIL_TTL_SECONDS,
+        ]
+        for field, value in mapping.items():
+            args.extend((field, value))
+        keys = [
+            *_shard_keys(cell),
+            _pos_key(actor_type, actor_id),
+            _trail_key(actor_type, actor_id),
+            *_shard_keys(cell if old_cell is None else old_cell),
+        ]
+        _queue_script(pipe, _WRITE_SCRIPT, keys, args)
+        if old_cell is not None and old_cell != cell:
+            pipe.sadd(SHARDS_KEY, cell)
+        return True
+
+    _queue_position_write(pipe, actor_type, actor_id, lat, lon, now_ts, mapping, ttl_seconds, cell, old_cell)
+    _queue_trail_append(pipe, actor_type, actor_id, lat, lon, alt=alt, heading=heading, speed=speed)
+    return False
+
+
+def update_actor_position(
+    actor_type: ActorType,
+    actor_id: int | str,
+    lat: float,
+    lon: float,
+    *,
+    alt: Optional[float] = None,
+    name: Optional[str] = None,
+    op: Optional[str] = None,
+    heading: Optional[float] = None,
+    speed: Optional[float] = None,
+    ttl_seconds: int = DEFAULT_TTL_SECONDS,
+    min_move_m: float = 0.0,
+    min_heading_deg: float = WRITE_MIN_HEADING_DEGREES,
+) -> bool:
+    """
+    Update actor position in Redis geo index and hash (one round trip).
+
+    Real moves are also appended to the actor's capped trail stream.
+
+    With min_move_m > 0 a stationary actor that moved less than min_move_m
+    metres and turned less than min_heading_deg only gets its ts and TTL
+    refreshed (see _WRITE_SCRIPT). Writes carrying an op are never
+    suppressed. Returns False when the write was suppressed.
+    """
     r = get_redis_connection("default")
-    pos_key = _pos_key(actor_type, actor_id)
-    data = r.hgetall(pos_key)
-    if not data:
-        return None
+    now_ts = int(time.time())
+    old_cell = _old_cells(r, [(actor_type, actor_id)])[0]
+    suppressible = False
+
+    def queue(pipe):
+        nonlocal suppressible
+        suppressible = _queue_actor_update(
+            pipe,
+            actor_type,
+            actor_id,
+            lat,
+            lon,
+            now_ts,
+            alt=alt,
+            name=name,
+            op=op,
+            heading=heading,
+            speed=speed,
+            ttl_seconds=ttl_seconds,
+            min_move_m=min_move_m,
+            min_heading_deg=min_heading_deg,
+            old_cell=old_cell,
+        )
+
+    results = _execute_writes(r, queue)
+    return bool(int(results[0])) if suppressible else True
+
+
+async def aupdate_actor_position(
+    actor_type: ActorType,
+    actor_id: int | str,
+    lat: float,
+    lon: float,
+    *,
+    alt: Optional[float] = None,
+    name: Optional[str] = None,
+    op: Optional[str] = None,
+    heading: Optional[float] = None,
+    speed: Optional[float] = None,
+    ttl_seconds: int = DEFAULT_TTL_SECONDS,
+    min_move_m: float = 0.0,
+    min_heading_deg: float = WRITE_MIN_HEADING_DEGREES,
+) -> bool:
+    """Async update_actor_position."""
+    r = get_async_redis()
+    now_ts = int(time.time())
+    old_cell = (await _aold_cells(r, [(actor_type, actor_id)]))[0]
+    suppressible = False
+
+    def queue(pipe):
+        nonlocal suppressible
+        suppressible = _queue_actor_update(
+            pipe,
+            actor_type,
+            actor_id,
+            lat,
+            lon,
+            now_ts,
+            alt=alt,
+            name=name,
+            op=op,
+            heading=heading,
+            speed=speed,
+            ttl_seconds=ttl_seconds,
+            min_move_m=min_move_m,
+            min_heading_deg=min_heading_deg,
+            old_cell=old_cell,
+        )
+
+    results = await _aexecute_writes(r, queue)
+    return bool(int(results[0])) if suppressible else True
 
-    decoded = {k.decode("utf-8"): v.decode("utf-8") for k, v in data.items()}
 
+def _queue_actor_updates(pipe, actors: List[dict], now_ts: int, ttl_seconds: int, old_cells: List[Optional[str]]) -> int:
+    count = 0
+    for a, old_cell in zip(actors, old_cells):
+        _queue_actor_update(
+            pipe,
+            a["type"],
+            a["id"],
+            a["lat"],
+            a["lon"],
+            now_ts,
+            alt=a.get("alt"),
+            name=a.get("name"),
+            op=a.get("op"),
+            heading=a.get("heading"),
+            speed=a.get("speed"),
+            ttl_seconds=ttl_seconds,
+            old_cell=old_cell,
+        )
+        count += 1
+    return count
+
+
+def update_actor_positions(
+    actors: Iterable[dict],
+    *,
+    ttl_seconds: int = DEFAULT_TTL_SECONDS,
+) -> int:
+    """
+    Update many actor positions in a single MULTI/EXEC round trip.
+
+    Each item needs "type", "id", "lat" and "lon"; "alt", "name", "op",
+    "heading" and "speed" are optional. Items must already be validated.
+    Returns the number of actors written.
+    """
+    actors = list(actors)
+    if not actors:
+        return 0
+    r = get_redis_connection("default")
+    now_ts = int(time.time())
+    old_cells = _old_cells(r, [(a["type"], a["id"]) for a in actors])
+    _execute_writes(r, lambda pipe: _queue_actor_updates(pipe, actors, now_ts, ttl_seconds, old_cells))
+    return len(actors)
+
+
+async def aupdate_actor_positions(
+    actors: Iterable[dict],
+    *,
+    ttl_seconds: int = DEFAULT_TTL_SECONDS,
+) -> int:
+    """Async update_actor_positions."""
+    actors = list(actors)
+    if not actors:
+        return 0
+    r = get_async_redis()
+    now_ts = int(time.time())
+    old_cells = await _aold_cells(r, [(a["type"], a["id"]) for a in actors])
+    await _aexecute_writes(r, lambda pipe: _queue_actor_updates(pipe, actors, now_ts, ttl_seconds, old_cells))
+    return len(actors)
+
+
+def prune_stale_actors(
+    *,
+    max_age_seconds: int = STALE_SECONDS,
+    batch_size: int = PRUNE_BATCH_SIZE,
+) -> int:
+    """
+    Remove actors not updated for max_age_seconds from the geo index.
+
+    Removes at most batch_size members per shard and script call, with one
+    pipelined pass over all shards at a time, so a large backlog never
+    blocks Redis for long. Returns the total number of members removed.
+    """
+    r = get_redis_connection("default")
+    prune = r.register_script(_PRUNE_SCRIPT)
+    cutoff = int(time.time()) - int(max_age_seconds)
+
+    # GEO_KEY also holds actors written while sharding was off.
+    pending = [""] + sorted(cell.decode("utf-8") for cell in r.smembers(SHARDS_KEY))
+    removed = 0
+    while pending:
+        pipe = r.pipeline(transaction=False)
+        for cell in pending:
+            prune(keys=list(_shard_keys(cell)), args=[cutoff, batch_size], client=pipe)
+        counts = [int(n) for n in pipe.execute()]
+        removed += sum(counts)
+        pending = [cell for cell, n in zip(pending, counts) if n >= batch_size]
+    return removed
+
+
+def remove_actors(actors: Iterable[Tuple[ActorType, int | str]], *, chunk_size: int = PRUNE_BATCH_SIZE) -> None:
+    """
+    Remove (type, id) actors from every geo and last-seen index and delete
+    their hashes and trails, e.g. to clean up test or benchmark actors.
+
+    Members are removed from GEO_KEY and all registered shards, so actors
+    whose hash (and shard field) already expired are found too.
+    """
+    actors = list(actors)
+    r = get_redis_connection("default")
+    cells = [""] + sorted(cell.decode("utf-8") for cell in r.smembers(SHARDS_KEY))
+    for i in range(0, len(actors), chunk_size):
+        chunk = actors[i:i + chunk_size]
+        members = [_member_name(actor_type, actor_id) for actor_type, actor_id in chunk]
+        pipe = r.pipeline(transaction=False)
+        for cell in cells:
+            for key in _shard_keys(cell):
+                pipe.zrem(key, *members)
+        pipe.delete(*[_pos_key(t, a) for t, a in chunk], *[_trail_key(t, a) for t, a in chunk])
+        pipe.execute()
+
+
+def _decode_text_hash(decoded: Dict[str, str], actor_type: str) -> Optional[dict]:
+    """Decode a hash stored as one string per field."""
     ts_str = decoded.get("ts")
     try:
         ts = int(ts_str) if ts_str is not None else None
     except ValueError:
         ts = None
 
-    now_ts = int(time.time())
-    if ts is None or now_ts - ts > STALE_SECONDS:
+    if ts is None:
         return None
 
     try:
@@ -90,32 +828,256 @@ def get_actor_position(actor_type: ActorType, actor_id: int | str) -> Optional[d
     except (KeyError, ValueError):
         return None
 
-    result: dict = {
+    item: dict = {
         "type": decoded.get("type") or actor_type,
-        "id": actor_id,
         "lat": lat,
         "lon": lon,
         "ts": ts,
     }
-    if "alt" in decoded:
-        try:
-            result["alt"] = float(decoded["alt"])
-        except ValueError:
-            pass
-    if "name" in decoded:
-        result["name"] = decoded["name"]
-    if "heading" in decoded:
-        try:
-            result["heading"] = float(decoded["heading"])
-        except ValueError:
-            pass
-    if "speed" in decoded:
-        try:
-            result["speed"] = float(decoded["speed"])
-        except ValueError:
-            pass
-
-    return result
+    for field in ("alt", "heading", "speed"):
+        if field in decoded:
+            try:
+                item[field] = float(decoded[field])
+            except ValueError:
+                pass
+    return item
+
+
+def _decode_packed(values: tuple, actor_type: str, strings: Dict[str, str]) -> dict:
+    """Build an actor dict from an unpacked PACKED_STRUCT tuple."""
+    lat, lon, ts, alt, heading, speed = values
+    item: dict = {
+        "type": strings.get("type") or actor_type,
+        "lat": lat,
+        "lon": lon,
+        "ts": ts,
+    }
+    if not math.isnan(alt):
+        item["alt"] = alt
+    if not math.isnan(heading):
+        item["heading"] = heading
+    if not math.isnan(speed):
+        item["speed"] = speed
+    return item
+
+
+def _decode_position_hashes(hashes: List[dict], actor_types: List[str]) -> List[Optional[dict]]:
+    """
+    Decode raw HGETALL results into actor dicts (None for missing/invalid).
+
+    Packed hashes are decoded together with a single struct.iter_unpack
+    over their concatenated blobs; text hashes are decoded per field.
+    """
+    packed_key = PACKED_FIELD.encode()
+    decoded_items: List[Optional[dict]] = [None] * len(hashes)
+    strings: List[Dict[str, str]] = [{}] * len(hashes)
+    packed_idx: List[int] = []
+    blobs: List[bytes] = []
+
+    for i, h in enumerate(hashes):
+        if not h:
+            continue
+        blob = h.get(packed_key)
+        strings[i] = {k.decode("utf-8"): v.decode("utf-8") for k, v in h.items() if k != packed_key}
+        if blob is not None and len(blob) == PACKED_STRUCT.size:
+            packed_idx.append(i)
+            blobs.append(blob)
+        else:
+            decoded_items[i] = _decode_text_hash(strings[i], actor_types[i])
+
+    if blobs:
+        unpacked = PACKED_STRUCT.iter_unpack(b"".join(blobs))
+        for i, values in zip(packed_idx, unpacked):
+            item = _decode_packed(values, actor_types[i], strings[i])
+            if "ts" in strings[i]:
+                try:
+                    item["ts"] = int(strings[i]["ts"])
+                except ValueError:
+                    pass
+            decoded_items[i] = item
+
+    for item, fields in zip(decoded_items, strings):
+        if item is None:
+            continue
+        if "name" in fields:
+            item["name"] = fields["name"]
+        if "op" in fields:
+            item["op"] = fields["op"]
+
+    return decoded_items
+
+
+def _actor_from_hash(data: dict, actor_type: ActorType, actor_id: int | str) -> Optional[dict]:
+    if not data:
+        return None
+
+    item = _decode_position_hashes([data], [actor_type])[0]
+    if item is None:
+        return None
+
+    now_ts = int(time.time())
+    if now_ts - item["ts"] > STALE_SECONDS:
+        return None
+
+    item.pop("op", None)
+    return {"type": item.pop("type"), "id": actor_id, **item}
+
+
+def get_actor_position(actor_type: ActorType, actor_id: int | str) -> Optional[dict]:
+    """Return actor position from Redis or None if not found/stale."""
+    r = get_redis_connection("default")
+    data = r.hgetall(_pos_key(actor_type, actor_id))
+    return _actor_from_hash(data, actor_type, actor_id)
+
+
+async def aget_actor_position(actor_type: ActorType, actor_id: int | str) -> Optional[dict]:
+    """Async get_actor_position."""
+    r = get_async_redis()
+    data = await r.hgetall(_pos_key(actor_type, actor_id))
+    return _actor_from_hash(data, actor_type, actor_id)
+
+
+def get_actor_trails(
+    actors: Iterable[tuple],
+    *,
+    since_ts: Optional[float] = None,
+    until_ts: Optional[float] = None,
+    max_points: int = MAX_TRAIL_POINTS,
+) -> Dict[str, List[dict]]:
+    """
+    Return recorded trails for many (type, id) actors in one pipeline.
+
+    Each trail is keyed by "<type>:<id>" and lists up to max_points of the
+    most recent points between since_ts and until_ts (unix seconds), oldest
+    first. Point ts is the stream entry time in (fractional) seconds.
+    Actors without a recorded trail get an empty list.
+    """
+    r = get_redis_connection("default")
+    low = "-" if since_ts is None else int(float(since_ts) * 1000)
+    high = "+" if until_ts is None else int(float(until_ts) * 1000)
+    count = max(1, min(int(max_points), MAX_TRAIL_POINTS))
+
+    members = []
+    pipe = r.pipeline()
+    for actor_type, actor_id in actors:
+        members.append(_member_name(actor_type, actor_id))
+        pipe.xrevrange(_trail_key(actor_type, actor_id), max=high, min=low, count=count)
+    entries_per_actor = pipe.execute() if members else []
+
+    trails: Dict[str, List[dict]] = {}
+    for member, entries in zip(members, entries_per_actor):
+        points: List[dict] = []
+        for entry_id, fields in reversed(entries):
+            decoded = {k.decode("utf-8"): v.decode("utf-8") for k, v in fields.items()}
+            try:
+                point: dict = {
+                    "lat": float(decoded["lat"]),
+                    "lon": float(decoded["lon"]),
+                    "ts": int(entry_id.split(b"-", 1)[0]) / 1000.0,
+                }
+            except (KeyError, ValueError):
+                continue
+            for field in ("alt", "heading", "speed"):
+                if field in decoded:
+                    try:
+                        point[field] = float(decoded[field])
+                    except ValueError:
+                        pass
+            points.append(point)
+        trails[member] = points
+    return trails
+
+
+def extrapolate_actor(actor: dict, now_ts: Optional[float] = None) -> dict:
+    """
+    Dead-reckon an actor dict forward from its ts using heading/speed.
+
+    heading is degrees clockwise from north and speed is metres per second.
+    Extrapolation is capped at DEAD_RECKONING_MAX_SECONDS. Actors without
+    both fields, or not moving, are returned unchanged.
+    """
+    heading = actor.get("heading")
+    speed = actor.get("speed")
+    if heading is None or not speed:
+        return actor
+
+    now = time.time() if now_ts is None else now_ts
+    dt = min(max(now - actor["ts"], 0.0), DEAD_RECKONING_MAX_SECONDS)
+    if dt <= 0:
+        return actor
+
+    dist_km = speed * dt / 1000.0
+    h = math.radians(heading)
+    lat = actor["lat"] + dist_km * math.cos(h) / KM_PER_DEGREE
+    cos_lat = max(math.cos(math.radians(actor["lat"])), 1e-6)
+    lon = actor["lon"] + dist_km * math.sin(h) / (KM_PER_DEGREE * cos_lat)
+    lon = (lon + 180.0) % 360.0 - 180.0
+
+    return {**actor, "lat": max(min(lat, GEO_MAX_LAT), -GEO_MAX_LAT), "lon": lon}
+
+
+def _hydrate_candidates(raw_results: list, include_types: Optional[List[ActorType]]) -> list:
+    """(type, id, dist) for GEO search results (member, dist, coords) of the wanted types."""
+    candidates = []
+    for member_bytes, dist, coords in raw_results:
+        member = member_bytes.decode("utf-8")
+        actor_type, actor_id = member.split(":", 1)
+        if include_types is not None and actor_type not in include_types:
+            continue
+        candidates.append((actor_type, actor_id, dist))
+    return candidates
+
+
+def _hydrate_actors(
+    r,
+    raw_results: list,
+    include_types: Optional[List[ActorType]] = None,
+) -> List[dict]:
+    """Fetch hashes for GEO search results (member, dist, coords) in one pipeline."""
+    candidates = _hydrate_candidates(raw_results, include_types)
+    pipe = r.pipeline()
+    for actor_type, actor_id, dist in candidates:
+        pipe.hgetall(_pos_key(actor_type, actor_id))
+    hashes = pipe.execute() if candidates else []
+    return _build_hydrated(candidates, hashes)
+
+
+async def _ahydrate_actors(
+    r,
+    raw_results: list,
+    include_types: Optional[List[ActorType]] = None,
+) -> List[dict]:
+    """Async _hydrate_actors."""
+    candidates = _hydrate_candidates(raw_results, include_types)
+    pipe = r.pipeline()
+    for actor_type, actor_id, dist in candidates:
+        pipe.hgetall(_pos_key(actor_type, actor_id))
+    hashes = await pipe.execute() if candidates else []
+    return _build_hydrated(candidates, hashes)
+
+
+def _build_hydrated(candidates: list, hashes: List[dict]) -> List[dict]:
+    decoded_items = _decode_position_hashes(hashes, [c[0] for c in candidates])
+
+    now_ts = int(time.time())
+    results: List[dict] = []
+
+    for (actor_type, actor_id, dist), decoded in zip(candidates, decoded_items):
+        if decoded is None or now_ts - decoded["ts"] > STALE_SECONDS:
+            continue
+
+        item: dict = {
+            "type": decoded.pop("type"),
+            "id": actor_id,
+            "lat": decoded.pop("lat"),
+            "lon": decoded.pop("lon"),
+            "dist_km": float(dist),
+            "ts": decoded.pop("ts"),
+        }
+        item.update(decoded)
+        results.append(item)
+
+    return results
 
 
 def get_nearby_actors(
@@ -126,91 +1088,631 @@ def get_nearby_actors(
     max_results: int = 200,
     include_types: Optional[List[ActorType]] = None,
 ) -> List[dict]:
-    """Return list of actors within radius_km from point (lat, lon)."""
+    """
+    Return list of actors within radius_km from point (lat, lon).
+
+    Only the geo shards overlapping the circle's bounding box are searched
+    (in one pipeline); their results are merged by distance.
+    """
+    return _nearby_actors(lat, lon, radius_km, max_results, include_types)[0]
+
+
+async def aget_nearby_actors(
+    lat: float,
+    lon: float,
+    radius_km: float,
+    *,
+    max_results: int = 200,
+    include_types: Optional[List[ActorType]] = None,
+) -> List[dict]:
+    """Async get_nearby_actors."""
+    return (await _anearby_actors(lat, lon, radius_km, max_results, include_types))[0]
+
+
+def _nearby_actors(lat, lon, radius_km, max_results, include_types):
+    """get_nearby_actors returning (actors, complete); see _merge_shard_results."""
     r = get_redis_connection("default")
+    pipe = r.pipeline()
+    _queue_nearby(pipe, lat, lon, radius_km, max_results, _registered_shards())
+    raw_results, complete = _merge_shard_results(pipe.execute(), max_results)
+    return _hydrate_actors(r, raw_results, include_types), complete
+
+
+async def _anearby_actors(lat, lon, radius_km, max_results, include_types):
+    """Async _nearby_actors."""
+    r = get_async_redis()
+    pipe = r.pipeline()
+    _queue_nearby(pipe, lat, lon, radius_km, max_results, await _aregistered_shards())
+    raw_results, complete = _merge_shard_results(await pipe.execute(), max_results)
+    return await _ahydrate_actors(r, raw_results, include_types), complete
+
 
+def _queue_nearby(pipe, lat: float, lon: float, radius_km: float, count: int, shards: tuple) -> None:
+    """Queue GEORADIUS on every shard overlapping the circle."""
     lat_f = float(lat)
     lon_f = float(lon)
     radius = float(radius_km)
+    for key in _shard_keys_for_radius(lat_f, lon_f, radius, shards):
+        pipe.georadius(
+            key,
+            lon_f,
+            lat_f,
+            radius,
+            unit="km",
+            sort="ASC",
+            withdist=True,
+            withcoord=True,
+            count=count,
+        )
 
-    raw_results = r.georadius(
-        GEO_KEY,
-        lon_f,
-        lat_f,
-        radius,
-        unit="km",
-        withdist=True,
-        withcoord=True,
-        count=max_results,
-    )
 
+def _merge_shard_results(shard_results: list, count: int):
+    """
+    Merge per-shard results by distance. Returns (raw results, complete);
+    complete is False when a shard hit `count`, i.e. matches may be missing.
+    """
+    raw_results = [res for results in shard_results for res in results]
+    raw_results.sort(key=lambda res: res[1])
+    complete = all(len(results) < count for results in shard_results)
+    return _unique_members(raw_results)[:count], complete
+
+
+def _unique_members(raw_results: list) -> list:
+    """
+    Drop repeated members from sorted search results. An actor whose hash
+    expired before it changed shard, or that was written concurrently, can
+    briefly sit in two shards until prune removes the stale copy.
+    """
+    seen = set()
+    unique = []
+    for res in raw_results:
+        if res[0] not in seen:
+            seen.add(res[0])
+            unique.append(res)
+    return unique
+
+
+def _shard_keys_for_radius(lat: float, lon: float, radius_km: float, shards: tuple) -> List[str]:
+    """Geo index keys whose regions overlap the bounding box of a circle (see _shard_keys_for_box)."""
+    if _shard_precision() <= 0:
+        return [GEO_KEY]
+
+    angle = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(angle)
+    min_lat = max(lat - dlat, -90.0)
+    max_lat = min(lat + dlat, 90.0)
+
+    ratio = math.sin(angle) / max(math.cos(math.radians(lat)), 1e-12)
+    if angle >= math.pi / 2 or max_lat >= 90.0 or min_lat <= -90.0 or ratio >= 1.0:
+        return _shard_keys_for_box(min_lat, -180.0, max_lat, 180.0, shards)
+
+    dlon = math.degrees(math.asin(ratio))
+    min_lon = lon - dlon
+    max_lon = lon + dlon
+    if min_lon < -180.0:
+        ranges = [(-180.0, max_lon), (min_lon + 360.0, 180.0)]
+    elif max_lon > 180.0:
+        ranges = [(min_lon, 180.0), (-180.0, max_lon - 360.0)]
+    else:
+        ranges = [(min_lon, max_lon)]
+
+    keys = set()
+    for west, east in ranges:
+        keys.update(_shard_keys_for_box(min_lat, west, max_lat, east, shards))
+    return sorted(keys)
+
+
+def _queue_search_box(
+    pipe,
+    min_lat: float,
+    min_lon: float,
+    max_lat: float,
+    max_lon: float,
+    count: Optional[int],
+    shards: tuple,
+) -> int:
+    """
+    Queue GEOSEARCH BYBOX on every shard overlapping a box that does not
+    cross the antimeridian. Returns the searched geo index keys in order;
+    count=None searches without COUNT.
+    """
+    center_lat = (min_lat + max_lat) / 2.0
+    center_lon = (min_lon + max_lon) / 2.0
+
+    # Size the box on the parallel closest to the equator (its widest
+    # point) and pad slightly; results are clipped to exact bounds below.
+    widest_lat = 0.0 if min_lat <= 0.0 <= max_lat else min(abs(min_lat), abs(max_lat))
+    width_km = (max_lon - min_lon) * KM_PER_DEGREE * math.cos(math.radians(widest_lat)) * 1.01
+    height_km = (max_lat - min_lat) * KM_PER_DEGREE * 1.01
+
+    keys = _shard_keys_for_box(min_lat, min_lon, max_lat, max_lon, shards)
+    for key in keys:
+        pipe.geosearch(
+            key,
+            longitude=center_lon,
+            latitude=center_lat,
+            width=max(width_km, 0.001),
+            height=max(height_km, 0.001),
+            unit="km",
+            sort="ASC",
+            count=count,
+            withdist=True,
+            withcoord=True,
+        )
+    return keys
+
+
+def _search_box_any(
+    r,
+    min_lat: float,
+    min_lon: float,
+    max_lat: float,
+    max_lon: float,
+    count: int,
+) -> list:
+    """
+    Box search over all overlapping shards in one pipeline, splitting boxes
+    crossing the antimeridian (min_lon > max_lon). Results are clipped to
+    the exact bounds and merged by distance. Returns (raw results,
+    complete) like _merge_shard_results.
+
+    COUNT keeps the members nearest each half's own centre, so a crossing
+    box that hit it is searched again without COUNT to rank by the real
+    centre.
+    """
+    box = _box_ranges(min_lat, min_lon, max_lat, max_lon)
+    shards = _registered_shards()
     pipe = r.pipeline()
-    for member_bytes, dist, coords in raw_results:
-        member = member_bytes.decode("utf-8")
-        actor_type, actor_id = member.split(":", 1)
-        pos_key = _pos_key(actor_type, actor_id)
-        pipe.hgetall(pos_key)
+    queued = _queue_box_ranges(pipe, box, count, shards)
+    raw_results, complete = _merge_box_results(pipe.execute(), box, queued, count)
+    if complete or len(box[2]) == 1:
+        return raw_results, complete
 
-    hashes = pipe.execute()
+    pipe = r.pipeline()
+    queued = _queue_box_ranges(pipe, box, None, shards)
+    return _merge_box_results(pipe.execute(), box, queued, count)
 
-    now_ts = int(time.time())
-    results: List[dict] = []
 
-    for (member_bytes, dist, coords), h in zip(raw_results, hashes):
-        if not h:
-            continue
+async def _asearch_box_any(
+    r,
+    min_lat: float,
+    min_lon: float,
+    max_lat: float,
+    max_lon: float,
+    count: int,
+) -> list:
+    """Async _search_box_any."""
+    box = _box_ranges(min_lat, min_lon, max_lat, max_lon)
+    shards = await _aregistered_shards()
+    pipe = r.pipeline()
+    queued = _queue_box_ranges(pipe, box, count, shards)
+    raw_results, complete = _merge_box_results(await pipe.execute(), box, queued, count)
+    if complete or len(box[2]) == 1:
+        return raw_results, complete
 
-        member = member_bytes.decode("utf-8")
-        actor_type, actor_id = member.split(":", 1)
+    pipe = r.pipeline()
+    queued = _queue_box_ranges(pipe, box, None, shards)
+    return _merge_box_results(await pipe.execute(), box, queued, count)
+
+
+def _box_ranges(min_lat, min_lon, max_lat, max_lon):
+    """(min_lat, max_lat, [(west, east), ...]) of a box clamped to the geo index and split at the antimeridian."""
+    min_lat_f = max(float(min_lat), -GEO_MAX_LAT)
+    max_lat_f = min(float(max_lat), GEO_MAX_LAT)
+    min_lon_f = float(min_lon)
+    max_lon_f = float(max_lon)
+
+    if min_lon_f <= max_lon_f:
+        ranges = [(min_lon_f, max_lon_f)]
+    else:
+        ranges = [(min_lon_f, 180.0), (-180.0, max_lon_f)]
+    return min_lat_f, max_lat_f, ranges
+
+
+def _queue_box_ranges(pipe, box, count: Optional[int], shards: tuple) -> List[List[str]]:
+    """Queue the searches of a _box_ranges box; returns the keys searched per range."""
+    min_lat_f, max_lat_f, ranges = box
+    return [_queue_search_box(pipe, min_lat_f, west, max_lat_f, east, count, shards) for west, east in ranges]
+
+
+def _merge_box_results(shard_results: list, box, queued: List[List[str]], count: int):
+    min_lat_f, max_lat_f, ranges = box
+    shard_results = iter(shard_results)
+
+    raw_results = []
+    complete = True
+    for (west, east), keys in zip(ranges, queued):
+        for _ in keys:
+            results = next(shard_results)
+            complete = complete and len(results) < count
+            raw_results.extend(
+                res for res in results
+                if min_lat_f <= res[2][1] <= max_lat_f and west <= res[2][0] <= east
+            )
+    if len(ranges) > 1:
+        # Each half was searched from its own centre; re-measure from the real one.
+        center_lat = (min_lat_f + max_lat_f) / 2.0
+        center_lon = ((ranges[0][0] + ranges[1][1]) / 2.0 + 360.0) % 360.0 - 180.0
+        raw_results = [
+            (res[0], _haversine_km(center_lat, center_lon, res[2][1], res[2][0]), res[2])
+            for res in raw_results
+        ]
+    raw_results.sort(key=lambda res: res[1])
+    return _unique_members(raw_results)[:count], complete
+
+
+def get_actors_in_box(
+    min_lat: float,
+    min_lon: float,
+    max_lat: float,
+    max_lon: float,
+    *,
+    max_results: int = 200,
+    include_types: Optional[List[ActorType]] = None,
+) -> List[dict]:
+    """
+    Return actors inside a lat/lon bounding box (e.g. the client viewport).
+
+    Results are ordered by distance from the box centre, so max_results
+    keeps the actors closest to the middle of the view. A box whose
+    min_lon is greater than max_lon is treated as crossing the antimeridian.
+    dist_km is measured from the centre of the searched box.
+    """
+    return _actors_in_box(min_lat, min_lon, max_lat, max_lon, max_results, include_types)[0]
+
+
+async def aget_actors_in_box(
+    min_lat: float,
+    min_lon: float,
+    max_lat: float,
+    max_lon: float,
+    *,
+    max_results: int = 200,
+    include_types: Optional[List[ActorType]] = None,
+) -> List[dict]:
+    """Async get_actors_in_box."""
+    return (await _aactors_in_box(min_lat, min_lon, max_lat, max_lon, max_results, include_types))[0]
 
+
+def _actors_in_box(min_lat, min_lon, max_lat, max_lon, max_results, include_types):
+    """get_actors_in_box returning (actors, complete); see _search_box_any."""
+    r = get_redis_connection("default")
+    raw_results, complete = _search_box_any(r, min_lat, min_lon, max_lat, max_lon, max_results)
+    return _hydrate_actors(r, raw_results, include_types), complete
+
+
+async def _aactors_in_box(min_lat, min_lon, max_lat, max_lon, max_results, include_types):
+    """Async _actors_in_box."""
+    r = get_async_redis()
+    raw_results, complete = await _asearch_box_any(r, min_lat, min_lon, max_lat, max_lon, max_results)
+    return await _ahydrate_actors(r, raw_results, include_types), complete
+
+
+def get_actor_points_in_box(
+    min_lat: float,
+    min_lon: float,
+    max_lat: float,
+    max_lon: float,
+    *,
+    max_results: int = 10000,
+    include_types: Optional[List[ActorType]] = None,
+    max_age_seconds: int = STALE_SECONDS,
+) -> Tuple[List[dict], bool]:
+    """
+    Return (points, complete): bare {type, id, lat, lon} points inside a
+    bounding box.
+
+    Coordinates come straight from the geo index without reading the
+    per-actor hashes, which makes this cheap enough for aggregate views
+    over many actors. Members not seen for max_age_seconds (by the
+    last-seen index) are left out even before they are pruned. complete
+    is False when max_results cut the search off, i.e. points may be
+    missing.
+    """
+    r = get_redis_connection("default")
+    box = _box_ranges(min_lat, min_lon, max_lat, max_lon)
+    pipe = r.pipeline()
+    queued = _queue_box_ranges(pipe, box, max_results, _registered_shards())
+    shard_results = pipe.execute()
+
+    pipe = r.pipeline(transaction=False)
+    _queue_seen_scores(pipe, shard_results, queued)
+    live_results = _drop_stale(shard_results, pipe.execute(), max_age_seconds)
+    raw_results, _ = _merge_box_results(live_results, box, queued, max_results)
+    return _points_from_results(raw_results, include_types), _all_below(shard_results, max_results)
+
+
+async def aget_actor_points_in_box(
+    min_lat: float,
+    min_lon: float,
+    max_lat: float,
+    max_lon: float,
+    *,
+    max_results: int = 10000,
+    include_types: Optional[List[ActorType]] = None,
+    max_age_seconds: int = STALE_SECONDS,
+) -> Tuple[List[dict], bool]:
+    """Async get_actor_points_in_box."""
+    r = get_async_redis()
+    box = _box_ranges(min_lat, min_lon, max_lat, max_lon)
+    pipe = r.pipeline()
+    queued = _queue_box_ranges(pipe, box, max_results, await _aregistered_shards())
+    shard_results = await pipe.execute()
+
+    pipe = r.pipeline(transaction=False)
+    _queue_seen_scores(pipe, shard_results, queued)
+    live_results = _drop_stale(shard_results, await pipe.execute(), max_age_seconds)
+    raw_results, _ = _merge_box_results(live_results, box, queued, max_results)
+    return _points_from_results(raw_results, include_types), _all_below(shard_results, max_results)
+
+
+def _queue_seen_scores(pipe, shard_results: list, queued: List[List[str]]) -> None:
+    """Queue ZMSCORE of each non-empty shard result list against the shard's last-seen index."""
+    keys = [key for range_keys in queued for key in range_keys]
+    for key, results in zip(keys, shard_results):
+        if results:
+            pipe.zmscore(_seen_key_for(key), [res[0] for res in results])
+
+
+def _drop_stale(shard_results: list, scores: list, max_age_seconds: int) -> list:
+    """Remove results missing from the last-seen index or older than max_age_seconds."""
+    cutoff = time.time() - max_age_seconds
+    scores = iter(scores)
+    live = []
+    for results in shard_results:
+        if results:
+            results = [res for res, seen in zip(results, next(scores)) if seen is not None and seen >= cutoff]
+        live.append(results)
+    return live
+
+
+def _all_below(shard_results: list, count: int) -> bool:
+    """True when no shard search hit `count`, i.e. nothing was cut off."""
+    return all(len(results) < count for results in shard_results)
+
+
+def _points_from_results(raw_results: list, include_types: Optional[List[ActorType]]) -> List[dict]:
+    points: List[dict] = []
+    for member_bytes, dist, coords in raw_results:
+        actor_type, actor_id = member_bytes.decode("utf-8").split(":", 1)
         if include_types is not None and actor_type not in include_types:
             continue
+        points.append({
+            "type": actor_type,
+            "id": actor_id,
+            "lat": float(coords[1]),
+            "lon": float(coords[0]),
+        })
+    return points
 
-        decoded = {k.decode("utf-8"): v.decode("utf-8") for k, v in h.items()}
 
-        ts_str = decoded.get("ts")
-        try:
-            ts = int(ts_str) if ts_str is not None else None
-        except ValueError:
-            ts = None
+def _haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
 
-        if ts is None or now_ts - ts > STALE_SECONDS:
-            continue
 
-        try:
-            lat_val = float(decoded["lat"])
-            lon_val = float(decoded["lon"])
-        except (KeyError, ValueError):
-            continue
+def _types_key(include_types: Optional[List[ActorType]]):
+    return None if include_types is None else tuple(sorted(include_types))
 
-        item: dict = {
-            "type": decoded.get("type") or actor_type,
-            "id": actor_id,
-            "lat": lat_val,
-            "lon": lon_val,
-            "dist_km": float(dist),
-            "ts": ts,
-        }
-        if "alt" in decoded:
-            try:
-                item["alt"] = float(decoded["alt"])
-            except ValueError:
-                pass
-        if "name" in decoded:
-            item["name"] = decoded["name"]
-        if "heading" in decoded:
-            try:
-                item["heading"] = float(decoded["heading"])
-            except ValueError:
-                pass
-        if "speed" in decoded:
-            try:
-                item["speed"] = float(decoded["speed"])
-            except ValueError:
-                pass
-        if "op" in decoded:
-            item["op"] = decoded["op"]
 
-        results.append(item)
+def get_nearby_actors_cached(
+    lat: float,
+    lon: float,
+    radius_km: float,
+    *,
+    max_results: int = 200,
+    include_types: Optional[List[ActorType]] = None,
+) -> List[dict]:
+    """
+    get_nearby_actors served from a short-lived per-process snapshot.
 
+    The centre is snapped to a SNAPSHOT_GRID_DEGREES grid and the radius
+    to a power of two (enlarged to cover the snapping error), so callers
+    with nearly identical queries share one Redis round trip. Results are
+    then filtered and re-measured against the exact query.
+
+    Snapshots hold up to SNAPSHOT_NEARBY_OVERFETCH times max_results
+    actors. One that was cut off is still complete up to its farthest
+    actor, so it answers every caller whose max_results nearest lie inside
+    that reach; other callers get the exact query, cached under its own key.
+    """
+    key, cell_lat, cell_lon, radius_bucket = _nearby_snapshot_query(lat, lon, radius_km, max_results, include_types)
+    snapshot = _snapshot_cache.get_or_load(
+        key,
+        lambda: _nearby_actors(cell_lat, cell_lon, radius_bucket, max_results * SNAPSHOT_NEARBY_OVERFETCH, include_types),
+    )
+    results = _filter_nearby_snapshot(snapshot, cell_lat, cell_lon, lat, lon, radius_km, max_results)
+    if results is None:
+        results = _snapshot_cache.get_or_load(
+            _exact_nearby_key(lat, lon, radius_km, max_results, include_types),
+            lambda: get_nearby_actors(lat, lon, radius_km, max_results=max_results, include_types=include_types),
+        )
     return results
+
+
+async def aget_nearby_actors_cached(
+    lat: float,
+    lon: float,
+    radius_km: float,
+    *,
+    max_results: int = 200,
+    include_types: Optional[List[ActorType]] = None,
+) -> List[dict]:
+    """Async get_nearby_actors_cached (shares the same snapshot cache)."""
+    key, cell_lat, cell_lon, radius_bucket = _nearby_snapshot_query(lat, lon, radius_km, max_results, include_types)
+    snapshot = await _snapshot_cache.aget_or_load(
+        key,
+        lambda: _anearby_actors(cell_lat, cell_lon, radius_bucket, max_results * SNAPSHOT_NEARBY_OVERFETCH, include_types),
+    )
+    results = _filter_nearby_snapshot(snapshot, cell_lat, cell_lon, lat, lon, radius_km, max_results)
+    if results is None:
+        results = await _snapshot_cache.aget_or_load(
+            _exact_nearby_key(lat, lon, radius_km, max_results, include_types),
+            lambda: aget_nearby_actors(lat, lon, radius_km, max_results=max_results, include_types=include_types),
+        )
+    return results
+
+
+def _nearby_snapshot_query(lat, lon, radius_km, max_results, include_types):
+    """Return (cache key, snapped lat, snapped lon, radius bucket) for a nearby query."""
+    radius = float(radius_km)
+    cell_lat = round(float(lat) / SNAPSHOT_GRID_DEGREES) * SNAPSHOT_GRID_DEGREES
+    cell_lon = round(float(lon) / SNAPSHOT_GRID_DEGREES) * SNAPSHOT_GRID_DEGREES
+    snap_error_km = SNAPSHOT_GRID_DEGREES * KM_PER_DEGREE
+    radius_bucket = 2 ** math.ceil(math.log2(max(radius + snap_error_km, 0.001)))
+
+    key = ("radius", round(cell_lat, 6), round(cell_lon, 6), radius_bucket, max_results, _types_key(include_types))
+    return key, cell_lat, cell_lon, radius_bucket
+
+
+def _exact_nearby_key(lat, lon, radius_km, max_results, include_types):
+    return ("radius_exact", float(lat), float(lon), float(radius_km), max_results, _types_key(include_types))
+
+
+def _filter_nearby_snapshot(
+    snapshot: tuple,
+    cell_lat: float,
+    cell_lon: float,
+    lat,
+    lon,
+    radius_km,
+    max_results: int,
+) -> Optional[List[dict]]:
+    """
+    Answer a nearby query from a (actors, complete) snapshot taken around
+    (cell_lat, cell_lon), or None when the snapshot may be missing some of
+    the caller's max_results nearest.
+    """
+    actors, complete = snapshot
+    lat_f = float(lat)
+    lon_f = float(lon)
+    radius = float(radius_km)
+
+    results: List[dict] = []
+    for a in actors:
+        dist = _haversine_km(lat_f, lon_f, a["lat"], a["lon"])
+        if dist <= radius:
+            results.append({**a, "dist_km": dist})
+    results.sort(key=lambda a: a["dist_km"])
+    results = results[:max_results]
+    if complete:
+        return results
+
+    # Every actor nearer the snapped centre than the farthest snapshot
+    # actor is in the snapshot; seen from the caller that reach shrinks
+    # by the distance between the two centres.
+    if not actors or len(results) < max_results:
+        return None
+    farthest = max(_haversine_km(cell_lat, cell_lon, a["lat"], a["lon"]) for a in actors)
+    reach = farthest - _haversine_km(cell_lat, cell_lon, lat_f, lon_f)
+    if results[-1]["dist_km"] >= reach:
+        return None
+    return results
+
+
+def _snap_down(value: float, step: float) -> float:
+    return math.floor(value / step) * step
+
+
+def _snap_up(value: float, step: float) -> float:
+    return math.ceil(value / step) * step
+
+
+def get_actors_in_box_cached(
+    min_lat: float,
+    min_lon: float,
+    max_lat: float,
+    max_lon: float,
+    *,
+    max_results: int = 200,
+    include_types: Optional[List[ActorType]] = None,
+) -> List[dict]:
+    """
+    get_actors_in_box served from a short-lived per-process snapshot.
+
+    The box is expanded outward to a power-of-two degree grid scaled to its
+    size, so similar viewports share one Redis round trip; results are then
+    clipped to the exact box. A snapshot cut off at max_results is not
+    used; the exact box is queried instead, cached under its own key.
+    """
+    box = (float(min_lat), float(min_lon), float(max_lat), float(max_lon))
+    key, q_box = _box_snapshot_query(*box, max_results, include_types)
+    snapshot, complete = _snapshot_cache.get_or_load(
+        key,
+        lambda: _actors_in_box(*q_box, max_results, include_types),
+    )
+    if not complete:
+        return _snapshot_cache.get_or_load(
+            ("box_exact", *box, max_results, _types_key(include_types)),
+            lambda: get_actors_in_box(*box, max_results=max_results, include_types=include_types),
+        )
+    return _clip_box_snapshot(snapshot, *box, max_results)
+
+
+async def aget_actors_in_box_cached(
+    min_lat: float,
+    min_lon: float,
+    max_lat: float,
+    max_lon: float,
+    *,
+    max_results: int = 200,
+    include_types: Optional[List[ActorType]] = None,
+) -> List[dict]:
+    """Async get_actors_in_box_cached (shares the same snapshot cache)."""
+    box = (float(min_lat), float(min_lon), float(max_lat), float(max_lon))
+    key, q_box = _box_snapshot_query(*box, max_results, include_types)
+    snapshot, complete = await _snapshot_cache.aget_or_load(
+        key,
+        lambda: _aactors_in_box(*q_box, max_results, include_types),
+    )
+    if not complete:
+        return await _snapshot_cache.aget_or_load(
+            ("box_exact", *box, max_results, _types_key(include_types)),
+            lambda: aget_actors_in_box(*box, max_results=max_results, include_types=include_types),
+        )
+    return _clip_box_snapshot(snapshot, *box, max_results)
+
+
+def _box_snapshot_query(min_lat_f, min_lon_f, max_lat_f, max_lon_f, max_results, include_types):
+    """Return (cache key, snapped (min_lat, min_lon, max_lat, max_lon)) for a box query."""
+    lon_span = max_lon_f - min_lon_f if min_lon_f <= max_lon_f else 360.0 - (min_lon_f - max_lon_f)
+    span = max(max_lat_f - min_lat_f, lon_span)
+    step = max(SNAPSHOT_MIN_BOX_STEP, 2 ** math.ceil(math.log2(max(span / 4, 1e-9))))
+
+    q_min_lat = max(_snap_down(min_lat_f, step), -90.0)
+    q_max_lat = min(_snap_up(max_lat_f, step), 90.0)
+    q_min_lon = max(_snap_down(min_lon_f, step), -180.0)
+    q_max_lon = min(_snap_up(max_lon_f, step), 180.0)
+    crosses = min_lon_f > max_lon_f
+    if crosses and q_min_lon <= q_max_lon:
+        # Snapping closed the antimeridian gap; search the whole band.
+        q_min_lon, q_max_lon = -180.0, 180.0
+
+    key = ("box", q_min_lat, q_min_lon, q_max_lat, q_max_lon, max_results, _types_key(include_types))
+    return key, (q_min_lat, q_min_lon, q_max_lat, q_max_lon)
+
+
+def _clip_box_snapshot(snapshot: List[dict], min_lat_f, min_lon_f, max_lat_f, max_lon_f, max_results: int) -> List[dict]:
+    crosses = min_lon_f > max_lon_f
+    center_lat = (min_lat_f + max_lat_f) / 2.0
+    center_lon = (min_lon_f + max_lon_f) / 2.0
+    if crosses:
+        center_lon = (center_lon + 360.0) % 360.0 - 180.0
+
+    results: List[dict] = []
+    for a in snapshot:
+        if not (min_lat_f <= a["lat"] <= max_lat_f):
+            continue
+        if crosses:
+            if not (a["lon"] >= min_lon_f or a["lon"] <= max_lon_f):
+                continue
+        elif not (min_lon_f <= a["lon"] <= max_lon_f):
+            continue
+        results.append({**a, "dist_km": _haversine_km(center_lat, center_lon, a["lat"], a["lon"])})
+
+    results.sort(key=lambda a: a["dist_km"])
+    return results[:max_results]
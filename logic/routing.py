@@ -3,4 +3,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r"^ws/chat/$", consumers.DirectChatConsumer.as_asgi()),
+    re_path(r"^ws/positions/$", consumers.PositionConsumer.as_asgi()),
 ]
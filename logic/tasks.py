@@ -0,0 +1,26 @@
+import logging
+
+from celery import shared_task
+
+from .redis_positions import prune_stale_actors
+from .utils.presence import prune_presence
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True)
+def prune_stale_actors_task():
+    """Drop expired actors from the geo index (run by celery beat)."""
+    removed = prune_stale_actors()
+    if removed:
+        logger.info(f"Pruned {removed} stale actors from geo index")
+    return removed
+
+
+@shared_task(ignore_result=True)
+def prune_presence_task():
+    """Drop users whose sockets stopped heartbeating (run by celery beat)."""
+    removed = prune_presence()
+    if removed:
+        logger.info(f"Pruned {removed} stale users from presence")
+    return removed
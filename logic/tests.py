@@ -1 +1,67 @@
+import unittest
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Q
 from django.test import TestCase
+from django.utils import timezone
+
+from logic.models import Conversation, Message
+
+User = get_user_model()
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'EXPLAIN output is PostgreSQL specific')
+class ChatQueryPlanTests(TestCase):
+    """The chat endpoints' queries are served by their indexes, not table scans."""
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create([
+            User(username=f'plan_{i}', email=f'plan_{i}@example.invalid', password='!')
+            for i in range(20)
+        ])
+        cls.user, cls.peer = users[0], users[1]
+
+        messages = []
+        for i in range(5000):
+            sender = users[i % len(users)]
+            receiver = users[(i * 7 + 1) % len(users)]
+            if sender == receiver:
+                continue
+            # Mostly read messages, as in a real table.
+            read_at = None if i % 20 == 0 else timezone.now()
+            messages.append(Message(sender=sender, receiver=receiver, content='x', read_at=read_at))
+        for i in range(40):
+            sender, receiver = (users[0], users[1]) if i % 2 else (users[1], users[0])
+            messages.append(Message(sender=sender, receiver=receiver, content='x', read_at=None if i < 10 else timezone.now()))
+        Message.objects.bulk_create(messages, batch_size=1000)
+        Conversation.objects.bulk_create([
+            Conversation(user=users[0], peer=other) for other in users[1:]
+        ])
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE logic_message')
+            cursor.execute('ANALYZE logic_conversation')
+            # Tiny test tables would otherwise always be cheapest to scan;
+            # this still lets the planner choose between indexes.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, qs, index_name):
+        plan = qs.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_history_uses_pair_index(self):
+        qs = Message.objects.filter(
+            Q(sender=self.user, receiver=self.peer) | Q(sender=self.peer, receiver=self.user)
+        ).order_by('-created_at', '-id')[:51]
+        self.assertUsesIndex(qs, 'message_pair_created')
+
+    def test_mark_read_uses_unread_index(self):
+        qs = Message.objects.filter(sender=self.peer, receiver=self.user, read_at__isnull=True)
+        self.assertUsesIndex(qs, 'message_unread_by_pair')
+
+    def test_threads_use_recent_conversation_index(self):
+        qs = Conversation.objects.filter(user=self.user).order_by('-last_time')[:50]
+        self.assertUsesIndex(qs, 'conversation_user_recent')
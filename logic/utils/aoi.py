@@ -0,0 +1,155 @@
+"""
+Area-of-interest partitioning for live position fan-out.
+
+Positions are published to one channel-layer group per geohash cell
+(AOI_PRECISION characters) and each PositionConsumer joins only the groups
+for the cells covering its view plus one ring of neighbours.
+"""
+import logging
+import math
+
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+AOI_PRECISION = 4
+# Views needing more cells than this fall back to periodic snapshots.
+AOI_MAX_CELLS = 64
+AOI_GROUP_PREFIX = "pos_cell_"
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat: float, lon: float, precision: int = AOI_PRECISION) -> str:
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    out = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(out) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_lo = mid
+            else:
+                bits <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_lo = mid
+            else:
+                bits <<= 1
+                lat_hi = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            out.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(out)
+
+
+def cell_size_degrees(precision: int = AOI_PRECISION):
+    """Return (lat_degrees, lon_degrees) spanned by one geohash cell."""
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = math.floor(precision * 5 / 2)
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+def geohash_bounds(cell: str):
+    """Return (min_lat, min_lon, max_lat, max_lon) of a geohash cell."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    even = True
+    for ch in cell:
+        bits = _BASE32.index(ch)
+        for shift in range(4, -1, -1):
+            bit = (bits >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                if bit:
+                    lon_lo = mid
+                else:
+                    lon_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if bit:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lat_lo, lon_lo, lat_hi, lon_hi
+
+
+def cell_group(cell: str) -> str:
+    return f"{AOI_GROUP_PREFIX}{cell}"
+
+
+def _lon_ranges(west: float, east: float):
+    if west <= east:
+        return [(west, east)]
+    return [(west, 180.0), (-180.0, east)]
+
+
+def cells_for_bbox(bbox, precision: int = AOI_PRECISION):
+    """
+    Return the set of cells covering bbox plus one ring of neighbours, or
+    None when that would exceed AOI_MAX_CELLS.
+    """
+    west, south, east, north = bbox
+    dlat, dlon = cell_size_degrees(precision)
+
+    south = max(south - dlat, -90.0)
+    north = min(north + dlat, 90.0)
+    ranges = _lon_ranges(west, east)
+
+    rows = math.floor(north / dlat) - math.floor(south / dlat) + 1
+    cols = sum(math.floor(e / dlon) - math.floor(w / dlon) + 3 for w, e in ranges)
+    if rows * cols > AOI_MAX_CELLS:
+        return None
+
+    cells = set()
+    for w, e in ranges:
+        for row in range(math.floor(south / dlat), math.floor(north / dlat) + 1):
+            lat = min((row + 0.5) * dlat, 90.0 - dlat / 2)
+            for col in range(math.floor(w / dlon) - 1, math.floor(e / dlon) + 2):
+                lon = (col + 0.5) * dlon
+                lon = (lon + 180.0) % 360.0 - 180.0
+                cells.add(geohash_encode(lat, lon, precision))
+    return cells
+
+
+def bbox_contains(bbox, lat: float, lon: float) -> bool:
+    west, south, east, north = bbox
+    if not (south <= lat <= north):
+        return False
+    return any(w <= lon <= e for w, e in _lon_ranges(west, east))
+
+
+def _group_by_cell(items):
+    by_cell = {}
+    for item in items:
+        cell = geohash_encode(item["lat"], item["lon"])
+        by_cell.setdefault(cell, []).append(item)
+    return by_cell
+
+
+async def publish_positions(items) -> None:
+    """Send map items to the AOI group of the cell each one is in."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    for cell, cell_items in _group_by_cell(items).items():
+        try:
+            await channel_layer.group_send(
+                cell_group(cell),
+                {"type": "position.moved", "items": cell_items},
+            )
+        except Exception as e:
+            logger.warning(f"Error publishing positions to {cell}: {e}")
@@ -0,0 +1,30 @@
+import asyncio
+import weakref
+
+import redis.asyncio as aioredis
+from django.conf import settings
+
+# Async clients get one connection pool per event loop.
+ASYNC_MAX_CONNECTIONS = 100
+_async_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aioredis.ConnectionPool]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_async_redis() -> aioredis.Redis:
+    """
+    Return a redis.asyncio client for the running event loop.
+
+    Uses the same server as the django_redis "default" cache. Pools are
+    kept per loop because asyncio connections cannot be shared between
+    loops (e.g. async_to_sync calls each run their own).
+    """
+    loop = asyncio.get_running_loop()
+    pool = _async_pools.get(loop)
+    if pool is None:
+        location = settings.CACHES["default"]["LOCATION"]
+        if isinstance(location, (list, tuple)):
+            location = location[0]
+        pool = aioredis.ConnectionPool.from_url(location, max_connections=ASYNC_MAX_CONNECTIONS)
+        _async_pools[loop] = pool
+    return aioredis.Redis(connection_pool=pool)
@@ -0,0 +1,18 @@
+"""
+Measurement helpers shared by the bench_positions and bench_chat commands.
+"""
+import math
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank pct percentile of an ascending list; 0.0 when empty."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def redis_calls(r):
+    """Total commands executed by Redis so far (INFO commandstats, excluding INFO)."""
+    stats = r.info("commandstats")
+    return sum(v["calls"] for k, v in stats.items() if k != "cmdstat_info")
@@ -0,0 +1,103 @@
+"""
+Shared Redis cache of chat recipient data: usernames and block lists.
+
+chat:uname:<id> holds a user's username; block lists are the "blocked"
+sets of utils.friend_graph. Views that change Friend rows with status
+"blocked" call invalidate_blocks, which drops the shared entries and
+tells connected DirectChatConsumers of both users to drop their
+per-connection copies.
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+
+from logic.utils import friend_graph
+from logic.utils.async_redis import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+CHAT_CACHE_TTL_SECONDS = 24 * 3600
+
+
+def _uname_key(user_id) -> str:
+    return f"chat:uname:{user_id}"
+
+
+def user_keys(user_id):
+    """Redis keys this module keeps for user_id, e.g. for cleanup."""
+    return [_uname_key(user_id)]
+
+
+def _load_recipient(to_id, load_name, load_blocks):
+    """Read the missing parts from the DB: (username or None, friend_graph relations or None)."""
+    name = None
+    if load_name:
+        name = User.objects.filter(id=to_id).values_list("username", flat=True).first()
+    relations = None
+    if load_blocks:
+        relations = friend_graph.load_relations(to_id)
+    return name, relations
+
+
+async def aget_recipient(from_id, to_id):
+    """
+    Return (receiver username or None if no such user, True if to_id blocked from_id).
+
+    One Redis round trip when cached; otherwise one DB hop, after which
+    the result is cached.
+    """
+    r = get_async_redis()
+    pipe = r.pipeline(transaction=False)
+    pipe.get(_uname_key(to_id))
+    pipe.exists(*friend_graph.graph_keys(to_id))
+    pipe.get(friend_graph.generation_key(to_id))
+    pipe.sismember(friend_graph.relation_key(to_id, "blocked"), str(from_id))
+    name, loaded_sets, generation, blocked = await pipe.execute()
+    blocks_cached = loaded_sets == len(friend_graph.RELATION_KINDS)
+
+    if name is not None and blocks_cached:
+        return name.decode("utf-8"), bool(blocked)
+
+    db_name, relations = await database_sync_to_async(_load_recipient)(
+        to_id,
+        name is None,
+        not blocks_cached,
+    )
+    if name is None:
+        if db_name is None:
+            return None, False
+        name = db_name
+    else:
+        name = name.decode("utf-8")
+
+    pipe = r.pipeline(transaction=False)
+    pipe.set(_uname_key(to_id), name, ex=CHAT_CACHE_TTL_SECONDS)
+    if not blocks_cached:
+        friend_graph.queue_store(pipe, to_id, relations, generation)
+        blocked = int(from_id) in relations["blocked"]
+    await pipe.execute()
+
+    return name, bool(blocked)
+
+
+def invalidate_blocks(*user_ids):
+    """Drop cached block lists of user_ids (shared and per-connection) after Friend changes."""
+    friend_graph.invalidate(*user_ids)
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    ids = [int(user_id) for user_id in user_ids]
+    for user_id in ids:
+        try:
+            async_to_sync(channel_layer.group_send)(
+                f"user_{user_id}",
+                {"type": "chat.blocks_changed", "user_ids": ids},
+            )
+        except Exception as e:
+            logger.warning(f"Error notifying user_{user_id} of block change: {e}")
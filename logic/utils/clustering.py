@@ -0,0 +1,44 @@
+import math
+
+# Web map zoom level below which actors are aggregated into grid cells.
+CLUSTER_MAX_ZOOM = 10
+# Grid cells per map tile edge; higher values give finer clusters.
+CLUSTER_GRID_DIVISIONS = 8
+
+
+def cluster_cell_degrees(zoom: int, divisions: int = CLUSTER_GRID_DIVISIONS) -> float:
+    """Grid cell size in degrees for a zoom level (a tile spans 360 / 2**zoom)."""
+    return 360.0 / (2 ** zoom) / divisions
+
+
+def cluster_points(points, zoom: int, divisions: int = CLUSTER_GRID_DIVISIONS) -> list:
+    """
+    Bucket {lat, lon} points into a regular lat/lon grid.
+
+    Returns one dict per non-empty cell with the member count and centroid.
+    Cell edges are aligned to multiples of the cell size, so no cell crosses
+    the antimeridian.
+    """
+    cell = cluster_cell_degrees(zoom, divisions)
+    buckets = {}
+
+    for p in points:
+        lat = p["lat"]
+        lon = p["lon"]
+        key = (math.floor(lat / cell), math.floor(lon / cell))
+        b = buckets.get(key)
+        if b is None:
+            b = buckets[key] = [0, 0.0, 0.0]
+        b[0] += 1
+        b[1] += lat
+        b[2] += lon
+
+    clusters = []
+    for (row, col), (count, lat_sum, lon_sum) in buckets.items():
+        clusters.append({
+            "id": f"cluster:{zoom}:{row}:{col}",
+            "count": count,
+            "lat": lat_sum / count,
+            "lon": lon_sum / count,
+        })
+    return clusters
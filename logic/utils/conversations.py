@@ -0,0 +1,66 @@
+"""
+Maintenance of the denormalized Conversation table.
+
+Every message touches two rows: the sender's (user=sender, peer=receiver)
+and the receiver's (user=receiver, peer=sender), which also gains one
+unread. Callers run record_messages in the same transaction that saves
+the messages, so thread lists never disagree with Message rows.
+
+Both functions are single conditional UPDATEs, so concurrent batches and
+mark_read calls never overwrite each other's changes.
+"""
+from collections import defaultdict
+
+from django.db.models import BigIntegerField, Case, F, Q, Value, When
+from django.db.models.functions import Greatest
+
+from logic.models import Conversation
+
+
+def record_messages(messages):
+    """
+    Point both sides' Conversation rows at the newest of `messages` (saved,
+    in send order), unless a newer message is already recorded.
+    """
+    latest = {}
+    unread = defaultdict(int)
+    for msg in messages:
+        latest[(msg.sender_id, msg.receiver_id)] = msg
+        latest[(msg.receiver_id, msg.sender_id)] = msg
+        unread[(msg.receiver_id, msg.sender_id)] += 1
+
+    Conversation.objects.bulk_create(
+        [
+            Conversation(user_id=user_id, peer_id=peer_id)
+            for user_id, peer_id in latest
+        ],
+        ignore_conflicts=True,
+    )
+    # Fixed order, so concurrent batches lock rows the same way round.
+    for (user_id, peer_id), msg in sorted(latest.items()):
+        newer = (
+            Q(last_time__isnull=True)
+            | Q(last_time__lt=msg.created_at)
+            | Q(last_time=msg.created_at, last_message_id__lt=msg.pk)
+        )
+        Conversation.objects.filter(user_id=user_id, peer_id=peer_id).update(
+            last_message_id=Case(
+                When(newer, then=Value(msg.pk)),
+                default=F('last_message_id'),
+                output_field=BigIntegerField(),
+            ),
+            last_time=Case(When(newer, then=Value(msg.created_at)), default=F('last_time')),
+            unread_count=F('unread_count') + unread[(user_id, peer_id)],
+        )
+
+
+def mark_read(user_id, peer_id, count):
+    """
+    Take `count` messages just marked read off user_id's unread count for
+    the thread with peer_id. Messages arriving meanwhile stay counted.
+    """
+    if count <= 0:
+        return
+    Conversation.objects.filter(user_id=user_id, peer_id=peer_id).update(
+        unread_count=Greatest(F('unread_count') - count, 0),
+    )
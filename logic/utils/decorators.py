@@ -1,5 +1,13 @@
+import os
 from functools import wraps
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
 from django.http import JsonResponse
+from django.utils.module_loading import import_string
+from django_ratelimit.core import is_ratelimited
+from django_ratelimit.exceptions import Ratelimited
+
+INTERNAL_API_SECRET = os.environ.get("INTERNAL_API_SECRET", "")
 
 
 def login_required_json(view_func):
@@ -10,3 +18,51 @@ def login_required_json(view_func):
             return JsonResponse({"ok": False, "error": "AUTH_REQUIRED"}, status=401)
         return view_func(request, *args, **kwargs)
     return wrapper
+
+
+def _has_internal_secret(request):
+    secret = request.headers.get('X-Internal-Secret', '')
+    return bool(INTERNAL_API_SECRET) and secret == INTERNAL_API_SECRET
+
+
+def require_internal_secret(view_func):
+    """Require internal API secret for server-to-server calls."""
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            if not _has_internal_secret(request):
+                return JsonResponse({"ok": False, "error": "FORBIDDEN"}, status=403)
+            return await view_func(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not _has_internal_secret(request):
+            return JsonResponse({"ok": False, "error": "FORBIDDEN"}, status=403)
+        return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def async_ratelimit(key, rate):
+    """
+    django_ratelimit's ratelimit(block=True) for async views.
+
+    The limit check uses the sync Django cache, so it runs via sync_to_async.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            limited = await sync_to_async(is_ratelimited)(
+                request=request,
+                fn=view_func,
+                key=key,
+                rate=rate,
+                increment=True,
+            )
+            request.limited = limited or getattr(request, 'limited', False)
+            if limited:
+                cls = getattr(settings, 'RATELIMIT_EXCEPTION_CLASS', Ratelimited)
+                raise (import_string(cls) if isinstance(cls, str) else cls)()
+            return await view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,131 @@
+"""
+Per-user delivery sequence numbers and a bounded catch-up queue.
+
+Every message.new event for a user gets the next number from chat:seq:<id>
+and is kept in the sorted set chat:inbox:<id> (score = seq, member =
+"<seq>:<json>"), trimmed to PENDING_MAX_EVENTS. Clients remember the last
+seq they saw; after a reconnect they ask for everything since it in one
+call instead of reloading history. A client acknowledging seq N
+("delivered") drops events up to N.
+
+The counter itself has no TTL, so sequence numbers only grow: a counter
+that expired and restarted at 1 would make a client that stayed
+connected with a higher seq discard new events as already seen. It is one
+small key per user who ever received a message.
+"""
+import json
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django_redis import get_redis_connection
+
+from logic.utils.async_redis import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+PENDING_MAX_EVENTS = 500
+PENDING_TTL_SECONDS = 24 * 3600
+
+# ARGV[1] event JSON, ARGV[2] max events kept, ARGV[3] inbox TTL.
+_ENQUEUE_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('ZADD', KEYS[2], seq, seq .. ':' .. ARGV[1])
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -tonumber(ARGV[2]) - 1)
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return seq
+"""
+
+
+def _seq_key(user_id) -> str:
+    return f"chat:seq:{user_id}"
+
+
+def _inbox_key(user_id) -> str:
+    return f"chat:inbox:{user_id}"
+
+
+def user_keys(user_id):
+    """Redis keys this module keeps for user_id, e.g. for cleanup."""
+    return [_seq_key(user_id), _inbox_key(user_id)]
+
+
+def enqueue(user_id, event) -> int:
+    """Number `event` for user_id, keep it for catch-up and return its seq."""
+    r = get_redis_connection("default")
+    return int(r.eval(
+        _ENQUEUE_SCRIPT, 2, _seq_key(user_id), _inbox_key(user_id),
+        json.dumps(event), PENDING_MAX_EVENTS, PENDING_TTL_SECONDS,
+    ))
+
+
+def deliver_message(user_id, message) -> None:
+    """Queue a message.new for user_id and push it to their sockets (sync views)."""
+    try:
+        seq = enqueue(user_id, {"type": "message.new", "message": message})
+    except Exception as e:
+        logger.warning(f"Error queueing message for catch-up: {e}")
+        seq = None
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(
+            f"user_{user_id}",
+            {"type": "chat.message", "message": message, "seq": seq},
+        )
+    except Exception as e:
+        logger.warning(f"Error sending to user_{user_id}: {e}")
+
+
+async def aenqueue(user_id, event) -> int:
+    """enqueue for consumers."""
+    r = get_async_redis()
+    script = r.register_script(_ENQUEUE_SCRIPT)
+    seq = await script(
+        keys=[_seq_key(user_id), _inbox_key(user_id)],
+        args=[json.dumps(event), PENDING_MAX_EVENTS, PENDING_TTL_SECONDS],
+    )
+    return int(seq)
+
+
+async def aget_seq(user_id) -> int:
+    """Latest seq issued to user_id (0 if none)."""
+    r = get_async_redis()
+    return int(await r.get(_seq_key(user_id)) or 0)
+
+
+async def aget_since(user_id, since: int):
+    """
+    Return (events after `since` with their "seq", latest seq, complete).
+
+    complete is False when events after `since` were already trimmed or
+    expired; the client must then reload threads/history instead.
+    """
+    r = get_async_redis()
+    pipe = r.pipeline(transaction=False)
+    pipe.zrangebyscore(_inbox_key(user_id), f"({since}", "+inf")
+    pipe.get(_seq_key(user_id))
+    members, latest = await pipe.execute()
+    latest = int(latest or 0)
+
+    events = []
+    for member in members:
+        seq, _, data = member.decode("utf-8").partition(":")
+        event = json.loads(data)
+        event["seq"] = int(seq)
+        events.append(event)
+
+    if since < latest:
+        complete = bool(events) and events[0]["seq"] == since + 1
+    else:
+        # since > latest means the counter was reset (e.g. Redis flushed).
+        complete = since == latest
+    return events, latest, complete
+
+
+async def aack(user_id, seq: int) -> None:
+    """Drop queued events up to and including seq (the client has them)."""
+    r = get_async_redis()
+    await r.zremrangebyscore(_inbox_key(user_id), "-inf", seq)
@@ -0,0 +1,172 @@
+"""
+Redis cache of each user's Friend relationships.
+
+fg:<id>:<kind> is a set of user ids per RELATION_KINDS, plus
+LOADED_MARKER so an empty set is still a cache hit:
+
+  friends      accepted, either direction
+  pending_out  requests <id> sent
+  pending_in   requests <id> received
+  blocked      users <id> blocked
+  blocked_by   users who blocked <id>
+
+All sets of a user are loaded together from one Friend query on a miss.
+Views that change Friend rows call invalidate() for both users (through
+chat_cache.invalidate_blocks when blocks change) after the change is
+committed. invalidate() also bumps fg:<id>:gen; readers note it before
+loading and the store is skipped if it changed meanwhile, so a load that
+raced with an invalidation never caches the old relationships.
+"""
+from django.db.models import Q
+from django_redis import get_redis_connection
+
+from logic.models import Friend
+
+RELATION_KINDS = ("friends", "pending_out", "pending_in", "blocked", "blocked_by")
+# Precedence when several kinds apply to the same pair.
+STATUS_ORDER = ("blocked", "blocked_by", "friends", "pending_out", "pending_in")
+FRIEND_GRAPH_TTL_SECONDS = 3600
+LOADED_MARKER = "0"
+# Loads retried when invalidations keep racing with them.
+FRIEND_GRAPH_LOAD_ATTEMPTS = 3
+
+# KEYS[1] generation key, KEYS[2..] relation sets. ARGV[1] generation seen
+# before loading ("" if none), ARGV[2] TTL, ARGV[3] loaded marker,
+# ARGV[4..] member count per set, then the members of all sets in order.
+# Returns 0 without writing if the generation changed.
+_STORE_SCRIPT = """
+if (redis.call('GET', KEYS[1]) or '') ~= ARGV[1] then
+    return 0
+end
+local pos = 3 + #KEYS
+for k = 2, #KEYS do
+    local n = tonumber(ARGV[k + 2])
+    redis.call('DEL', KEYS[k])
+    redis.call('SADD', KEYS[k], ARGV[3])
+    for i = pos, pos + n - 1 do
+        redis.call('SADD', KEYS[k], ARGV[i])
+    end
+    pos = pos + n
+    redis.call('EXPIRE', KEYS[k], ARGV[2])
+end
+return 1
+"""
+
+
+def relation_key(user_id, kind) -> str:
+    return f"fg:{user_id}:{kind}"
+
+
+def generation_key(user_id) -> str:
+    return f"fg:{user_id}:gen"
+
+
+def graph_keys(user_id):
+    return [relation_key(user_id, kind) for kind in RELATION_KINDS]
+
+
+def load_relations(user_id) -> dict:
+    """Read user_id's relationships from the DB as {kind: set of ids}."""
+    user_id = int(user_id)
+    relations = {kind: set() for kind in RELATION_KINDS}
+    rows = Friend.objects.filter(
+        Q(user_id=user_id) | Q(friend_id=user_id)
+    ).values_list("user_id", "friend_id", "status")
+    for from_id, to_id, status in rows:
+        outgoing = from_id == user_id
+        other = to_id if outgoing else from_id
+        if status == "accepted":
+            relations["friends"].add(other)
+        elif status == "pending":
+            relations["pending_out" if outgoing else "pending_in"].add(other)
+        elif status == "blocked":
+            relations["blocked" if outgoing else "blocked_by"].add(other)
+    return relations
+
+
+def queue_store(pipe, user_id, relations, generation):
+    """
+    Queue writing `relations` (from load_relations) for user_id on pipe,
+    unless user_id's generation (read before loading) has changed.
+    """
+    counts, members = [], []
+    for kind in RELATION_KINDS:
+        counts.append(len(relations[kind]))
+        members.extend(str(i) for i in relations[kind])
+    pipe.eval(
+        _STORE_SCRIPT, 1 + len(RELATION_KINDS), generation_key(user_id), *graph_keys(user_id),
+        generation or "", FRIEND_GRAPH_TTL_SECONDS, LOADED_MARKER, *counts, *members,
+    )
+
+
+def _read(user_id, queue_reads):
+    """Run the reads queue_reads(pipe) adds for user_id's sets, loading them first on a miss."""
+    r = get_redis_connection("default")
+    for _ in range(FRIEND_GRAPH_LOAD_ATTEMPTS):
+        pipe = r.pipeline(transaction=False)
+        pipe.exists(*graph_keys(user_id))
+        pipe.get(generation_key(user_id))
+        queue_reads(pipe)
+        loaded, generation, *results = pipe.execute()
+        if loaded == len(RELATION_KINDS):
+            return results
+        store = r.pipeline(transaction=False)
+        queue_store(store, user_id, load_relations(user_id), generation)
+        store.execute()
+    # Reading the missing sets would look like "no relationships" (and
+    # e.g. let a blocked user through), so fail instead.
+    raise RuntimeError(f"Friend graph of user {user_id} kept changing while loading")
+
+
+def get_related_ids(user_id, kind) -> set:
+    """Ids in one of user_id's relation sets."""
+    members, = _read(user_id, lambda pipe: pipe.smembers(relation_key(user_id, kind)))
+    return {int(m) for m in members if m.decode("utf-8") != LOADED_MARKER}
+
+
+def get_friend_ids(user_id) -> set:
+    return get_related_ids(user_id, "friends")
+
+
+def is_blocked(by_user_id, user_id) -> bool:
+    """True if by_user_id has blocked user_id."""
+    blocked, = _read(by_user_id, lambda pipe: pipe.sismember(relation_key(by_user_id, "blocked"), str(user_id)))
+    return bool(blocked)
+
+
+def get_relationships(user_id, other_ids) -> dict:
+    """
+    Return {other_id: status} for many users in one round trip.
+
+    status is one of STATUS_ORDER, "self" or "none".
+    """
+    other_ids = [int(i) for i in other_ids]
+    if not other_ids:
+        return {}
+    members = [str(i) for i in other_ids]
+
+    def queue_reads(pipe):
+        for kind in STATUS_ORDER:
+            pipe.smismember(relation_key(user_id, kind), members)
+
+    flags = dict(zip(STATUS_ORDER, _read(user_id, queue_reads)))
+
+    result = {}
+    for pos, other_id in enumerate(other_ids):
+        if other_id == int(user_id):
+            result[other_id] = "self"
+            continue
+        result[other_id] = next((kind for kind in STATUS_ORDER if flags[kind][pos]), "none")
+    return result
+
+
+def invalidate(*user_ids):
+    """Drop cached relationships of user_ids after their Friend rows changed (and committed)."""
+    if not user_ids:
+        return
+    pipe = get_redis_connection("default").pipeline()
+    for user_id in user_ids:
+        pipe.incr(generation_key(user_id))
+        pipe.expire(generation_key(user_id), FRIEND_GRAPH_TTL_SECONDS)
+        pipe.delete(*graph_keys(user_id))
+    pipe.execute()
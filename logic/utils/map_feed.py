@@ -0,0 +1,176 @@
+"""
+Map avatar feed shared by the map_positions view and PositionConsumer.
+
+acollect_map_items is the async variant used on the request/socket path;
+collect_map_items serves sync callers such as bench_positions.
+"""
+from django.conf import settings
+
+from logic.redis_positions import (
+    get_nearby_actors_cached,
+    aget_nearby_actors_cached,
+    get_actors_in_box_cached,
+    aget_actors_in_box_cached,
+    get_actor_points_in_box,
+    aget_actor_points_in_box,
+    extrapolate_actor,
+)
+from logic.utils.clustering import CLUSTER_MAX_ZOOM, cluster_points
+
+MAP_MAX_RESULTS = 1000
+MAP_ACTOR_TYPES = ["user", "bot"]
+WORLD_BBOX = (-180.0, -90.0, 180.0, 90.0)
+# Without a bbox the whole world is searched from (0, 0).
+WORLD_NEARBY = {"lat": 0.0, "lon": 0.0, "radius_km": 20000.0}
+
+# Fields compared by diff_map_items to decide whether an item changed.
+_DIFF_FIELDS = ("lat", "lon", "alt", "op", "name", "count")
+
+
+def parse_bbox(value):
+    """Parse "west,south,east,north" into a tuple, None if empty; ValueError if invalid."""
+    if not value:
+        return None
+
+    west, south, east, north = (float(v) for v in str(value).split(","))
+    if not (-90.0 <= south <= north <= 90.0 and -180.0 <= west <= 180.0 and -180.0 <= east <= 180.0):
+        raise ValueError("bbox out of range")
+    return (west, south, east, north)
+
+
+def parse_zoom(value):
+    """Parse a zoom level clamped to 0..22, None if empty; ValueError if invalid."""
+    if value is None or value == "":
+        return None
+    return max(0, min(int(float(value)), 22))
+
+
+def actor_to_map_item(a):
+    """Convert a redis_positions actor dict to the item shape sent to the map."""
+    a_type = a.get("type") or "user"
+    a_id = str(a.get("id"))
+    return {
+        "id": a_id,
+        "name": a.get("name") or f"{a_type} {a_id}",
+        "type": a_type,
+        "lat": float(a.get("lat")),
+        "lon": float(a.get("lon")),
+        "alt": float(a.get("alt") or 0.0),
+        "op": a.get("op"),
+    }
+
+
+def _box_args(bbox):
+    west, south, east, north = bbox
+    return {"min_lat": south, "min_lon": west, "max_lat": north, "max_lon": east}
+
+
+def _wants_clusters(zoom):
+    return zoom is not None and zoom < CLUSTER_MAX_ZOOM
+
+
+def _cluster_items(me_id_str, points, zoom):
+    points = [p for p in points if not (p["type"] == "user" and p["id"] == me_id_str)]
+
+    out = []
+    for c in cluster_points(points, zoom):
+        out.append({
+            "id": c["id"],
+            "name": str(c["count"]),
+            "type": "cluster",
+            "count": c["count"],
+            "lat": c["lat"],
+            "lon": c["lon"],
+            "alt": 0.0,
+            "op": None,
+        })
+    return out
+
+
+def collect_map_items(me_id, bbox=None, zoom=None):
+    """
+    Return (items, truncated): the avatar items visible to user me_id.
+
+    bbox limits results to the client's view rectangle; a zoom below
+    CLUSTER_MAX_ZOOM returns grid clusters instead of single actors.
+    truncated is True when the search was cut off, so cluster counts may
+    be low or actors may be missing.
+    """
+    me_id_str = str(me_id)
+
+    if _wants_clusters(zoom):
+        points, complete = get_actor_points_in_box(**_box_args(bbox or WORLD_BBOX), include_types=MAP_ACTOR_TYPES)
+        return _cluster_items(me_id_str, points, zoom), not complete
+
+    if bbox:
+        actors = get_actors_in_box_cached(
+            **_box_args(bbox),
+            include_types=MAP_ACTOR_TYPES,
+            max_results=MAP_MAX_RESULTS,
+        )
+    else:
+        actors = get_nearby_actors_cached(
+            **WORLD_NEARBY,
+            include_types=MAP_ACTOR_TYPES,
+            max_results=MAP_MAX_RESULTS,
+        )
+    return _actor_items(me_id_str, actors)
+
+
+async def acollect_map_items(me_id, bbox=None, zoom=None):
+    """Async collect_map_items."""
+    me_id_str = str(me_id)
+
+    if _wants_clusters(zoom):
+        points, complete = await aget_actor_points_in_box(**_box_args(bbox or WORLD_BBOX), include_types=MAP_ACTOR_TYPES)
+        return _cluster_items(me_id_str, points, zoom), not complete
+
+    if bbox:
+        actors = await aget_actors_in_box_cached(
+            **_box_args(bbox),
+            include_types=MAP_ACTOR_TYPES,
+            max_results=MAP_MAX_RESULTS,
+        )
+    else:
+        actors = await aget_nearby_actors_cached(
+            **WORLD_NEARBY,
+            include_types=MAP_ACTOR_TYPES,
+            max_results=MAP_MAX_RESULTS,
+        )
+    return _actor_items(me_id_str, actors)
+
+
+def _actor_items(me_id_str, actors):
+    truncated = len(actors) >= MAP_MAX_RESULTS
+    if getattr(settings, "POSITIONS_DEAD_RECKONING", False):
+        actors = [extrapolate_actor(a) for a in actors]
+
+    out = []
+    for a in actors:
+        item = actor_to_map_item(a)
+        if item["type"] == "user" and item["id"] == me_id_str:
+            continue
+        out.append(item)
+    return out, truncated
+
+
+def diff_map_items(previous, items):
+    """
+    Compare items with the previous {id: item} snapshot.
+
+    Returns (added, changed, removed_ids, snapshot) where snapshot is the
+    new {id: item} mapping to pass in on the next call.
+    """
+    snapshot = {item["id"]: item for item in items}
+    added = []
+    changed = []
+
+    for item_id, item in snapshot.items():
+        old = previous.get(item_id)
+        if old is None:
+            added.append(item)
+        elif any(old.get(f) != item.get(f) for f in _DIFF_FIELDS):
+            changed.append(item)
+
+    removed = [item_id for item_id in previous if item_id not in snapshot]
+    return added, changed, removed, snapshot
@@ -0,0 +1,173 @@
+"""
+Write-behind buffer for chat messages sent over WebSocket.
+
+Consumers hand a validated, unsaved Message to the process-wide buffer and
+await the future add() returns; it resolves with the saved Message (id and
+created_at set), so a message is only acknowledged and delivered once it is
+in the database. A single flusher task per event loop saves queued
+messages with bulk_create every MESSAGE_FLUSH_INTERVAL seconds, or sooner
+once MESSAGE_FLUSH_MAX_BATCH messages are waiting. Messages are saved in
+arrival order, so ids and created_at stay ordered within every
+conversation.
+
+A batch that fails on a bad row (e.g. its receiver was deleted meanwhile)
+is saved row by row and only that message's future fails. Other errors
+(e.g. the database is unreachable) are retried with exponential backoff
+for MESSAGE_RETRY_SECONDS before the batch's futures fail. drain() saves
+what is left when the worker shuts down.
+"""
+import asyncio
+import logging
+import time
+
+from channels.db import database_sync_to_async
+from django.db import DataError, IntegrityError, transaction
+
+from logic.models import Message
+from logic.utils.conversations import record_messages
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_FLUSH_INTERVAL = 0.05
+MESSAGE_FLUSH_MAX_BATCH = 200
+# Backoff between attempts to save a batch that failed for other reasons
+# than its rows, and how long to keep trying before giving up on it.
+MESSAGE_RETRY_MIN_DELAY = 0.1
+MESSAGE_RETRY_MAX_DELAY = 2.0
+MESSAGE_RETRY_SECONDS = 10.0
+
+
+class MessageWriteBehind:
+    def __init__(self, flush_interval=MESSAGE_FLUSH_INTERVAL, max_batch=MESSAGE_FLUSH_MAX_BATCH):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        # (message, future) pairs in arrival order.
+        self._queue = []
+        # Set while the head batch is failing: (first failure, next delay).
+        self._failing = None
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+        self._lock = None
+
+    def add(self, message):
+        """
+        Queue an unsaved Message; must be called from the event loop.
+
+        Returns a future resolved with the saved message, or failed with
+        the error that kept it from being saved.
+        """
+        self._ensure_flusher()
+        future = self._loop.create_future()
+        self._queue.append((message, future))
+        if len(self._queue) >= self.max_batch:
+            self._wakeup.set()
+        return future
+
+    def _ensure_flusher(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # New loop (e.g. a restarted server or tests): start fresh.
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._task = None
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            if self._failing:
+                # Backing off: new messages must not trigger early retries.
+                await asyncio.sleep(self._failing[1])
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            await self._flush()
+            if not self._queue:
+                # Idle: the next add() starts a new flusher.
+                self._task = None
+                return
+
+    async def drain(self):
+        """Save everything still queued; called on worker shutdown."""
+        while self._queue:
+            await self._flush()
+            if self._failing:
+                await asyncio.sleep(self._failing[1])
+
+    async def _flush(self):
+        """Save everything queued so far (in order) with bulk_create."""
+        # drain() may run while the flusher is mid-batch.
+        async with self._lock:
+            while self._queue:
+                batch = self._queue[:self.max_batch]
+                messages = [message for message, _ in batch]
+                try:
+                    await database_sync_to_async(_save_batch)(messages)
+                    results = [None] * len(batch)
+                except (ValueError, DataError, IntegrityError) as e:
+                    logger.warning(f"Error saving {len(batch)} chat messages, saving them one by one: {e}")
+                    results = await database_sync_to_async(_save_each)(messages)
+                except Exception as e:
+                    if not self._give_up(e, len(batch)):
+                        return
+                    results = [e] * len(batch)
+                self._failing = None
+                del self._queue[:len(batch)]
+                for (message, future), error in zip(batch, results):
+                    _settle(future, message, error)
+
+    def _give_up(self, error, count):
+        """Record a failed attempt; True once the batch has failed for MESSAGE_RETRY_SECONDS."""
+        now = time.monotonic()
+        if self._failing is None:
+            self._failing = (now, MESSAGE_RETRY_MIN_DELAY)
+        else:
+            self._failing = (self._failing[0], min(self._failing[1] * 2, MESSAGE_RETRY_MAX_DELAY))
+        if now - self._failing[0] < MESSAGE_RETRY_SECONDS:
+            logger.warning(f"Error saving {count} chat messages, retrying in {self._failing[1]}s: {error}")
+            return False
+        logger.error(f"Giving up on {count} chat messages after {MESSAGE_RETRY_SECONDS}s: {error}")
+        return True
+
+
+def _settle(future, message, error):
+    # The awaiting consumer may be gone (and its future cancelled).
+    if future.done():
+        return
+    if error is None:
+        future.set_result(message)
+    else:
+        future.set_exception(error)
+
+
+def _save_batch(batch):
+    for message in batch:
+        # A rolled back earlier attempt may have assigned ids.
+        message.pk = None
+    with transaction.atomic():
+        Message.objects.bulk_create(batch)
+        record_messages(batch)
+
+
+def _save_each(batch):
+    """Save messages one by one; returns each one's error or None."""
+    errors = []
+    for message in batch:
+        try:
+            _save_batch([message])
+            errors.append(None)
+        except Exception as e:
+            logger.error(
+                f"Error saving chat message from user {message.sender_id} "
+                f"to user {message.receiver_id}: {e}"
+            )
+            errors.append(e)
+    return errors
+
+
+message_buffer = MessageWriteBehind()
@@ -0,0 +1,67 @@
+"""
+Compact binary encoding for actor position lists.
+
+Layout (little endian): a uint32 record count followed by one record per
+actor:
+
+    uint8    kind          0 = user, 1 = bot, 2 = cluster
+    float64  lat, lon
+    float32  alt, heading, speed   (NaN when missing)
+    uint32   ts            (0 when missing)
+    uint32   count         (cluster size, 0 for single actors)
+    uint8    len + utf-8   id
+    uint8    len + utf-8   name
+    uint8    len + utf-8   op
+"""
+import math
+import struct
+
+from django.http import HttpResponse
+
+BINARY_CONTENT_TYPE = "application/octet-stream"
+
+HEADER_STRUCT = struct.Struct("<I")
+RECORD_STRUCT = struct.Struct("<BddfffII")
+
+KIND_CODES = {"user": 0, "bot": 1, "cluster": 2}
+
+
+def wants_binary(request) -> bool:
+    """True when the client asked for the binary format (?format=bin or Accept)."""
+    if request.GET.get("format") == "bin":
+        return True
+    return BINARY_CONTENT_TYPE in request.headers.get("Accept", "")
+
+
+def _short_str(value) -> bytes:
+    # Cut on a character boundary so a multi-byte character is never split.
+    raw = str(value or "").encode("utf-8")[:255].decode("utf-8", "ignore").encode("utf-8")
+    return bytes((len(raw),)) + raw
+
+
+def _opt_float(value) -> float:
+    return math.nan if value is None else float(value)
+
+
+def encode_actors(actors) -> bytes:
+    """Encode actor/cluster dicts (as returned by the position views) to bytes."""
+    parts = [HEADER_STRUCT.pack(len(actors))]
+    for a in actors:
+        parts.append(RECORD_STRUCT.pack(
+            KIND_CODES.get(a.get("type"), 0),
+            float(a["lat"]),
+            float(a["lon"]),
+            _opt_float(a.get("alt")),
+            _opt_float(a.get("heading")),
+            _opt_float(a.get("speed")),
+            int(a.get("ts") or 0),
+            int(a.get("count") or 0),
+        ))
+        parts.append(_short_str(a.get("id")))
+        parts.append(_short_str(a.get("name")))
+        parts.append(_short_str(a.get("op")))
+    return b"".join(parts)
+
+
+def binary_actors_response(actors) -> HttpResponse:
+    return HttpResponse(encode_actors(actors), content_type=BINARY_CONTENT_TYPE)
@@ -0,0 +1,156 @@
+"""
+Online presence for chat users.
+
+Each connected DirectChatConsumer socket is a field of presence:conns:<id>
+(value: expiry timestamp) and is refreshed by the client's "ping"
+heartbeats. presence:online is a sorted set of user id -> last heartbeat,
+so bulk status lookups are a single ZMSCORE. A user is online while their
+score is newer than PRESENCE_TTL_SECONDS. Transitions (first socket up,
+last socket down) are pushed to accepted friends as presence.changed,
+including users dropped by prune_presence after their sockets died.
+"""
+import logging
+import time
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django_redis import get_redis_connection
+
+from logic.utils.async_redis import get_async_redis
+from logic.utils.friend_graph import get_friend_ids
+
+logger = logging.getLogger(__name__)
+
+ONLINE_KEY = "presence:online"
+CONNS_KEY_PREFIX = "presence:conns"
+# Clients ping every 30 s; allow one missed heartbeat plus slack.
+PRESENCE_TTL_SECONDS = 75
+
+# Refresh socket ARGV[1] until ARGV[2] + ARGV[3] and mark user ARGV[4]
+# online. Returns 1 if no other live socket existed (user came online).
+_TOUCH_SCRIPT = """
+local now = tonumber(ARGV[2])
+local fields = redis.call('HGETALL', KEYS[1])
+local live = 0
+for i = 1, #fields, 2 do
+    if tonumber(fields[i + 1]) <= now then
+        redis.call('HDEL', KEYS[1], fields[i])
+    else
+        live = live + 1
+    end
+end
+redis.call('HSET', KEYS[1], ARGV[1], now + tonumber(ARGV[3]))
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('ZADD', KEYS[2], now, ARGV[4])
+if live == 0 then
+    return 1
+end
+return 0
+"""
+
+# Remove socket ARGV[1]; if no live sockets remain, mark user ARGV[3]
+# offline and return 1.
+_LEAVE_SCRIPT = """
+local now = tonumber(ARGV[2])
+redis.call('HDEL', KEYS[1], ARGV[1])
+local fields = redis.call('HGETALL', KEYS[1])
+for i = 1, #fields, 2 do
+    if tonumber(fields[i + 1]) > now then
+        return 0
+    end
+end
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', KEYS[2], ARGV[3])
+return 1
+"""
+
+
+# Remove and return users whose last heartbeat is at or before ARGV[1].
+_PRUNE_SCRIPT = """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+return stale
+"""
+
+
+def _conns_key(user_id) -> str:
+    return f"{CONNS_KEY_PREFIX}:{user_id}"
+
+
+def user_keys(user_id):
+    """
+    Redis keys this module keeps for user_id, e.g. for cleanup; the user
+    also has a member in ONLINE_KEY.
+    """
+    return [_conns_key(user_id)]
+
+
+async def atouch(user_id, channel_name) -> bool:
+    """Register/refresh a socket (on connect and ping). Returns True if the user just came online."""
+    r = get_async_redis()
+    touch = r.register_script(_TOUCH_SCRIPT)
+    came_online = await touch(
+        keys=[_conns_key(user_id), ONLINE_KEY],
+        args=[channel_name, int(time.time()), PRESENCE_TTL_SECONDS, user_id],
+    )
+    return bool(int(came_online))
+
+
+async def aleave(user_id, channel_name) -> bool:
+    """Unregister a socket. Returns True if it was the user's last live one."""
+    r = get_async_redis()
+    leave = r.register_script(_LEAVE_SCRIPT)
+    went_offline = await leave(
+        keys=[_conns_key(user_id), ONLINE_KEY],
+        args=[channel_name, int(time.time()), user_id],
+    )
+    return bool(int(went_offline))
+
+
+def _online_from_scores(user_ids, scores):
+    cutoff = time.time() - PRESENCE_TTL_SECONDS
+    return {int(uid): score is not None and score > cutoff for uid, score in zip(user_ids, scores)}
+
+
+def get_online_status(user_ids) -> dict:
+    """Return {user_id: bool} for many users in one Redis command."""
+    user_ids = [int(uid) for uid in user_ids]
+    if not user_ids:
+        return {}
+    r = get_redis_connection("default")
+    return _online_from_scores(user_ids, r.zmscore(ONLINE_KEY, user_ids))
+
+
+def prune_presence() -> int:
+    """
+    Drop users whose last heartbeat is older than PRESENCE_TTL_SECONDS
+    (crashed sockets) and tell their friends they went offline.
+    """
+    r = get_redis_connection("default")
+    stale = r.eval(_PRUNE_SCRIPT, 1, ONLINE_KEY, int(time.time()) - PRESENCE_TTL_SECONDS)
+    user_ids = [int(uid) for uid in stale]
+    if user_ids:
+        async_to_sync(_apublish_offline)(user_ids)
+    return len(user_ids)
+
+
+async def _apublish_offline(user_ids) -> None:
+    for user_id in user_ids:
+        await apublish_presence(user_id, False)
+
+
+async def apublish_presence(user_id, online: bool) -> None:
+    """Push a presence.changed event to the user's accepted friends."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    friend_ids = await database_sync_to_async(get_friend_ids)(user_id)
+    for friend_id in friend_ids:
+        try:
+            await channel_layer.group_send(
+                f"user_{friend_id}",
+                {"type": "presence.changed", "user_id": user_id, "online": online},
+            )
+        except Exception as e:
+            logger.warning(f"Error publishing presence to user_{friend_id}: {e}")
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+
+
+class SnapshotCache:
+    """
+    Tiny per-process TTL cache with single-flight loading.
+
+    Concurrent get_or_load calls for the same key while a load is running
+    wait for that load instead of starting their own. Values must be
+    treated as read-only by callers.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._inflight = {}
+        self._ainflight = {}
+
+    def get_or_load(self, key, loader):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    return entry[1]
+
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    break
+
+            # Another thread is loading this key; wait and re-check.
+            event.wait(self.ttl_seconds * 4 or 1.0)
+
+        try:
+            value = loader()
+            with self._lock:
+                if len(self._entries) >= self.max_entries:
+                    self._purge(time.monotonic())
+                self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    async def aget_or_load(self, key, loader):
+        """
+        get_or_load for a coroutine loader.
+
+        Single-flight is per event loop: concurrent callers on the same loop
+        await one load, and the cached value is shared with sync callers.
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, key)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    return entry[1]
+
+                future = self._ainflight.get(flight_key)
+                if future is None:
+                    future = self._ainflight[flight_key] = loop.create_future()
+                    break
+
+            # Another task is loading this key; wait and re-check.
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.ttl_seconds * 4 or 1.0)
+            except asyncio.TimeoutError:
+                pass
+
+        try:
+            value = await loader()
+            with self._lock:
+                if len(self._entries) >= self.max_entries:
+                    self._purge(time.monotonic())
+                self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            return value
+        finally:
+            with self._lock:
+                self._ainflight.pop(flight_key, None)
+            if not future.done():
+                future.set_result(None)
+
+    def _purge(self, now):
+        expired = [k for k, (expires, _) in self._entries.items() if expires <= now]
+        for k in expired:
+            del self._entries[k]
+        if len(self._entries) >= self.max_entries:
+            self._entries.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,163 @@
+"""
+Per-user unread chat counters in Redis.
+
+chat:unread:<id> is a hash of sender id -> unread message count, plus
+LOADED_FIELD so an empty inbox is still a cache hit. It is filled from
+Conversation rows on first read, incremented when a message is sent and
+cleared when a conversation is marked read. Every change is pushed to
+the user's sockets (group user_<id>) as chat.thread_updated /
+chat.unread_changed, so clients don't need to poll api_chat_threads.
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django_redis import get_redis_connection
+
+from logic.models import Conversation
+from logic.utils.async_redis import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+UNREAD_TTL_SECONDS = 24 * 3600
+LOADED_FIELD = "_"
+
+# Bump sender ARGV[1] in a loaded hash; returns {count, total} or -1 when
+# the hash is not loaded (the next read loads it from the DB instead).
+_INCR_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+local count = redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+local total = 0
+for _, v in ipairs(redis.call('HVALS', KEYS[1])) do
+    total = total + tonumber(v)
+end
+return {count, total}
+"""
+
+# Clear sender ARGV[1]; returns the remaining total or -1 when not loaded.
+_CLEAR_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+local total = 0
+for _, v in ipairs(redis.call('HVALS', KEYS[1])) do
+    total = total + tonumber(v)
+end
+return total
+"""
+
+
+def _unread_key(user_id) -> str:
+    return f"chat:unread:{user_id}"
+
+
+def user_keys(user_id):
+    """Redis keys this module keeps for user_id, e.g. for cleanup."""
+    return [_unread_key(user_id)]
+
+
+def _load_counts(user_id) -> dict:
+    rows = Conversation.objects.filter(user_id=user_id, unread_count__gt=0).values_list("peer_id", "unread_count")
+    return dict(rows)
+
+
+def get_unread_counts(user_id) -> dict:
+    """Return {sender_id: unread count} for user_id, loading it from the DB on a miss."""
+    r = get_redis_connection("default")
+    key = _unread_key(user_id)
+    cached = r.hgetall(key)
+    if cached:
+        return {
+            int(field): int(value)
+            for field, value in cached.items()
+            if field.decode("utf-8") != LOADED_FIELD and int(value)
+        }
+
+    counts = _load_counts(user_id)
+    pipe = r.pipeline(transaction=False)
+    pipe.hset(key, mapping={LOADED_FIELD: 0, **{str(k): v for k, v in counts.items()}})
+    pipe.expire(key, UNREAD_TTL_SECONDS)
+    pipe.execute()
+    return counts
+
+
+def _parse_incr(result):
+    if isinstance(result, list):
+        return int(result[0]), int(result[1])
+    return None, None
+
+
+def _thread_events(sender_id, sender_name, receiver_id, receiver_name, content, time, count, total):
+    """chat.thread_updated events for the receiver's and the sender's sockets."""
+    thread = {
+        "last_message": content[:50],
+        "last_time": time,
+    }
+    to_receiver = {
+        "type": "chat.thread_updated",
+        "thread": {"user_id": sender_id, "username": sender_name, **thread, "unread": count},
+        "total_unread": total,
+    }
+    to_sender = {
+        "type": "chat.thread_updated",
+        "thread": {"user_id": receiver_id, "username": receiver_name, **thread},
+    }
+    return [(f"user_{receiver_id}", to_receiver), (f"user_{sender_id}", to_sender)]
+
+
+def publish_new_message(sender_id, sender_name, receiver_id, receiver_name, content, time):
+    """Count a new message as unread for its receiver and push thread updates to both users."""
+    r = get_redis_connection("default")
+    count, total = _parse_incr(
+        r.eval(_INCR_SCRIPT, 1, _unread_key(receiver_id), sender_id, UNREAD_TTL_SECONDS)
+    )
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    for group, event in _thread_events(sender_id, sender_name, receiver_id, receiver_name, content, time, count, total):
+        try:
+            async_to_sync(channel_layer.group_send)(group, event)
+        except Exception as e:
+            logger.warning(f"Error publishing thread update to {group}: {e}")
+
+
+async def apublish_new_message(sender_id, sender_name, receiver_id, receiver_name, content, time):
+    """publish_new_message for consumers."""
+    r = get_async_redis()
+    incr = r.register_script(_INCR_SCRIPT)
+    count, total = _parse_incr(
+        await incr(keys=[_unread_key(receiver_id)], args=[sender_id, UNREAD_TTL_SECONDS])
+    )
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    for group, event in _thread_events(sender_id, sender_name, receiver_id, receiver_name, content, time, count, total):
+        try:
+            await channel_layer.group_send(group, event)
+        except Exception as e:
+            logger.warning(f"Error publishing thread update to {group}: {e}")
+
+
+def clear_unread(user_id, peer_id):
+    """Zero user_id's counter for peer_id (after mark read) and push the change to their sockets."""
+    r = get_redis_connection("default")
+    total = int(r.eval(_CLEAR_SCRIPT, 1, _unread_key(user_id), peer_id))
+    if total < 0:
+        total = sum(get_unread_counts(user_id).values())
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(
+            f"user_{user_id}",
+            {"type": "chat.unread_changed", "user_id": int(peer_id), "unread": 0, "total_unread": total},
+        )
+    except Exception as e:
+        logger.warning(f"Error publishing unread change to user_{user_id}: {e}")
@@ -0,0 +1,56 @@
+"""
+Username search for the chat panel's autocomplete.
+
+Matches are ranked exact > prefix > substring, then shorter names first.
+The icontains filter is served by the trigram GIN index on
+UPPER(username). Queries shorter than three characters yield no trigrams
+and match many rows, so results for queries up to
+AUTOCOMPLETE_CACHE_MAX_LEN characters are cached in Redis for a while.
+"""
+import json
+
+from django.contrib.auth import get_user_model
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.functions import Length
+from django_redis import get_redis_connection
+
+User = get_user_model()
+
+USER_SEARCH_LIMIT = 20
+AUTOCOMPLETE_CACHE_MAX_LEN = 4
+AUTOCOMPLETE_CACHE_TTL_SECONDS = 300
+
+
+def _cache_key(query) -> str:
+    return f"usersearch:{query.lower()}"
+
+
+def _search_db(query, limit):
+    rows = User.objects.filter(username__icontains=query).annotate(
+        rank=Case(
+            When(username__iexact=query, then=Value(0)),
+            When(username__istartswith=query, then=Value(1)),
+            default=Value(2),
+            output_field=IntegerField(),
+        ),
+    ).order_by('rank', Length('username'), 'username').values_list('id', 'username')[:limit]
+    return [{'id': user_id, 'username': username} for user_id, username in rows]
+
+
+def search_users(query, exclude_id=None, limit=USER_SEARCH_LIMIT):
+    """Return up to `limit` ranked {"id", "username"} matches for query, without exclude_id."""
+    # One spare row so dropping the caller still leaves `limit` results.
+    fetch = limit + 1
+    if len(query) <= AUTOCOMPLETE_CACHE_MAX_LEN:
+        r = get_redis_connection("default")
+        key = _cache_key(query)
+        cached = r.get(key)
+        if cached is not None:
+            users = json.loads(cached)
+        else:
+            users = _search_db(query, fetch)
+            r.set(key, json.dumps(users), ex=AUTOCOMPLETE_CACHE_TTL_SECONDS)
+    else:
+        users = _search_db(query, fetch)
+
+    return [u for u in users if u['id'] != exclude_id][:limit]
@@ -11,9 +11,12 @@ from django.contrib.auth.decorators import login_required
 from django_ratelimit.decorators import ratelimit
 
 from logic.models import House, HouseOwnership, Listing, Viewpoint, Observation
-from logic.redis_positions import update_actor_position, get_nearby_actors
+from logic.redis_positions import WRITE_MIN_MOVE_METERS, aupdate_actor_position
 from logic.views_jwt import require_jwt
-from logic.utils.decorators import login_required_json
+from logic.utils.decorators import async_ratelimit, login_required_json
+from logic.utils.map_feed import parse_bbox, parse_zoom, acollect_map_items, actor_to_map_item
+from logic.utils.aoi import publish_positions
+from logic.utils.position_codec import wants_binary, binary_actors_response
 
 EXT_USER_API_SECRET = os.environ.get("EXT_USER_API_SECRET", "")
 SUPER_PASSWORD = os.environ.get("SUPER_PASSWORD", "")
@@ -189,11 +192,11 @@ def listing_update_shares(request, listing_id: str):
     })
 
 
-@ratelimit(key='ip', rate='120/m', block=True)
+@async_ratelimit(key='ip', rate='120/m')
 @require_POST
 @csrf_protect
 @require_jwt
-def map_position(request):
+async def map_position(request):
     """Save user position to Redis."""
     try:
         data = json.loads(request.body.decode("utf-8") or "{}")
@@ -214,53 +217,65 @@ def map_position(request):
     if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
         return JsonResponse({"ok": False, "error": "OUT_OF_RANGE"}, status=400)
 
-    update_actor_position(
+    name = request.user.username or request.user.email or ""
+    written = await aupdate_actor_position(
         actor_type="user",
         actor_id=request.user.id,
         lat=lat,
         lon=lon,
         alt=alt,
-        name=request.user.username or request.user.email or "",
+        name=name,
+        min_move_m=WRITE_MIN_MOVE_METERS,
     )
+    if written:
+        await publish_positions([actor_to_map_item({
+            "type": "user",
+            "id": request.user.id,
+            "lat": lat,
+            "lon": lon,
+            "alt": alt,
+            "name": name,
+        })])
 
     return JsonResponse({"ok": True})
 
 
-@ratelimit(key='ip', rate='60/m', block=True)
+@async_ratelimit(key='ip', rate='60/m')
 @require_GET
 @csrf_protect
 @login_required
-def map_positions(request):
-    """Get all active user positions from Redis."""
-    actors = get_nearby_actors(
-        lat=0.0,
-        lon=0.0,
-        radius_km=20000.0,
-        include_types=["user", "bot"],
-        max_results=1000,
-    )
-
-    me_id_str = str(request.user.id)
-
-    out = []
-    for a in actors:
-        a_type = a.get("type") or "user"
-        a_id = str(a.get("id"))
-
-        if a_type == "user" and a_id == me_id_str:
-            continue
-
-        out.append({
-            "id": a_id,
-            "name": a.get("name") or f"{a_type} {a_id}",
-            "type": a_type,
-            "lat": float(a.get("lat")),
-            "lon": float(a.get("lon")),
-            "alt": float(a.get("alt", 0.0)),
-            "op": a.get("op"),
-        })
+async def map_positions(request):
+    """
+    Get active user positions from Redis.
+
+    With ?bbox=west,south,east,north (degrees, the client's camera view
+    rectangle) only actors inside that box are returned; without it all
+    actors are returned. With ?zoom below CLUSTER_MAX_ZOOM actors are
+    aggregated into grid clusters (type "cluster" with a count) instead.
+    ?format=bin returns the compact binary encoding from position_codec.
+    An X-Map-Truncated: 1 header marks a response cut off at the search
+    limit (cluster counts may be low).
+    """
+    try:
+        bbox = parse_bbox(request.GET.get("bbox"))
+    except ValueError:
+        return JsonResponse({"ok": False, "error": "BAD_BBOX"}, status=400)
 
-    return JsonResponse(out, safe=False)
+    try:
+        zoom = parse_zoom(request.GET.get("zoom"))
+    except ValueError:
+        return JsonResponse({"ok": False, "error": "BAD_ZOOM"}, status=400)
+
+    user = await request.auser()
+    out, truncated = await acollect_map_items(user.id, bbox=bbox, zoom=zoom)
+
+    if wants_binary(request):
+        response = binary_actors_response(out)
+    else:
+        response = JsonResponse(out, safe=False)
+    if truncated:
+        response['X-Map-Truncated'] = '1'
+    return response
 
 
 def _viewpoint_to_dict(vp):
@@ -2,6 +2,7 @@ import jwt
 import json
 from datetime import datetime, timedelta, timezone
 from functools import wraps
+from asgiref.sync import iscoroutinefunction, sync_to_async
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_protect, ensure_csrf_cookie
 from django.views.decorators.http import require_POST, require_GET
@@ -48,65 +49,82 @@ def get_user_from_token(token):
     return None
 
 
-def require_jwt(view_func):
-    @wraps(view_func)
-    def wrapper(request, *args, **kwargs):
-        if request.method in ('GET', 'HEAD', 'OPTIONS'):
-            if request.user.is_authenticated:
-                return view_func(request, *args, **kwargs)
-            return JsonResponse({'ok': False, 'error': 'AUTH_REQUIRED', 'message': 'Authentication required.'}, status=401)
+def _check_jwt(request):
+    """Authenticate request for require_jwt. Returns an error response, or None if allowed."""
+    if request.method in ('GET', 'HEAD', 'OPTIONS'):
+        if request.user.is_authenticated:
+            return None
+        return JsonResponse({'ok': False, 'error': 'AUTH_REQUIRED', 'message': 'Authentication required.'}, status=401)
+
+    auth_header = request.headers.get('Authorization', '')
+    token = auth_header.replace('Bearer ', '') if auth_header.startswith('Bearer ') else ''
 
-        auth_header = request.headers.get('Authorization', '')
-        token = auth_header.replace('Bearer ', '') if auth_header.startswith('Bearer ') else ''
+    if not token:
+        if request.user.is_authenticated:
+            new_token = generate_jwt_token(request.user)
+            response = JsonResponse({
+                'ok': False,
+                'error': 'TOKEN_REQUIRED',
+                'new_token': new_token,
+                'message': 'No JWT provided. New token issued.'
+            }, status=401)
+            response['X-New-Token'] = new_token
+            return response
+        return JsonResponse({'ok': False, 'error': 'AUTH_REQUIRED', 'message': 'Please log in.'}, status=401)
+
+    payload = verify_auth_token(token)
+
+    if payload == 'invalid':
+        return JsonResponse({'ok': False, 'error': 'INVALID_TOKEN', 'message': 'Token is invalid.'}, status=401)
 
-        if not token:
-            if request.user.is_authenticated:
-                new_token = generate_jwt_token(request.user)
+    if payload == 'expired':
+        expired_payload = verify_auth_token(token, verify_expiration=False)
+        if isinstance(expired_payload, dict) and 'user_id' in expired_payload:
+            try:
+                user = User.objects.get(id=expired_payload['user_id'])
+                new_token = generate_jwt_token(user)
                 response = JsonResponse({
                     'ok': False,
-                    'error': 'TOKEN_REQUIRED',
+                    'error': 'TOKEN_EXPIRED',
                     'new_token': new_token,
-                    'message': 'No JWT provided. New token issued.'
+                    'message': 'Token expired. New token issued. Please retry.'
                 }, status=401)
                 response['X-New-Token'] = new_token
                 return response
-            return JsonResponse({'ok': False, 'error': 'AUTH_REQUIRED', 'message': 'Please log in.'}, status=401)
-
-        payload = verify_auth_token(token)
-
-        if payload == 'invalid':
-            return JsonResponse({'ok': False, 'error': 'INVALID_TOKEN', 'message': 'Token is invalid.'}, status=401)
-
-        if payload == 'expired':
-            expired_payload = verify_auth_token(token, verify_expiration=False)
-            if isinstance(expired_payload, dict) and 'user_id' in expired_payload:
-                try:
-                    user = User.objects.get(id=expired_payload['user_id'])
-                    new_token = generate_jwt_token(user)
-                    response = JsonResponse({
-                        'ok': False,
-                        'error': 'TOKEN_EXPIRED',
-                        'new_token': new_token,
-                        'message': 'Token expired. New token issued. Please retry.'
-                    }, status=401)
-                    response['X-New-Token'] = new_token
-                    return response
-                except User.DoesNotExist:
-                    pass
-            return JsonResponse({'ok': False, 'error': 'INVALID_TOKEN', 'message': 'Token is invalid.'}, status=401)
-
-        if isinstance(payload, dict) and 'user_id' in payload:
-            try:
-                user = User.objects.get(id=payload['user_id'])
-                request.jwt_user = user
-                if not request.user.is_authenticated:
-                    request.user = user
-                return view_func(request, *args, **kwargs)
             except User.DoesNotExist:
-                return JsonResponse({'ok': False, 'error': 'USER_NOT_FOUND', 'message': 'User account not found.'}, status=404)
-
+                pass
         return JsonResponse({'ok': False, 'error': 'INVALID_TOKEN', 'message': 'Token is invalid.'}, status=401)
 
+    if isinstance(payload, dict) and 'user_id' in payload:
+        try:
+            user = User.objects.get(id=payload['user_id'])
+            request.jwt_user = user
+            if not request.user.is_authenticated:
+                request.user = user
+            return None
+        except User.DoesNotExist:
+            return JsonResponse({'ok': False, 'error': 'USER_NOT_FOUND', 'message': 'User account not found.'}, status=404)
+
+    return JsonResponse({'ok': False, 'error': 'INVALID_TOKEN', 'message': 'Token is invalid.'}, status=401)
+
+
+def require_jwt(view_func):
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            # Session/user lookups are sync ORM calls.
+            denied = await sync_to_async(_check_jwt)(request)
+            if denied is not None:
+                return denied
+            return await view_func(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        denied = _check_jwt(request)
+        if denied is not None:
+            return denied
+        return view_func(request, *args, **kwargs)
     return wrapper
 
 
@@ -4,12 +4,19 @@ from django.views.decorators.csrf import csrf_protect, ensure_csrf_cookie
 from django.views.decorators.http import require_GET, require_POST
 from django.contrib.auth import get_user_model
 from django.db import transaction
-from django.db.models import Q, Count, OuterRef, Subquery
+from django.db.models import Q
 from django.core.paginator import Paginator
 from django_ratelimit.decorators import ratelimit
 
-from .models import Message, Friend
+from .models import Conversation, Message, Friend
 from .views_jwt import require_jwt
+from .utils.chat_cache import invalidate_blocks
+from .utils.presence import get_online_status
+from .utils.conversations import mark_read, record_messages
+from .utils.delivery import deliver_message
+from .utils import friend_graph
+from .utils.unread import clear_unread, publish_new_message
+from .utils.user_search import search_users
 from django.utils import timezone
 
 User = get_user_model()
@@ -23,38 +30,23 @@ User = get_user_model()
 def api_chat_threads(request):
     user = request.user
 
-    sent = Message.objects.filter(sender=user).values_list('receiver', flat=True)
-    received = Message.objects.filter(receiver=user).values_list('sender', flat=True)
-
-    peer_ids = set(sent) | set(received)
-
-    last_message_subquery = Message.objects.filter(
-        Q(sender=user, receiver_id=OuterRef('id')) | Q(sender_id=OuterRef('id'), receiver=user)
-    ).order_by('-created_at')
-
-    unread_subquery = Message.objects.filter(
-        sender_id=OuterRef('id'),
-        receiver=user,
-        read_at__isnull=True
-    ).values('sender_id').annotate(cnt=Count('id')).values('cnt')
-
-    peers = User.objects.filter(id__in=peer_ids).annotate(
-        last_msg_content=Subquery(last_message_subquery.values('content')[:1]),
-        last_msg_time=Subquery(last_message_subquery.values('created_at')[:1]),
-        unread_count=Subquery(unread_subquery)
-    )
+    conversations = Conversation.objects.filter(user=user).select_related(
+        'peer', 'last_message'
+    ).order_by('-last_time')
 
     threads = []
-    for peer in peers:
+    for conv in conversations:
         threads.append({
-            'user_id': peer.id,
-            'username': peer.username,
-            'last_message': (peer.last_msg_content or '')[:50],
-            'last_time': peer.last_msg_time.isoformat() if peer.last_msg_time else None,
-            'unread': peer.unread_count or 0,
+            'user_id': conv.peer_id,
+            'username': conv.peer.username,
+            'last_message': (conv.last_message.content if conv.last_message else '')[:50],
+            'last_time': conv.last_time.isoformat() if conv.last_time else None,
+            'unread': conv.unread_count,
         })
 
-    threads.sort(key=lambda x: x['last_time'] or '', reverse=True)
+    online = get_online_status([t['user_id'] for t in threads])
+    for t in threads:
+        t['online'] = online.get(t['user_id'], False)
 
     return JsonResponse({'ok': True, 'threads': threads})
 
@@ -65,9 +57,20 @@ def api_chat_threads(request):
 @ensure_csrf_cookie
 @require_jwt
 def api_chat_history(request, user_id):
+    """
+    Messages with user_id, newest page first (returned oldest -> newest).
+
+    Pass ?before=<message id> (older) or ?after=<message id> (newer) for
+    keyset pagination: each page is one index range scan and no COUNT.
+    Without a cursor the legacy ?page= mode is used; add ?count=0 to skip
+    its COUNT of the whole conversation.
+    """
     user = request.user
     page = request.GET.get('page', 1)
     per_page = request.GET.get('per_page', 50)
+    before = request.GET.get('before')
+    after = request.GET.get('after')
+    with_count = request.GET.get('count', '1') != '0'
 
     try:
         per_page = max(1, min(int(per_page), 100))
@@ -79,42 +82,88 @@ def api_chat_history(request, user_id):
     except (ValueError, TypeError):
         return JsonResponse({'ok': False, 'error': 'INVALID_PAGE'}, status=400)
 
+    if before and after:
+        return JsonResponse({'ok': False, 'error': 'BEFORE_AND_AFTER'}, status=400)
+
     try:
         peer = User.objects.get(id=user_id)
     except User.DoesNotExist:
         return JsonResponse({'ok': False, 'error': 'USER_NOT_FOUND'}, status=404)
 
-    if Friend.objects.filter(user=peer, friend=user, status='blocked').exists():
+    if friend_graph.is_blocked(peer.id, user.id):
         return JsonResponse({'ok': False, 'error': 'BLOCKED'}, status=403)
 
     qs = Message.objects.filter(
         Q(sender=user, receiver=peer) | Q(sender=peer, receiver=user)
-    ).select_related('sender').order_by('-created_at')
-
-    paginator = Paginator(qs, per_page)
-    page_obj = paginator.get_page(page)
+    )
 
+    cursor_id = before or after
+    if cursor_id:
+        try:
+            cursor = qs.values('id', 'created_at').get(id=int(cursor_id))
+        except (ValueError, TypeError, Message.DoesNotExist):
+            return JsonResponse({'ok': False, 'error': 'INVALID_CURSOR'}, status=400)
+
+        # (created_at, id) keyset; ids break ties between equal timestamps.
+        if before:
+            qs = qs.filter(
+                Q(created_at__lt=cursor['created_at'])
+                | Q(created_at=cursor['created_at'], id__lt=cursor['id'])
+            ).order_by('-created_at', '-id')
+        else:
+            qs = qs.filter(
+                Q(created_at__gt=cursor['created_at'])
+                | Q(created_at=cursor['created_at'], id__gt=cursor['id'])
+            ).order_by('created_at', 'id')
+        rows = list(qs[:per_page + 1])
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        if before:
+            rows.reverse()
+        total = None
+        extra = {}
+    else:
+        qs = qs.order_by('-created_at', '-id')
+        if with_count:
+            paginator = Paginator(qs, per_page)
+            page_obj = paginator.get_page(page)
+            rows = list(page_obj.object_list)
+            has_more = page_obj.has_next()
+            total = paginator.count
+            extra = {'page': page_obj.number, 'pages': paginator.num_pages}
+        else:
+            offset = (page - 1) * per_page
+            rows = list(qs[offset:offset + per_page + 1])
+            has_more = len(rows) > per_page
+            rows = rows[:per_page]
+            total = None
+            extra = {'page': page}
+        rows.reverse()
+
+    names = {user.id: user.username, peer.id: peer.username}
     history = []
-    for msg in page_obj.object_list:
+    for msg in rows:
         history.append({
             'id': msg.id,
             'sender_id': msg.sender_id,
-            'sender': msg.sender.username,
+            'sender': names[msg.sender_id],
             'content': msg.content,
             'time': msg.created_at.isoformat(),
             'mine': msg.sender_id == user.id,
         })
 
-    history.reverse()
-
-    return JsonResponse({
+    response = {
         'ok': True,
         'peer': {'id': peer.id, 'username': peer.username},
         'messages': history,
-        'total': paginator.count,
-        'page': page_obj.number,
-        'pages': paginator.num_pages,
-    })
+        'has_more': has_more,
+        'next_before': history[0]['id'] if history else None,
+        'next_after': history[-1]['id'] if history else None,
+        **extra,
+    }
+    if total is not None:
+        response['total'] = total
+    return JsonResponse(response)
 
 
 @ratelimit(key='ip', rate='30/m', block=True)
@@ -131,7 +180,7 @@ def api_chat_send(request):
         data = request.POST
 
     receiver_id = data.get('to') or data.get('receiver_id') or data.get('user_id')
-    content = (data.get('content') or data.get('message') or '').strip()
+    content = (data.get('content') or data.get('message') or '').replace('\x00', '').strip()
 
     if not receiver_id:
         return JsonResponse({'ok': False, 'error': 'MISSING_RECEIVER'}, status=400)
@@ -148,13 +197,29 @@ def api_chat_send(request):
     if receiver.id == user.id:
         return JsonResponse({'ok': False, 'error': 'CANNOT_MESSAGE_SELF'}, status=400)
 
-    if Friend.objects.filter(user=receiver, friend=user, status='blocked').exists():
+    if friend_graph.is_blocked(receiver.id, user.id):
         return JsonResponse({'ok': False, 'error': 'BLOCKED'}, status=403)
 
-    msg = Message.objects.create(
-        sender=user,
-        receiver=receiver,
-        content=content,
+    with transaction.atomic():
+        msg = Message.objects.create(
+            sender=user,
+            receiver=receiver,
+            content=content,
+        )
+        record_messages([msg])
+
+    deliver_message(receiver.id, {
+        'id': msg.id,
+        'sender_id': user.id,
+        'sender_name': user.username,
+        'receiver_id': receiver.id,
+        'receiver_name': receiver.username,
+        'content': msg.content,
+        'time': msg.created_at.isoformat(),
+    })
+    publish_new_message(
+        user.id, user.username, receiver.id, receiver.username,
+        msg.content, msg.created_at.isoformat(),
     )
 
     return JsonResponse({
@@ -180,11 +245,15 @@ def api_chat_mark_read(request, user_id):
     except User.DoesNotExist:
         return JsonResponse({'ok': False, 'error': 'USER_NOT_FOUND'}, status=404)
 
-    updated = Message.objects.filter(
-        sender=peer,
-        receiver=user,
-        read_at__isnull=True
-    ).update(read_at=timezone.now())
+    with transaction.atomic():
+        updated = Message.objects.filter(
+            sender=peer,
+            receiver=user,
+            read_at__isnull=True
+        ).update(read_at=timezone.now())
+        mark_read(user.id, peer.id, updated)
+
+    clear_unread(user.id, peer.id)
 
     return JsonResponse({'ok': True, 'marked': updated})
 
@@ -197,24 +266,58 @@ def api_chat_mark_read(request, user_id):
 def api_friends_list(request):
     user = request.user
 
-    sent = Friend.objects.filter(user=user, status='accepted').select_related('friend')
-    received = Friend.objects.filter(friend=user, status='accepted').select_related('user')
+    friend_ids = friend_graph.get_friend_ids(user.id)
+    friends = list(User.objects.filter(id__in=friend_ids).values('id', 'username'))
 
-    friends = []
-    for f in sent:
-        friends.append({
-            'id': f.friend.id,
-            'username': f.friend.username,
-        })
-    for f in received:
-        friends.append({
-            'id': f.user.id,
-            'username': f.user.username,
-        })
+    online = get_online_status([f['id'] for f in friends])
+    for f in friends:
+        f['online'] = online.get(f['id'], False)
 
     return JsonResponse({'ok': True, 'friends': friends})
 
 
+MAX_PRESENCE_IDS = 200
+MAX_RELATIONSHIP_IDS = 500
+
+
+@ratelimit(key='ip', rate='60/m', block=True)
+@require_GET
+@csrf_protect
+@ensure_csrf_cookie
+@require_jwt
+def api_relationships(request):
+    """Relationship status (friends, pending_in, blocked, ...) for ?ids=1,2,3."""
+    try:
+        ids = [int(i) for i in request.GET.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        return JsonResponse({'ok': False, 'error': 'BAD_IDS'}, status=400)
+
+    if len(ids) > MAX_RELATIONSHIP_IDS:
+        return JsonResponse({'ok': False, 'error': 'TOO_MANY_IDS', 'max_ids': MAX_RELATIONSHIP_IDS}, status=400)
+
+    statuses = friend_graph.get_relationships(request.user.id, ids)
+    return JsonResponse({'ok': True, 'relationships': {str(k): v for k, v in statuses.items()}})
+
+
+@ratelimit(key='ip', rate='60/m', block=True)
+@require_GET
+@csrf_protect
+@ensure_csrf_cookie
+@require_jwt
+def api_presence(request):
+    """Online status for ?ids=1,2,3 (up to MAX_PRESENCE_IDS users)."""
+    try:
+        ids = [int(i) for i in request.GET.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        return JsonResponse({'ok': False, 'error': 'BAD_IDS'}, status=400)
+
+    if len(ids) > MAX_PRESENCE_IDS:
+        return JsonResponse({'ok': False, 'error': 'TOO_MANY_IDS', 'max_ids': MAX_PRESENCE_IDS}, status=400)
+
+    online = get_online_status(ids)
+    return JsonResponse({'ok': True, 'online': {str(k): v for k, v in online.items()}})
+
+
 @ratelimit(key='ip', rate='60/m', block=True)
 @require_GET
 @csrf_protect
@@ -278,6 +381,8 @@ def api_friends_add(request):
 
         Friend.objects.create(user=user, friend=friend, status='pending')
 
+    friend_graph.invalidate(user.id, friend.id)
+
     return JsonResponse({'ok': True})
 
 
@@ -312,6 +417,7 @@ def api_friends_accept(request):
 
     fr.status = 'accepted'
     fr.save()
+    friend_graph.invalidate(user.id, fr.user_id)
 
     return JsonResponse({'ok': True})
 
@@ -337,6 +443,7 @@ def api_friends_remove(request):
     Friend.objects.filter(
         Q(user=user, friend_id=friend_id) | Q(user_id=friend_id, friend=user)
     ).delete()
+    invalidate_blocks(user.id, friend_id)
 
     return JsonResponse({'ok': True})
 
@@ -392,6 +499,7 @@ def api_block_user(request):
     ).delete()
 
     Friend.objects.create(user=user, friend=to_block, status='blocked')
+    invalidate_blocks(user.id, to_block.id)
 
     return JsonResponse({'ok': True})
 
@@ -415,6 +523,7 @@ def api_unblock_user(request):
         return JsonResponse({'ok': False, 'error': 'MISSING_USER_ID'}, status=400)
 
     Friend.objects.filter(user=user, friend_id=unblock_id, status='blocked').delete()
+    invalidate_blocks(user.id, unblock_id)
 
     return JsonResponse({'ok': True})
 
@@ -432,15 +541,4 @@ def api_users_search(request):
     if len(query) > 100:
         return JsonResponse({'ok': False, 'error': 'QUERY_TOO_LONG'}, status=400)
 
-    users = User.objects.filter(
-        username__icontains=query
-    ).exclude(id=request.user.id)[:20]
-
-    results = []
-    for u in users:
-        results.append({
-            'id': u.id,
-            'username': u.username,
-        })
-
-    return JsonResponse({'ok': True, 'users': results})
\ No newline at end of file
+    return JsonResponse({'ok': True, 'users': search_users(query, exclude_id=request.user.id)})
\ No newline at end of file
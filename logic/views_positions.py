@@ -1,41 +1,39 @@
 import json
-import os
-from functools import wraps
+import math
+import time
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST, require_GET
 from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django_ratelimit.decorators import ratelimit
 
-from .redis_positions import update_actor_position, get_nearby_actors
+from .redis_positions import (
+    GEO_MAX_LAT,
+    aupdate_actor_position,
+    aupdate_actor_positions,
+    aget_nearby_actors_cached,
+    get_actor_trails,
+    extrapolate_actor,
+    MAX_TRAIL_POINTS,
+)
 from .views_jwt import require_jwt
+from .utils.decorators import async_ratelimit, require_internal_secret
+from .utils.position_codec import wants_binary, binary_actors_response
+from .utils.map_feed import actor_to_map_item
+from .utils.aoi import publish_positions
 
-INTERNAL_API_SECRET = os.environ.get("INTERNAL_API_SECRET", "")
+MAX_BULK_ACTORS = 1000
+MAX_NEARBY_RESULTS = 1000
+MAX_NEARBY_RADIUS_KM = 50.0
+MAX_TRAIL_ACTORS = 100
+DEFAULT_TRAIL_WINDOW_SECONDS = 300
+# Trail stream IDs are unsigned 64-bit milliseconds.
+MAX_TRAIL_TIMESTAMP = 2 ** 63 / 1000
 
 
-def require_internal_secret(view_func):
-    """Require internal API secret for server-to-server calls."""
-    @wraps(view_func)
-    def wrapper(request, *args, **kwargs):
-        secret = request.headers.get('X-Internal-Secret', '')
-        if not INTERNAL_API_SECRET or secret != INTERNAL_API_SECRET:
-            return JsonResponse({"ok": False, "error": "FORBIDDEN"}, status=403)
-        return view_func(request, *args, **kwargs)
-    return wrapper
-
-
-@ratelimit(key='ip', rate='120/m', block=True)
-@require_POST
-@csrf_exempt
-@require_internal_secret
-def api_update_position(request):
-    """
-    Update actor position (internal API for bots).
-    Requires X-Internal-Secret header.
-    """
-    try:
-        data = json.loads(request.body.decode("utf-8"))
-    except json.JSONDecodeError:
-        return JsonResponse({"ok": False, "error": "invalid_json"}, status=400)
+def _parse_actor(data):
+    """Validate one actor payload. Returns (actor, None) or (None, error_code)."""
+    if not isinstance(data, dict):
+        return None, "invalid_item"
 
     actor_type = data.get("type")
     actor_id = data.get("id")
@@ -43,56 +41,167 @@ def api_update_position(request):
     lon = data.get("lon")
 
     if actor_type not in ("user", "bot"):
-        return JsonResponse({"ok": False, "error": "invalid_type"}, status=400)
+        return None, "invalid_type"
 
     if actor_id is None or lat is None or lon is None:
-        return JsonResponse({"ok": False, "error": "missing_fields"}, status=400)
+        return None, "missing_fields"
 
     try:
         lat = float(lat)
         lon = float(lon)
-    except ValueError:
-        return JsonResponse({"ok": False, "error": "invalid_lat_lon"}, status=400)
+    except (TypeError, ValueError):
+        return None, "invalid_lat_lon"
+
+    if not (-GEO_MAX_LAT <= lat <= GEO_MAX_LAT and -180.0 <= lon <= 180.0):
+        return None, "out_of_range"
 
     heading = data.get("heading")
     speed = data.get("speed")
     try:
         heading_val = float(heading) if heading is not None else None
-    except ValueError:
+    except (TypeError, ValueError):
         heading_val = None
     try:
         speed_val = float(speed) if speed is not None else None
-    except ValueError:
+    except (TypeError, ValueError):
         speed_val = None
 
-    update_actor_position(
-        actor_type=actor_type,
-        actor_id=actor_id,
-        lat=lat,
-        lon=lon,
-        heading=heading_val,
-        speed=speed_val,
+    return {
+        "type": actor_type,
+        "id": actor_id,
+        "lat": lat,
+        "lon": lon,
+        "heading": heading_val,
+        "speed": speed_val,
+    }, None
+
+
+def _load_bulk_items(request):
+    """Read a JSON array, {"actors": [...]} object or NDJSON body into a list."""
+    body = request.body.decode("utf-8")
+    content_type = request.content_type or ""
+
+    if content_type in ("application/x-ndjson", "application/ndjson"):
+        items = []
+        for line in body.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError:
+                items.append(None)
+        return items
+
+    data = json.loads(body)
+    if isinstance(data, dict):
+        data = data.get("actors")
+    if not isinstance(data, list):
+        raise ValueError("expected a list of actors")
+    return data
+
+
+@async_ratelimit(key='ip', rate='120/m')
+@require_POST
+@csrf_exempt
+@require_internal_secret
+async def api_update_position(request):
+    """
+    Update actor position (internal API for bots).
+    Requires X-Internal-Secret header.
+    """
+    try:
+        data = json.loads(request.body.decode("utf-8"))
+    except json.JSONDecodeError:
+        return JsonResponse({"ok": False, "error": "invalid_json"}, status=400)
+
+    actor, error = _parse_actor(data)
+    if error:
+        return JsonResponse({"ok": False, "error": error}, status=400)
+
+    await aupdate_actor_position(
+        actor_type=actor["type"],
+        actor_id=actor["id"],
+        lat=actor["lat"],
+        lon=actor["lon"],
+        heading=actor["heading"],
+        speed=actor["speed"],
     )
+    await publish_positions([actor_to_map_item(actor)])
 
     return JsonResponse({"ok": True})
 
 
-@ratelimit(key='ip', rate='60/m', block=True)
+@async_ratelimit(key='ip', rate='600/m')
+@require_POST
+@csrf_exempt
+@require_internal_secret
+async def api_update_positions_bulk(request):
+    """
+    Update many actor positions in one request (internal API for bots).
+    Body is a JSON array, {"actors": [...]} or NDJSON (application/x-ndjson).
+    Valid items are written in a single Redis round trip; invalid ones are
+    reported per index and skipped.
+    Requires X-Internal-Secret header.
+    """
+    try:
+        items = _load_bulk_items(request)
+    except (json.JSONDecodeError, UnicodeDecodeError, ValueError):
+        return JsonResponse({"ok": False, "error": "invalid_json"}, status=400)
+
+    if len(items) > MAX_BULK_ACTORS:
+        return JsonResponse(
+            {"ok": False, "error": "too_many_actors", "max_actors": MAX_BULK_ACTORS},
+            status=400,
+        )
+
+    actors = []
+    errors = []
+    for index, item in enumerate(items):
+        actor, error = _parse_actor(item)
+        if error:
+            errors.append({"index": index, "error": error})
+        else:
+            actors.append(actor)
+
+    written = await aupdate_actor_positions(actors)
+    await publish_positions([actor_to_map_item(a) for a in actors])
+
+    return JsonResponse(
+        {
+            "ok": True,
+            "written": written,
+            "errors": errors,
+        }
+    )
+
+
+@async_ratelimit(key='ip', rate='60/m')
 @require_GET
 @csrf_protect
 @require_jwt
-def api_nearby_positions(request):
-    """Get nearby positions. Requires authentication."""
+async def api_nearby_positions(request):
+    """
+    Get nearby positions. Requires authentication.
+    ?extrapolate=1 dead-reckons moving actors from their heading/speed.
+    ?format=bin returns the compact binary encoding from position_codec.
+    """
     try:
         lat = float(request.GET.get("lat"))
         lon = float(request.GET.get("lon"))
     except (TypeError, ValueError):
         return JsonResponse({"ok": False, "error": "invalid_lat_lon"}, status=400)
+    # Also rejects nan and inf.
+    if not (-GEO_MAX_LAT <= lat <= GEO_MAX_LAT and -180.0 <= lon <= 180.0):
+        return JsonResponse({"ok": False, "error": "out_of_range"}, status=400)
 
     try:
         radius_km = float(request.GET.get("radius_km", "1.0"))
     except ValueError:
         radius_km = 1.0
+    if not math.isfinite(radius_km) or radius_km <= 0:
+        radius_km = 1.0
+    radius_km = min(radius_km, MAX_NEARBY_RADIUS_KM)
 
     types_param = request.GET.get("types")
     include_types = None
@@ -106,8 +215,9 @@ def api_nearby_positions(request):
         max_results = int(max_results_param) if max_results_param else 200
     except ValueError:
         max_results = 200
+    max_results = max(1, min(max_results, MAX_NEARBY_RESULTS))
 
-    actors = get_nearby_actors(
+    actors = await aget_nearby_actors_cached(
         lat=lat,
         lon=lon,
         radius_km=radius_km,
@@ -115,6 +225,12 @@ def api_nearby_positions(request):
         include_types=include_types,
     )
 
+    if request.GET.get("extrapolate") in ("1", "true"):
+        actors = [extrapolate_actor(a) for a in actors]
+
+    if wants_binary(request):
+        return binary_actors_response(actors)
+
     return JsonResponse(
         {
             "ok": True,
@@ -122,3 +238,64 @@ def api_nearby_positions(request):
             "actors": actors,
         }
     )
+
+
+@ratelimit(key='ip', rate='60/m', block=True)
+@require_GET
+@csrf_protect
+@require_jwt
+def api_positions_trails(request):
+    """
+    Get recorded movement trails for many actors. Requires authentication.
+    ?actors=user:1,bot:7 (up to MAX_TRAIL_ACTORS)
+    ?since / ?until are unix seconds; since defaults to the last
+    DEFAULT_TRAIL_WINDOW_SECONDS. ?max_points caps points per actor.
+    """
+    actors_param = request.GET.get("actors", "")
+    actors = []
+    for member in actors_param.split(","):
+        member = member.strip()
+        if not member:
+            continue
+        actor_type, _, actor_id = member.partition(":")
+        if actor_type not in ("user", "bot") or not actor_id:
+            return JsonResponse({"ok": False, "error": "invalid_actor", "actor": member}, status=400)
+        actors.append((actor_type, actor_id))
+
+    if not actors:
+        return JsonResponse({"ok": False, "error": "missing_actors"}, status=400)
+
+    if len(actors) > MAX_TRAIL_ACTORS:
+        return JsonResponse(
+            {"ok": False, "error": "too_many_actors", "max_actors": MAX_TRAIL_ACTORS},
+            status=400,
+        )
+
+    try:
+        since = request.GET.get("since")
+        until = request.GET.get("until")
+        since_ts = float(since) if since else time.time() - DEFAULT_TRAIL_WINDOW_SECONDS
+        until_ts = float(until) if until else None
+        for ts in (since_ts, until_ts):
+            # Also rejects nan and inf.
+            if ts is not None and not 0 <= ts < MAX_TRAIL_TIMESTAMP:
+                raise ValueError(ts)
+    except ValueError:
+        return JsonResponse({"ok": False, "error": "invalid_time_range"}, status=400)
+
+    try:
+        max_points = int(request.GET.get("max_points", MAX_TRAIL_POINTS))
+    except ValueError:
+        max_points = MAX_TRAIL_POINTS
+    max_points = max(1, min(max_points, MAX_TRAIL_POINTS))
+
+    trails = get_actor_trails(actors, since_ts=since_ts, until_ts=until_ts, max_points=max_points)
+
+    return JsonResponse(
+        {
+            "ok": True,
+            "since": since_ts,
+            "until": until_ts,
+            "trails": trails,
+        }
+    )
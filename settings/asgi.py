@@ -27,6 +27,7 @@ CeleryInstrumentor().instrument()
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import logic.routing
+from logic.lifespan import lifespan_app
 
 application = ProtocolTypeRouter(
     {
@@ -36,6 +37,8 @@ application = ProtocolTypeRouter(
                 logic.routing.websocket_urlpatterns
             )
         ),
+        # Flushes the chat write-behind buffer on worker shutdown.
+        "lifespan": lifespan_app,
     }
 )
 
@@ -29,6 +29,15 @@ STATICFILES_DIRS = [
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
 REDIS_URL = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0')
+POSITIONS_PACKED_ENCODING = os.getenv('POSITIONS_PACKED_ENCODING', 'false').lower() == 'true'
+POSITIONS_DEAD_RECKONING = os.getenv('POSITIONS_DEAD_RECKONING', 'false').lower() == 'true'
+# Points kept per actor trail stream; 0 (the default) disables trails.
+# Enabled, every recorded position write also costs an XADD and an EXPIRE.
+POSITIONS_TRAIL_LENGTH = int(os.getenv('POSITIONS_TRAIL_LENGTH', '0'))
+# Geohash characters per regional geo index shard (0 keeps a single
+# geo:actors key). Shards need all geo keys on one Redis node, and sharded
+# writes cost one extra HGET round trip.
+POSITIONS_GEO_SHARD_PRECISION = int(os.getenv('POSITIONS_GEO_SHARD_PRECISION', '0'))
 
 RECAPTCHA_SECRET_KEY = os.getenv('RECAPTCHA_SECRET_KEY')
 
@@ -58,14 +67,32 @@ INSTALLED_APPS = [
 ]
 
 ASGI_APPLICATION = "settings.asgi.application"
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
-        "CONFIG": {
-            "hosts": [REDIS_URL],
+# "core" (RedisChannelLayer, list-backed queues) or "pubsub"
+# (RedisPubSubChannelLayer, no per-channel queues). Several comma-separated
+# CHANNEL_LAYER_HOSTS shard channels and groups across Redis instances.
+CHANNEL_LAYER_BACKEND = os.getenv('CHANNEL_LAYER_BACKEND', 'core')
+CHANNEL_LAYER_HOSTS = [h for h in os.getenv('CHANNEL_LAYER_HOSTS', REDIS_URL).split(',') if h]
+
+if CHANNEL_LAYER_BACKEND == 'pubsub':
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
+            "CONFIG": {
+                "hosts": CHANNEL_LAYER_HOSTS,
+            },
         },
-    },
-}
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": CHANNEL_LAYER_HOSTS,
+                "capacity": int(os.getenv('CHANNEL_LAYER_CAPACITY', '100')),
+                "expiry": int(os.getenv('CHANNEL_LAYER_EXPIRY', '60')),
+            },
+        },
+    }
 
 CACHES = {
     "default": {
@@ -135,6 +162,16 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+CELERY_BEAT_SCHEDULE = {
+    'prune-stale-actors': {
+        'task': 'logic.tasks.prune_stale_actors_task',
+        'schedule': 60.0,
+    },
+    'prune-presence': {
+        'task': 'logic.tasks.prune_presence_task',
+        'schedule': 60.0,
+    },
+}
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
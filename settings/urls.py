@@ -10,6 +10,7 @@ from logic import views_payment
 from logic import views_messages
 from logic import views_user
 from logic import views_jwt
+from logic import views_positions
 
 
 urlpatterns = [
@@ -32,6 +33,8 @@ urlpatterns = [
 
     path('api/map/position/', views.map_position, name='map_position'),
     path('api/map/positions/', views.map_positions, name='map_positions'),
+    path('api/internal/positions/bulk/', views_positions.api_update_positions_bulk, name='api_update_positions_bulk'),
+    path('api/positions/trails/', views_positions.api_positions_trails, name='api_positions_trails'),
 
     path('api/auth/login/', views_auth.api_login, name='api_login'),
     path('api/auth/logout/', views_auth.api_logout, name='api_logout'),
@@ -80,12 +83,14 @@ urlpatterns = [
     path('api/friends/add/', views_messages.api_friends_add, name='api_friends_add'),
     path('api/friends/accept/', views_messages.api_friends_accept, name='api_friends_accept'),
     path('api/friends/remove/', views_messages.api_friends_remove, name='api_friends_remove'),
+    path('api/friends/status/', views_messages.api_relationships, name='api_relationships'),
 
     path('api/blocked/', views_messages.api_blocked_list, name='api_blocked_list'),
     path('api/block/', views_messages.api_block_user, name='api_block_user'),
     path('api/unblock/', views_messages.api_unblock_user, name='api_unblock_user'),
 
     path('api/users/search/', views_messages.api_users_search, name='api_users_search'),
+    path('api/presence/', views_messages.api_presence, name='api_presence'),
 ]
 
 if settings.DEBUG:
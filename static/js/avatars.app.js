@@ -79,6 +79,27 @@
     };
   }
 
+  function getViewBbox() {
+    const viewer = getViewer();
+    if (!viewer || typeof Cesium === "undefined") return null;
+
+    const rect = viewer.camera.computeViewRectangle(viewer.scene.globe.ellipsoid);
+    if (!rect) return null;
+
+    return [
+      Cesium.Math.toDegrees(rect.west),
+      Cesium.Math.toDegrees(rect.south),
+      Cesium.Math.toDegrees(rect.east),
+      Cesium.Math.toDegrees(rect.north),
+    ].map((v) => v.toFixed(5)).join(",");
+  }
+
+  function getApproxZoom() {
+    const pos = getCameraLatLon();
+    if (!pos || !Number.isFinite(pos.alt) || pos.alt <= 0) return null;
+    return Math.max(0, Math.min(22, Math.floor(Math.log2(40075016 / pos.alt))));
+  }
+
   function distanceMeters(lat1, lon1, lat2, lon2) {
     const R = 6371000;
     const phi1 = lat1 * Math.PI / 180;
@@ -106,6 +127,12 @@
     }
     lastSentTs = now;
 
+    const ws = positionStream.ws;
+    if (ws && ws.readyState === WebSocket.OPEN) {
+      ws.send(JSON.stringify({ type: "position.update", lat, lon, alt }));
+      return;
+    }
+
     try {
       const csrf = getCookie("csrftoken");
       await fetch("/api/map/position/", {
@@ -191,6 +218,7 @@
       myAvatarEntity.__avatarAlt = markerHeight2;
 
       sendPositionToServer(p.lat, p.lon, p.alt);
+      sendStreamView(false);
     }
 
     viewer.camera.moveEnd.addEventListener(updateFromCamera);
@@ -881,7 +909,7 @@ chatBtn.addEventListener("click", () => {
     console.log("[avatars] click handler bound");
   }
 
-  async function refreshOtherAvatars() {
+  function applyAvatarList(list) {
     const viewer = getViewer();
     if (!viewer || typeof Cesium === "undefined") return;
 
@@ -891,156 +919,256 @@ chatBtn.addEventListener("click", () => {
         ? performance.now()
         : Date.now();
 
-    try {
-      const res = await fetch("/api/map/positions/", {
-        method: "GET",
-        credentials: "same-origin",
-        headers: { Accept: "application/json" },
-      });
-
-      if (!res.ok) {
-        return;
+    const seenIds = new Set();
+
+    for (const item of list) {
+      if (!item || item.id == null) continue;
+
+      const idStr = String(item.id);
+      const lat = Number(item.lat);
+      const lon = Number(item.lon);
+      const alt = Number(item.alt);
+      const opRaw = item.op ?? null;
+      const opKey = normalizeOp(opRaw);
+      const isCluster = item.type === "cluster";
+
+      if (!Number.isFinite(lat) || !Number.isFinite(lon)) continue;
+
+      if (
+        !isCluster &&
+        camPos &&
+        Number.isFinite(camPos.lat) &&
+        Number.isFinite(camPos.lon)
+      ) {
+        const dist = distanceMeters(camPos.lat, camPos.lon, lat, lon);
+        if (dist > MAX_AVATAR_DISTANCE_METERS) {
+          continue;
+        }
       }
 
-      const list = await res.json().catch(() => []);
-      if (!Array.isArray(list)) return;
+      seenIds.add(idStr);
 
-      const seenIds = new Set();
+      const markerHeight = Number.isFinite(alt) ? alt : 150;
 
-      for (const item of list) {
-        if (!item || item.id == null) continue;
+      if (otherAvatars[idStr]) {
+        const rec = otherAvatars[idStr];
+        const ent = rec.entity;
 
-        const idStr = String(item.id);
-        const lat = Number(item.lat);
-        const lon = Number(item.lon);
-        const alt = Number(item.alt);
-        const opRaw = item.op ?? null;
-        const opKey = normalizeOp(opRaw);
+        if (isCluster && item.name && ent.__avatarBaseLabel !== item.name) {
+          ent.__avatarName      = item.name;
+          ent.__avatarBaseLabel = item.name;
+          if (ent.label) ent.label.text = item.name;
+        }
 
-        if (!Number.isFinite(lat) || !Number.isFinite(lon)) continue;
+        const prevOpKey = ent.__avatarOpKey || null;
 
-        if (
-          camPos &&
-          Number.isFinite(camPos.lat) &&
-          Number.isFinite(camPos.lon)
-        ) {
-          const dist = distanceMeters(camPos.lat, camPos.lon, lat, lon);
-          if (dist > MAX_AVATAR_DISTANCE_METERS) {
-            continue;
-          }
+        if (opKey && opKey !== prevOpKey) {
+          ent.__avatarOpKey     = opKey;
+          ent.__avatarOpStartMs = now;
         }
 
-        seenIds.add(idStr);
+        if (opKey) {
+          ent.__avatarOp = opKey;
+        }
 
-        const markerHeight = Number.isFinite(alt) ? alt : 150;
+        const prevToLat = Number.isFinite(rec.toLat) ? rec.toLat : lat;
+        const prevToLon = Number.isFinite(rec.toLon) ? rec.toLon : lon;
+        const prevToAlt = Number.isFinite(rec.toAlt) ? rec.toAlt : markerHeight;
 
-        if (otherAvatars[idStr]) {
-          const rec = otherAvatars[idStr];
-          const ent = rec.entity;
+        rec.fromLat = prevToLat;
+        rec.fromLon = prevToLon;
+        rec.fromAlt = prevToAlt;
 
-          const prevOpKey = ent.__avatarOpKey || null;
+        rec.toLat = lat;
+        rec.toLon = lon;
+        rec.toAlt = markerHeight;
 
-          if (opKey && opKey !== prevOpKey) {
-            ent.__avatarOpKey     = opKey;
-            ent.__avatarOpStartMs = now;
-          }
+        rec.startMs = now;
+        rec.endMs   = now + INTERP_DURATION_MS;
+        continue;
+      }
 
-          if (opKey) {
-            ent.__avatarOp = opKey;
-          }
 
-          const prevToLat = Number.isFinite(rec.toLat) ? rec.toLat : lat;
-          const prevToLon = Number.isFinite(rec.toLon) ? rec.toLon : lon;
-          const prevToAlt = Number.isFinite(rec.toAlt) ? rec.toAlt : markerHeight;
+      const labelText = item.name || `User ${idStr}`;
 
-          rec.fromLat = prevToLat;
-          rec.fromLon = prevToLon;
-          rec.fromAlt = prevToAlt;
+      const baseColorCss = isCluster ? "#a855f7" : (OP_COLORS[opKey] || "#3b82f6");
+      const baseScale    = isCluster
+        ? Math.min(3.0, 1.0 + Math.log10(Math.max(1, Number(item.count) || 1)))
+        : (OP_SCALES[opKey] || 1.0);
 
-          rec.toLat = lat;
-          rec.toLon = lon;
-          rec.toAlt = markerHeight;
+      const pixelSize    = 8 * baseScale;
 
-          rec.startMs = now;
-          rec.endMs   = now + INTERP_DURATION_MS;
-          continue;
-        }
+      const ent = viewer.entities.add({
+        position: Cesium.Cartesian3.fromDegrees(lon, lat, markerHeight),
 
+        point: {
+          pixelSize: pixelSize,
+          color: Cesium.Color.fromCssColorString(baseColorCss),
+          outlineColor: Cesium.Color.BLACK,
+          outlineWidth: 2,
+          disableDepthTestDistance: Number.POSITIVE_INFINITY,
+        },
 
-        const labelText = item.name || `User ${idStr}`;
+        label: {
+          text: labelText,
+          font: '13px "Segoe UI", sans-serif',
+          fillColor: Cesium.Color.WHITE,
+          outlineColor: Cesium.Color.BLACK,
+          outlineWidth: 2,
+          style: Cesium.LabelStyle.FILL_AND_OUTLINE,
+          verticalOrigin: Cesium.VerticalOrigin.BOTTOM,
+          pixelOffset: new Cesium.Cartesian2(0, -12),
+          showBackground: true,
+          backgroundColor: new Cesium.Color(0.05, 0.05, 0.08, 0.9),
+          disableDepthTestDistance: Number.POSITIVE_INFINITY,
+        },
+      });
 
-        const baseColorCss = OP_COLORS[opKey] || "#3b82f6";
-        const baseScale    = OP_SCALES[opKey] || 1.0;
+      if (!isCluster) {
+        ent.__avatarUserId   = idStr;
+      }
+      ent.__avatarCluster    = isCluster;
+      ent.__avatarName       = labelText;
+      ent.__avatarBaseLabel  = labelText;
+      ent.__avatarLat        = lat;
+      ent.__avatarLon        = lon;
+      ent.__avatarAlt        = markerHeight;
+      ent.__avatarOp         = opKey;
+      ent.__avatarOpKey      = opKey;
+      ent.__avatarOpStartMs  = opKey ? now : 0;
+
+
+      otherAvatars[idStr] = {
+        entity:  ent,
+        fromLat: lat,
+        fromLon: lon,
+        fromAlt: markerHeight,
+        toLat:   lat,
+        toLon:   lon,
+        toAlt:   markerHeight,
+        startMs: now,
+        endMs:   now,
+      };
 
-        const pixelSize    = 8 * baseScale;
+          }
 
-        const ent = viewer.entities.add({
-          position: Cesium.Cartesian3.fromDegrees(lon, lat, markerHeight),
+    for (const idStr in otherAvatars) {
+      if (!seenIds.has(idStr)) {
+        const rec = otherAvatars[idStr];
+        if (rec && rec.entity) {
+          try {
+            viewer.entities.remove(rec.entity);
+          } catch (e) {}
+        }
+        delete otherAvatars[idStr];
+      }
+    }
+  }
 
-          point: {
-            pixelSize: pixelSize,
-            color: Cesium.Color.fromCssColorString(baseColorCss),
-            outlineColor: Cesium.Color.BLACK,
-            outlineWidth: 2,
-            disableDepthTestDistance: Number.POSITIVE_INFINITY,
-          },
+  async function refreshOtherAvatars() {
+    const viewer = getViewer();
+    if (!viewer || typeof Cesium === "undefined") return;
 
-          label: {
-            text: labelText,
-            font: '13px "Segoe UI", sans-serif',
-            fillColor: Cesium.Color.WHITE,
-            outlineColor: Cesium.Color.BLACK,
-            outlineWidth: 2,
-            style: Cesium.LabelStyle.FILL_AND_OUTLINE,
-            verticalOrigin: Cesium.VerticalOrigin.BOTTOM,
-            pixelOffset: new Cesium.Cartesian2(0, -12),
-            showBackground: true,
-            backgroundColor: new Cesium.Color(0.05, 0.05, 0.08, 0.9),
-            disableDepthTestDistance: Number.POSITIVE_INFINITY,
-          },
-        });
+    const params = new URLSearchParams();
+    const bbox = getViewBbox();
+    if (bbox) params.set("bbox", bbox);
+    const zoom = getApproxZoom();
+    if (zoom != null) params.set("zoom", String(zoom));
+    const qs = params.toString();
+    const url = qs ? `/api/map/positions/?${qs}` : "/api/map/positions/";
 
-        ent.__avatarUserId     = idStr;
-        ent.__avatarName       = labelText;
-        ent.__avatarBaseLabel  = labelText;
-        ent.__avatarLat        = lat;
-        ent.__avatarLon        = lon;
-        ent.__avatarAlt        = markerHeight;
-        ent.__avatarOp         = opKey;
-        ent.__avatarOpKey      = opKey;
-        ent.__avatarOpStartMs  = opKey ? now : 0;
-
-
-        otherAvatars[idStr] = {
-          entity:  ent,
-          fromLat: lat,
-          fromLon: lon,
-          fromAlt: markerHeight,
-          toLat:   lat,
-          toLon:   lon,
-          toAlt:   markerHeight,
-          startMs: now,
-          endMs:   now,
-        };
-
-            }
-
-      for (const idStr in otherAvatars) {
-        if (!seenIds.has(idStr)) {
-          const rec = otherAvatars[idStr];
-          if (rec && rec.entity) {
-            try {
-              viewer.entities.remove(rec.entity);
-            } catch (e) {}
-          }
-          delete otherAvatars[idStr];
-        }
+    try {
+      const res = await fetch(url, {
+        method: "GET",
+        credentials: "same-origin",
+        headers: { Accept: "application/json" },
+      });
+
+      if (!res.ok) {
+        return;
       }
+
+      const list = await res.json().catch(() => []);
+      if (!Array.isArray(list)) return;
+
+      applyAvatarList(list);
     } catch (e) {
       console.warn("[avatars] refreshOtherAvatars error", e);
     }
   }
 
+  const positionStream = {
+    ws: null,
+    connected: false,
+    reconnectTimer: null,
+    items: {},
+    lastViewKey: null,
+  };
+
+  function sendStreamView(force) {
+    const ws = positionStream.ws;
+    if (!ws || ws.readyState !== WebSocket.OPEN) return;
+
+    const msg = { type: "view.set", bbox: getViewBbox(), zoom: getApproxZoom() };
+    const key = `${msg.bbox}|${msg.zoom}`;
+    if (!force && key === positionStream.lastViewKey) return;
+
+    positionStream.lastViewKey = key;
+    ws.send(JSON.stringify(msg));
+  }
+
+  function applyPositionDelta(data) {
+    const items = positionStream.items;
+    for (const item of data.added || []) items[String(item.id)] = item;
+    for (const item of data.changed || []) items[String(item.id)] = item;
+    for (const id of data.removed || []) delete items[String(id)];
+    applyAvatarList(Object.values(items));
+  }
+
+  function connectPositionStream() {
+    if (positionStream.ws && positionStream.ws.readyState === WebSocket.OPEN) return;
+
+    const protocol = window.location.protocol === "https:" ? "wss:" : "ws:";
+    const wsUrl = `${protocol}//${window.location.host}/ws/positions/`;
+
+    try {
+      const ws = new WebSocket(wsUrl);
+      positionStream.ws = ws;
+
+      ws.onopen = () => {
+        positionStream.connected = true;
+        positionStream.items = {};
+        positionStream.lastViewKey = null;
+        sendStreamView(true);
+      };
+
+      ws.onmessage = (event) => {
+        try {
+          const data = JSON.parse(event.data);
+          if (data.type === "positions.delta") applyPositionDelta(data);
+        } catch (e) {
+          console.warn("[avatars] position stream parse error", e);
+        }
+      };
+
+      ws.onclose = () => {
+        positionStream.connected = false;
+        if (!positionStream.reconnectTimer) {
+          positionStream.reconnectTimer = setTimeout(() => {
+            positionStream.reconnectTimer = null;
+            connectPositionStream();
+          }, 3000);
+        }
+      };
+
+      ws.onerror = (err) => {
+        console.warn("[avatars] position stream error", err);
+      };
+    } catch (e) {
+      console.warn("[avatars] position stream connection failed", e);
+    }
+  }
+
   function updateInterpolatedAvatarPositions() {
     const viewer = getViewer();
     if (!viewer || typeof Cesium === "undefined") return;
@@ -1159,7 +1287,11 @@ chatBtn.addEventListener("click", () => {
 
       if (!lastRefreshMs || now - lastRefreshMs >= 3000) {
         lastRefreshMs = now;
-        refreshOtherAvatars();
+        if (positionStream.connected) {
+          sendStreamView(false);
+        } else {
+          refreshOtherAvatars();
+        }
       }
 
       requestAnimationFrame(step);
@@ -1172,6 +1304,7 @@ chatBtn.addEventListener("click", () => {
     initMyAvatar();
     startOwnPositionHeartbeat();
     setupAvatarClickHandler();
+    connectPositionStream();
     startAvatarAnimationLoop();
   }
   function ensureAvatarChatPanel() {
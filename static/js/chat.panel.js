@@ -10,9 +10,17 @@
     pendingRequests: [],
     blocked: [],
     messages: [],
+    historyHasMore: false,
+    loadingOlder: false,
     ws: null,
     wsConnected: false,
     wsReconnectTimer: null,
+    wsEverConnected: false,
+    markReadTimer: null,
+    lastSeq: null,
+    syncing: false,
+    deliveredTimer: null,
+    nextRef: 1,
   };
 
   const csrf = () => window.getCookie ? window.getCookie('csrftoken') : '';
@@ -58,6 +66,12 @@
           clearTimeout(state.wsReconnectTimer);
           state.wsReconnectTimer = null;
         }
+        // Thread/unread events are pushed from now on; after a reconnect,
+        // catch up on whatever was missed while the socket was down.
+        if (state.wsEverConnected) {
+          syncUnreadCount();
+        }
+        state.wsEverConnected = true;
       };
 
       state.ws.onmessage = (event) => {
@@ -72,6 +86,7 @@
       state.ws.onclose = () => {
         console.log('[ChatPanel] WebSocket closed');
         state.wsConnected = false;
+        state.syncing = false;
         if (!state.wsReconnectTimer) {
           state.wsReconnectTimer = setTimeout(() => {
             state.wsReconnectTimer = null;
@@ -105,10 +120,45 @@
 
     if (type === 'connection.ack') {
       console.log('[ChatPanel] WS authenticated as user:', data.user_id);
+      if (state.lastSeq === null || data.seq === null || data.seq === undefined) {
+        state.lastSeq = data.seq === undefined ? null : data.seq;
+      } else if (data.seq !== state.lastSeq) {
+        requestSync();
+      }
+      return;
+    }
+
+    if (type === 'sync') {
+      state.syncing = false;
+      if (data.complete) {
+        for (const event of data.events || []) {
+          handleWsMessage(event);
+        }
+      } else {
+        // Too much was missed to replay; reload instead.
+        state.lastSeq = data.seq;
+        syncUnreadCount().then(refreshThreadList);
+        if (state.selectedUserId) {
+          loadMessages(state.selectedUserId).then(renderPanel);
+        }
+      }
+      scheduleDelivered();
       return;
     }
 
     if (type === 'message.new') {
+      if (typeof data.seq === 'number' && state.lastSeq !== null) {
+        if (data.seq <= state.lastSeq) return;  // already seen
+        if (data.seq > state.lastSeq + 1) {
+          // Missed something; the sync reply includes this message too.
+          requestSync();
+          return;
+        }
+      }
+      if (typeof data.seq === 'number') {
+        state.lastSeq = data.seq;
+        scheduleDelivered();
+      }
       const msg = data.message;
       if (state.selectedUserId &&
           (String(msg.sender_id) === String(state.selectedUserId) ||
@@ -126,39 +176,126 @@
           const msgList = document.getElementById('messageList');
           if (msgList) msgList.scrollTop = msgList.scrollHeight;
         }, 50);
-      } else {
-        loadThreads().then(() => {
-          if (state.activeTab === 'chats' && !state.selectedUserId) {
-            renderPanel();
-          }
-        });
       }
       return;
     }
 
+    if (type === 'message.ack') {
+      // Our own message was saved; give the optimistic copy its real id.
+      const pending = state.messages.find(m => m.ref === data.ref);
+      if (pending) {
+        pending.id = data.message.id;
+        pending.time = data.message.time;
+        delete pending.ref;
+      }
+      return;
+    }
+
+    if (type === 'thread.updated') {
+      const update = data.thread;
+      if (update.unread === null) {
+        // Server-side counter was cold; fetch the real counts once.
+        syncUnreadCount().then(refreshThreadList);
+        return;
+      }
+      const idx = state.threads.findIndex(t => String(t.user_id) === String(update.user_id));
+      const thread = idx >= 0 ? state.threads.splice(idx, 1)[0] : { unread: 0 };
+      Object.assign(thread, update);
+      state.threads.unshift(thread);
+      updateMenuBadge();
+      if (update.unread > 0 && isPanelVisible() &&
+          String(update.user_id) === String(state.selectedUserId)) {
+        scheduleMarkRead(update.user_id);
+      }
+      refreshThreadList();
+      return;
+    }
+
+    if (type === 'unread.changed') {
+      const thread = state.threads.find(t => String(t.user_id) === String(data.user_id));
+      if (thread) {
+        thread.unread = data.unread;
+      }
+      updateMenuBadge();
+      refreshThreadList();
+      return;
+    }
+
     if (type === 'message.error') {
       console.warn('[ChatPanel] Message error:', data.error);
+      if (data.error === 'SYNC_FAILED') {
+        // Catch-up is unavailable; reload what the user can see instead.
+        state.syncing = false;
+        syncUnreadCount().then(refreshThreadList);
+        if (state.selectedUserId) {
+          loadMessages(state.selectedUserId).then(renderPanel);
+        }
+        return;
+      }
+      if (data.ref) {
+        // Drop the optimistic copy of a message that was not sent.
+        const idx = state.messages.findIndex(m => m.ref === data.ref);
+        if (idx >= 0) {
+          state.messages.splice(idx, 1);
+          renderPanel();
+        }
+      }
       showError(getErrorMessage(data.error));
       return;
     }
 
+    if (type === 'presence') {
+      let changed = false;
+      for (const item of [...state.friends, ...state.threads]) {
+        const id = item.user_id !== undefined ? item.user_id : item.id;
+        if (String(id) === String(data.user_id) && item.online !== data.online) {
+          item.online = data.online;
+          changed = true;
+        }
+      }
+      if (changed && !state.selectedUserId) {
+        renderPanel();
+      }
+      return;
+    }
+
     if (type === 'pong') {
       return;
     }
   }
 
+  function requestSync() {
+    if (state.syncing || state.lastSeq === null) return;
+    if (!state.ws || state.ws.readyState !== WebSocket.OPEN) return;
+    state.syncing = true;
+    state.ws.send(JSON.stringify({ type: 'sync', since: state.lastSeq }));
+  }
+
+  function scheduleDelivered() {
+    if (state.deliveredTimer) return;
+    state.deliveredTimer = setTimeout(() => {
+      state.deliveredTimer = null;
+      if (state.lastSeq !== null && state.ws && state.ws.readyState === WebSocket.OPEN) {
+        state.ws.send(JSON.stringify({ type: 'delivered', seq: state.lastSeq }));
+      }
+    }, 1000);
+  }
+
   function sendWsMessage(toUserId, text) {
     if (!state.ws || state.ws.readyState !== WebSocket.OPEN) {
       console.warn('[ChatPanel] WebSocket not connected, falling back to HTTP');
-      return false;
+      return null;
     }
 
+    // Echoed back in message.ack / message.error.
+    const ref = String(state.nextRef++);
     state.ws.send(JSON.stringify({
       type: 'message.send',
       to: toUserId,
-      text: text
+      text: text,
+      ref: ref
     }));
-    return true;
+    return ref;
   }
 
   setInterval(() => {
@@ -221,7 +358,7 @@
         const hasUnread = t.unread && t.unread > 0;
         html += `
           <div class="chat-item ${hasUnread ? 'has-unread' : ''}" data-user-id="${t.user_id}" data-username="${t.username}">
-            <div class="chat-item-name">${escHtml(t.username)}</div>
+            <div class="chat-item-name">${t.online ? '<span class="online-dot" title="Online" style="display:inline-block;width:8px;height:8px;border-radius:50%;background:#22c55e;margin-right:6px;"></span>' : ''}${escHtml(t.username)}</div>
             <div class="chat-item-preview">${escHtml(t.last_message || '')}</div>
             <span class="unread-dot"></span>
           </div>
@@ -303,7 +440,7 @@
       for (const f of state.friends) {
         html += `
           <div class="chat-item friend-item" style="display:flex;justify-content:space-between;align-items:center;padding:10px;background:var(--glass-light);border-radius:8px;margin-bottom:6px;">
-            <span style="font-weight:600;">${escHtml(f.username)}</span>
+            <span style="font-weight:600;">${f.online ? '<span class="online-dot" title="Online" style="display:inline-block;width:8px;height:8px;border-radius:50%;background:#22c55e;margin-right:6px;"></span>' : ''}${escHtml(f.username)}</span>
             <div class="chat-item-actions" style="display:flex;gap:6px;">
               <button class="chat-btn message" data-message="${f.id}" data-name="${escHtml(f.username)}" style="background:var(--accent);color:#fff;border:none;padding:6px 12px;border-radius:6px;cursor:pointer;">Message</button>
               <button class="chat-btn remove" data-remove-friend="${f.id}" style="background:#ef4444;color:#fff;border:none;padding:6px 10px;border-radius:6px;cursor:pointer;">X</button>
@@ -426,6 +563,9 @@
     const msgList = document.getElementById('messageList');
     if (msgList) {
       msgList.scrollTop = msgList.scrollHeight;
+      msgList.onscroll = () => {
+        if (msgList.scrollTop < 40) loadOlderMessages();
+      };
     }
   }
 
@@ -451,7 +591,35 @@
     }
   }
 
+  function isPanelVisible() {
+    const panel = document.getElementById('chatPanel');
+    return !!panel && panel.style.display !== 'none';
+  }
+
+  function refreshThreadList() {
+    if (state.activeTab === 'chats' && !state.selectedUserId && isPanelVisible()) {
+      renderPanel();
+    }
+  }
+
+  function scheduleMarkRead(userId) {
+    // Batch reads of an open conversation into one request.
+    if (state.markReadTimer) return;
+    state.markReadTimer = setTimeout(() => {
+      state.markReadTimer = null;
+      if (String(userId) === String(state.selectedUserId)) {
+        markAsRead(userId);
+      }
+    }, 2000);
+  }
+
   async function pollUnreadCount() {
+    // While the WebSocket is up, unread counts are pushed instead.
+    if (state.wsConnected) return;
+    await syncUnreadCount();
+  }
+
+  async function syncUnreadCount() {
     if (!window.currentUserId) return;
 
     try {
@@ -465,7 +633,7 @@
   }
 
   function startUnreadPolling() {
-    pollUnreadCount();
+    syncUnreadCount();
 
     if (unreadPollTimer) clearInterval(unreadPollTimer);
     unreadPollTimer = setInterval(pollUnreadCount, 30000);
@@ -524,9 +692,33 @@
   }
 
   async function loadMessages(userId) {
-    const res = await api(`/api/chat/history/${userId}/`);
+    const res = await api(`/api/chat/history/${userId}/?count=0`);
     if (res.ok) {
       state.messages = res.messages || [];
+      state.historyHasMore = !!res.has_more;
+    }
+  }
+
+  async function loadOlderMessages() {
+    const oldest = state.messages.find(m => m.id);
+    if (!state.historyHasMore || state.loadingOlder || !oldest || !state.selectedUserId) return;
+
+    state.loadingOlder = true;
+    const userId = state.selectedUserId;
+    try {
+      const res = await api(`/api/chat/history/${userId}/?before=${oldest.id}`);
+      if (res.ok && String(userId) === String(state.selectedUserId)) {
+        state.messages = (res.messages || []).concat(state.messages);
+        state.historyHasMore = !!res.has_more;
+
+        const msgList = document.getElementById('messageList');
+        const fromBottom = msgList ? msgList.scrollHeight - msgList.scrollTop : 0;
+        renderPanel();
+        const newList = document.getElementById('messageList');
+        if (newList) newList.scrollTop = newList.scrollHeight - fromBottom;
+      }
+    } finally {
+      state.loadingOlder = false;
     }
   }
 
@@ -544,7 +736,9 @@
   async function markAsRead(userId) {
     try {
       await api(`/api/chat/read/${userId}/`, 'POST');
-      await loadThreads();
+      if (!state.wsConnected) {
+        await loadThreads();
+      }
     } catch (e) {
     }
   }
@@ -553,10 +747,11 @@
     text = (text || '').trim();
     if (!text || !state.selectedUserId) return;
 
-    const wsSent = sendWsMessage(state.selectedUserId, text);
+    const wsRef = sendWsMessage(state.selectedUserId, text);
 
-    if (wsSent) {
+    if (wsRef) {
       state.messages.push({
+        ref: wsRef,
         content: text,
         time: new Date().toISOString(),
         mine: true
@@ -572,8 +767,9 @@
 
       if (res.ok) {
         state.messages.push({
+          id: res.message.id,
           content: text,
-          time: new Date().toISOString(),
+          time: res.message.time,
           mine: true
         });
         renderPanel();
@@ -738,6 +934,8 @@
   const ERROR_MESSAGES = {
     'MISSING_RECEIVER': 'Receiver not specified',
     'EMPTY_MESSAGE': 'Message cannot be empty',
+    'MESSAGE_TOO_LONG': 'Message is too long',
+    'SEND_FAILED': 'Message could not be sent, please try again',
     'USER_NOT_FOUND': 'User not found',
     'CANNOT_MESSAGE_SELF': 'Cannot message yourself',
     'BLOCKED': 'You are blocked by this user',